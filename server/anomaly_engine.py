@@ -0,0 +1,302 @@
+"""
+Streaming rule-based anomaly detection for ECG readings.
+
+Each patient has a small incremental state: fixed-size rolling windows with
+running sum / sum of squares, and per-rule counters. Every rule is O(1) per
+reading, and a reading can trigger any number of rules. evaluate_batch()
+applies the same rules to a whole batch with NumPy: readings are grouped
+into per-patient segments and each rule makes one vectorized pass over all
+segments at once. The resulting state is exactly what streaming the batch
+one reading at a time would leave.
+
+State is kept for the `max_patients` most recently seen patients; a patient
+evicted from that LRU starts again with empty windows.
+"""
+
+import math
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+
+FIELDS = ("heart_rate", "rr_interval", "temperature", "qrs_duration", "heart_rate_variability", "st_segment")
+
+
+class RollingWindow:
+    __slots__ = ("size", "values", "index", "count", "total", "total_sq")
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def push(self, value):
+        if self.count == self.size:
+            old = self.values[self.index]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.total += value
+        self.total_sq += value * value
+        self.index = (self.index + 1) % self.size
+
+    def ordered(self):
+        """Current contents, oldest first."""
+        if self.count < self.size:
+            return self.values[:self.count]
+        return self.values[self.index:] + self.values[:self.index]
+
+    def load(self, values):
+        """Replace contents with the last `size` of values (oldest first)."""
+        values = [float(v) for v in values[-self.size:]]
+        self.count = len(values)
+        self.values = values + [0.0] * (self.size - self.count)
+        self.index = self.count % self.size
+        self.total = math.fsum(values)
+        self.total_sq = math.fsum(v * v for v in values)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.total / self.count
+        return math.sqrt(max(0.0, self.total_sq / self.count - mean * mean))
+
+
+class PatientState:
+    __slots__ = ("windows", "counters", "readings")
+
+    def __init__(self, window_specs):
+        self.windows = {spec: RollingWindow(spec[1]) for spec in window_specs}
+        self.counters = {}
+        self.readings = 0
+
+
+class Segments:
+    """A batch sorted by patient: segment k covers positions starts[k]:starts[k] + lengths[k]."""
+
+    def __init__(self, states, starts, lengths):
+        self.states = states
+        self.starts = starts
+        self.lengths = lengths
+        self.ids = np.repeat(np.arange(len(starts)), lengths)
+        # Position of each reading within its own patient's segment
+        self.local = np.arange(int(lengths.sum())) - np.repeat(starts, lengths)
+
+
+class Rule(ABC):
+    """Base rule. check() sees state before the reading is added to the windows."""
+
+    name = "Anomaly"
+    windows = ()
+    # Temporal rules read or update the patient's history, so they only see readings in order
+    temporal = False
+
+    @abstractmethod
+    def check(self, state, reading):
+        """True if the rule fires for this reading."""
+
+    @abstractmethod
+    def check_bulk(self, segments, columns):
+        """Boolean array over a patient-sorted batch (see Segments), arrival order within each patient."""
+
+
+class ThresholdRule(Rule):
+    def __init__(self, name, field, low=None, high=None):
+        self.name = name
+        self.field = field
+        self.low = low
+        self.high = high
+
+    def check(self, state, reading):
+        value = reading[self.field]
+        return (self.low is not None and value < self.low) or (self.high is not None and value > self.high)
+
+    def check_bulk(self, segments, columns):
+        values = columns[self.field]
+        mask = np.zeros(len(values), dtype=bool)
+        if self.low is not None:
+            mask |= values < self.low
+        if self.high is not None:
+            mask |= values > self.high
+        return mask
+
+
+class SustainedRule(ThresholdRule):
+    """Fires once the threshold has been breached on `count` consecutive readings."""
+
+    temporal = True
+
+    def __init__(self, name, field, count, low=None, high=None):
+        super().__init__(name, field, low, high)
+        self.count = count
+
+    def check(self, state, reading):
+        run = state.counters.get(self, 0) + 1 if super().check(state, reading) else 0
+        state.counters[self] = run
+        return run >= self.count
+
+    def check_bulk(self, segments, columns):
+        breached = super().check_bulk(segments, columns)
+        carry = np.array([state.counters.get(self, 0) for state in segments.states], dtype=np.int64)
+        # Run length = distance from the last non-breach in the same segment. A segment
+        # with no reset yet counts from a virtual reset `carry` readings before it starts.
+        # Offsetting each segment by a large step keeps the running max from leaking across.
+        step = int(segments.lengths.max() + carry.max()) + 2
+        offset = segments.ids * step
+        resets = np.where(breached, -1 - carry[segments.ids], segments.local) + offset
+        last_reset = np.maximum.accumulate(resets) - offset
+        run = np.where(breached, segments.local - last_reset, 0)
+        ends = segments.starts + segments.lengths - 1
+        for state, value in zip(segments.states, run[ends].tolist()):
+            state.counters[self] = value
+        return run >= self.count
+
+
+class DeviationRule(Rule):
+    """Fires when a value is more than k standard deviations from the patient's recent mean."""
+
+    temporal = True
+
+    def __init__(self, name, field, window=30, k=3.0, min_samples=10, min_std=1.0):
+        self.name = name
+        self.field = field
+        self.window = window
+        self.k = k
+        self.min_samples = min_samples
+        self.min_std = min_std
+        self.windows = ((field, window),)
+
+    def check(self, state, reading):
+        w = state.windows[(self.field, self.window)]
+        if w.count < self.min_samples:
+            return False
+        return abs(reading[self.field] - w.mean) > self.k * max(w.std, self.min_std)
+
+    def check_bulk(self, segments, columns):
+        values = columns[self.field]
+        # Lay out [prior window, new readings] for every segment back to back
+        priors = [state.windows[(self.field, self.window)].ordered() for state in segments.states]
+        prior_lengths = np.array([len(p) for p in priors], dtype=np.int64)
+        series_starts = np.concatenate(([0], np.cumsum(prior_lengths + segments.lengths)[:-1]))
+        pos = np.repeat(series_starts + prior_lengths, segments.lengths) + segments.local
+        series = np.empty(int(prior_lengths.sum() + len(values)))
+        series[pos] = values
+        total_prior = int(prior_lengths.sum())
+        prior_local = np.arange(total_prior) - np.repeat(np.cumsum(prior_lengths) - prior_lengths, prior_lengths)
+        prior_pos = np.repeat(series_starts, prior_lengths) + prior_local
+        series[prior_pos] = np.fromiter((v for p in priors for v in p), dtype=np.float64, count=total_prior)
+        csum = np.concatenate(([0.0], np.cumsum(series)))
+        csum_sq = np.concatenate(([0.0], np.cumsum(series * series)))
+        # Stats over the `window` values preceding each new reading, never reaching into another patient
+        start = np.maximum(np.repeat(series_starts, segments.lengths), pos - self.window)
+        count = pos - start
+        safe = np.maximum(count, 1)
+        mean = (csum[pos] - csum[start]) / safe
+        var = np.maximum(0.0, (csum_sq[pos] - csum_sq[start]) / safe - mean * mean)
+        std = np.where(count >= 2, np.sqrt(var), 0.0)
+        return (count >= self.min_samples) & (np.abs(values - mean) > self.k * np.maximum(std, self.min_std))
+
+
+def default_rules():
+    return [
+        # Instantaneous checks carried over from the original submit_ecg logic
+        ThresholdRule("Abnormal Heart Rate", "heart_rate", low=50, high=120),
+        ThresholdRule("ST Segment Elevation", "st_segment", high=0.1),
+        ThresholdRule("Low Heart Rate Variability", "heart_rate_variability", low=20),
+        # Temporal rules
+        SustainedRule("Sustained Tachycardia", "heart_rate", count=10, high=100),
+        SustainedRule("Sustained Bradycardia", "heart_rate", count=10, low=60),
+        DeviationRule("Sudden Heart Rate Change", "heart_rate", window=30, k=3.0),
+        ThresholdRule("Fever", "temperature", high=100.4),
+    ]
+
+
+class AnomalyEngine:
+    def __init__(self, rules=None, max_patients=10000):
+        self.rules = rules if rules is not None else default_rules()
+        self.window_specs = sorted({spec for rule in self.rules for spec in rule.windows})
+        self.max_patients = max_patients
+        self._states = OrderedDict()
+        self.readings = 0
+        self.evicted = 0
+
+    def state(self, patient_id):
+        state = self._states.get(patient_id)
+        if state is None:
+            state = PatientState(self.window_specs)
+            self._states[patient_id] = state
+            if len(self._states) > self.max_patients:
+                self._states.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._states.move_to_end(patient_id)
+        return state
+
+    def reset(self, patient_id):
+        self._states.pop(patient_id, None)
+
+    def evaluate(self, patient_id, reading):
+        """Anomaly names for one reading, updating the patient's state."""
+        state = self.state(patient_id)
+        anomalies = [rule.name for rule in self.rules if rule.check(state, reading)]
+        for (field, size), window in state.windows.items():
+            window.push(float(reading[field]))
+        state.readings += 1
+        self.readings += 1
+        return anomalies
+
+    def evaluate_late(self, reading):
+        """Anomaly names for a reading older than ones already seen: instantaneous rules only, no state changes."""
+        self.readings += 1
+        return [rule.name for rule in self.rules if not rule.temporal and rule.check(None, reading)]
+
+    def evaluate_batch(self, patient_ids, readings):
+        """Anomaly names for each reading of a batch, in order, vectorized across patients."""
+        results = [[] for _ in readings]
+        if not readings:
+            return results
+        unique_ids, inverse = np.unique(np.asarray(patient_ids), return_inverse=True)
+        # Stable sort keeps each patient's readings in arrival order
+        order = np.argsort(inverse, kind="stable")
+        lengths = np.bincount(inverse, minlength=len(unique_ids))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        segments = Segments([self.state(pid) for pid in unique_ids.tolist()], starts, lengths)
+        columns = {
+            field: np.array([r[field] for r in readings], dtype=np.float64)[order]
+            for field in FIELDS if field in readings[0]
+        }
+
+        hits = np.zeros((len(self.rules), len(readings)), dtype=bool)
+        for i, rule in enumerate(self.rules):
+            hits[i, order] = rule.check_bulk(segments, columns)
+        for i, j in zip(*np.nonzero(hits.T)):
+            results[i].append(self.rules[j].name)
+
+        for (field, size) in self.window_specs:
+            values = columns[field]
+            for state, start, length in zip(segments.states, starts.tolist(), lengths.tolist()):
+                window = state.windows[(field, size)]
+                window.load(window.ordered() + values[start:start + length].tolist())
+        for state, length in zip(segments.states, lengths.tolist()):
+            state.readings += length
+        self.readings += len(readings)
+        return results
+
+    def snapshot(self):
+        return {
+            "rules": [rule.name for rule in self.rules],
+            "patients": len(self._states),
+            "max_patients": self.max_patients,
+            "evicted": self.evicted,
+            "readings": self.readings,
+        }
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Anomaly engine benchmark
+Reports per-reading cost of streaming and bulk evaluation as the number of
+rules and patients grows
+
+Usage: python bench_anomaly.py [--readings 50000] [--patients 1,100,1000] [--rule-copies 1,2,4]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from anomaly_engine import AnomalyEngine, default_rules
+
+
+def make_readings(count, patients, rng):
+    patient_ids = [f"patient-{i}" for i in rng.integers(0, patients, count)]
+    heart_rate = rng.normal(78, 18, count).round()
+    readings = [
+        {
+            "heart_rate": int(hr),
+            "rr_interval": int(60000 / max(hr, 30)),
+            "temperature": float(t),
+            "qrs_duration": int(q),
+            "heart_rate_variability": int(v),
+            "st_segment": float(st),
+        }
+        for hr, t, q, v, st in zip(
+            heart_rate,
+            rng.normal(98.6, 0.8, count),
+            rng.integers(80, 120, count),
+            rng.integers(10, 60, count),
+            rng.uniform(0.0, 0.2, count),
+        )
+    ]
+    return patient_ids, readings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=50000)
+    parser.add_argument("--patients", default="1,100,1000")
+    parser.add_argument("--rule-copies", default="1,2,4", help="multiples of the default rule set")
+    parser.add_argument("--batch", type=int, default=500, help="readings per bulk call")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    print(f"{'rules':>5} {'patients':>8} {'stream us/reading':>17} {'bulk us/reading':>15}")
+    for copies in [int(c) for c in args.rule_copies.split(",")]:
+        for patients in [int(p) for p in args.patients.split(",")]:
+            patient_ids, readings = make_readings(args.readings, patients, rng)
+
+            engine = AnomalyEngine([rule for _ in range(copies) for rule in default_rules()])
+            started = time.perf_counter()
+            for patient_id, reading in zip(patient_ids, readings):
+                engine.evaluate(patient_id, reading)
+            stream_us = (time.perf_counter() - started) * 1e6 / args.readings
+
+            engine = AnomalyEngine([rule for _ in range(copies) for rule in default_rules()])
+            started = time.perf_counter()
+            for i in range(0, args.readings, args.batch):
+                engine.evaluate_batch(patient_ids[i:i + args.batch], readings[i:i + args.batch])
+            bulk_us = (time.perf_counter() - started) * 1e6 / args.readings
+
+            print(f"{len(engine.rules):>5} {patients:>8} {stream_us:>17.2f} {bulk_us:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Inference benchmark for the imaging classifier
+Reports single-scan p50/p99 latency and current resident memory for the
+selected backend, then images/s through MicroBatcher for a grid of max-batch /
+max-wait settings
+
+Usage: python bench_inference.py [--model NAME] [--backend torch|int8|onnx] [--requests 64] [--batches 1,2,4,8,16] [--waits 0,5,10,25]
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import statistics
+import time
+
+import torch
+from PIL import Image, ImageDraw
+from dotenv import load_dotenv
+from transformers import AutoModelForImageClassification, AutoImageProcessor
+
+from inference import InferencePool, MicroBatcher
+from model_backends import BACKENDS, build_backend
+from telemetry import configure_logging, process_memory
+
+load_dotenv()
+# Show the backend build/validation messages
+configure_logging(os.getenv("LOG_LEVEL", "INFO"))
+
+
+def make_images(count, size=512):
+    """Synthetic scan-like images so the benchmark needs no data on disk"""
+    images = []
+    for i in range(count):
+        img = Image.new('RGB', (size, size), color='black')
+        draw = ImageDraw.Draw(img)
+        inset = 40 + (i % 10) * 5
+        draw.ellipse([inset, inset, size - inset, size - inset], fill='gray', outline='white', width=2)
+        images.append(img)
+    return images
+
+
+async def run_config(batch_fn, images, workers, max_batch, max_wait_ms):
+    pool = InferencePool(workers=workers, max_queue=len(images))
+    batcher = MicroBatcher(batch_fn, pool, max_batch=max_batch, max_wait_ms=max_wait_ms, max_pending=len(images))
+    await batcher.start()
+    started = time.perf_counter()
+    await asyncio.gather(*[batcher.submit(img) for img in images])
+    elapsed = time.perf_counter() - started
+    snapshot = batcher.snapshot()
+    await batcher.stop()
+    pool.shutdown()
+    return elapsed, snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="chanelcolgate/vit-base-patch16-224-chest-x-ray")
+    parser.add_argument("--backend", default=os.getenv("INFERENCE_BACKEND", "torch"), choices=BACKENDS)
+    parser.add_argument("--latency-runs", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=64, help="concurrent images per configuration")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batches", default="1,2,4,8,16")
+    parser.add_argument("--waits", default="0,5,10,25")
+    args = parser.parse_args()
+
+    print(f"Loading {args.model}...")
+    processor = AutoImageProcessor.from_pretrained(args.model, token=os.getenv("HUGGINGFACE_TOKEN"))
+    model = AutoModelForImageClassification.from_pretrained(args.model, token=os.getenv("HUGGINGFACE_TOKEN"))
+    forward, backend = build_backend(args.backend, model, processor, args.model, cache_dir=os.getenv("MODEL_CACHE_DIR", "model_cache"))
+    if backend != "torch":
+        del model
+        # Return the fp32 weights before measuring, as the server does
+        gc.collect()
+
+    def batch_fn(batch):
+        inputs = processor(images=batch, return_tensors="pt")
+        with torch.no_grad():
+            probabilities = torch.softmax(forward(inputs["pixel_values"]), dim=-1)
+        return probabilities.max(dim=-1).indices.tolist()
+
+    images = make_images(args.requests)
+    # Warm-up pass so one-time allocation doesn't skew the first row
+    batch_fn(images[:2])
+
+    latencies = []
+    for i in range(args.latency_runs):
+        started = time.perf_counter()
+        batch_fn([images[i % len(images)]])
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    # Current footprint while serving; peak RSS would still include the fp32 model used to build the backend
+    memory = process_memory()
+    resident = f"RSS {memory['rss'] / 2**20:.0f} MB, PSS {memory['pss'] / 2**20:.0f} MB" if memory else "RSS n/a"
+    print(f"backend: {backend}, single scan p50 {statistics.median(latencies):.1f} ms, p99 {p99:.1f} ms, {resident}")
+
+    print(f"torch threads: {torch.get_num_threads()}, workers: {args.workers}, images per run: {args.requests}")
+    print(f"{'max_batch':>9} {'max_wait_ms':>11} {'avg_batch':>9} {'seconds':>8} {'images/s':>9}")
+    for max_batch in [int(b) for b in args.batches.split(",")]:
+        for max_wait_ms in [int(w) for w in args.waits.split(",")]:
+            elapsed, snapshot = asyncio.run(run_config(batch_fn, images, args.workers, max_batch, max_wait_ms))
+            print(f"{max_batch:>9} {max_wait_ms:>11} {snapshot['avg_batch_size']:>9} {elapsed:>8.2f} {args.requests / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
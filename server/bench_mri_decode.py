@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+MRI upload decode benchmark
+Writes large synthetic scans (JPEG and PNG), then runs the old /upload-mri
+path (read whole upload, full-resolution RGB decode, full-size JPEG for
+Gemini) and the bounded path (hash from file, draft/reduce decode, capped
+JPEG) each in a fresh process, reporting peak RSS growth and latency
+
+Linux only (reads /proc/self/status)
+
+Usage: python bench_mri_decode.py [--side 8000] [--max-side 1024] [--gemini-kb 1024]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def status_mb(field):
+    # VmHWM (peak RSS) starts over at exec; ru_maxrss would carry the parent's peak into the child
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_old(path, args):
+    with open(path, "rb") as f:
+        contents = f.read()
+    hashlib.sha256(contents).hexdigest()
+    image = Image.open(io.BytesIO(contents)).convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG")
+    return image.size, buf.tell()
+
+
+def run_bounded(path, args):
+    from result_cache import ResultCache
+    from scan_image import decode_scan, encode_jpeg
+
+    with open(path, "rb") as f:
+        ResultCache.make_key_from_file(f, "model", "1")
+        image, _ = decode_scan(f, args.max_side)
+    return image.size, len(encode_jpeg(image, args.gemini_kb * 1024))
+
+
+def child(args):
+    # Warm the decoders so the baseline includes their code, not just the interpreter
+    Image.new("RGB", (8, 8)).save(io.BytesIO(), format="JPEG")
+    import scan_image  # noqa: F401
+    baseline = status_mb("VmRSS")
+    started = time.perf_counter()
+    size, jpeg_bytes = {"old": run_old, "bounded": run_bounded}[args.child](args.path, args)
+    print(json.dumps({
+        "ms": round((time.perf_counter() - started) * 1000),
+        "peak_mb": round(status_mb("VmHWM") - baseline, 1),
+        "decoded": f"{size[0]}x{size[1]}",
+        "gemini_kb": round(jpeg_bytes / 1024),
+    }))
+
+
+def synthesize_scan(side, rng):
+    """Smooth anatomy-like blobs plus sensor noise, so JPEG and PNG sizes are realistic"""
+    y, x = np.mgrid[0:side, 0:side].astype(np.float32) / side
+    signal = 120 + 80 * np.sin(6 * x) * np.cos(4 * y) + 40 * np.exp(-((x - 0.5) ** 2 + (y - 0.5) ** 2) * 20)
+    signal += rng.normal(0, 12, (side, side)).astype(np.float32)
+    return Image.fromarray(np.clip(signal, 0, 255).astype(np.uint8), mode="L").convert("RGB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--side", type=int, default=8000, help="synthetic scan width and height in pixels")
+    parser.add_argument("--max-side", type=int, default=1024)
+    parser.add_argument("--gemini-kb", type=int, default=1024)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="mri_bench_")
+    print(f"Synthesizing {args.side}x{args.side} scan...")
+    scan = synthesize_scan(args.side, np.random.default_rng(42))
+    paths = {"jpeg": os.path.join(workdir, "scan.jpg"), "png": os.path.join(workdir, "scan.png")}
+    scan.save(paths["jpeg"], quality=98)
+    scan.save(paths["png"], compress_level=1)
+    del scan
+
+    print(f"{'format':<6} {'file MB':>8} {'path':<8} {'peak RSS MB':>12} {'ms':>7} {'decoded':>11} {'gemini KB':>10}")
+    try:
+        for fmt, path in paths.items():
+            file_mb = os.path.getsize(path) / 1024 / 1024
+            for mode in ("old", "bounded"):
+                out = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, "--path", path,
+                     "--max-side", str(args.max_side), "--gemini-kb", str(args.gemini_kb)],
+                    capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                )
+                r = json.loads(out.stdout)
+                print(f"{fmt:<6} {file_mb:>8.1f} {mode:<8} {r['peak_mb']:>12.1f} {r['ms']:>7} {r['decoded']:>11} {r['gemini_kb']:>10}")
+    finally:
+        for path in paths.values():
+            os.remove(path)
+        os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+QRS detector benchmark
+Streams synthetic raw ECG for many devices through WaveformAnalyzer in
+fixed-size chunks and reports samples/s on one core plus heart-rate error
+
+Usage: python bench_qrs.py [--devices 200] [--seconds 60] [--fs 500] [--chunk 2.0]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from qrs_detect import WaveformAnalyzer
+
+
+def synthesize_ecg(seconds, fs, heart_rate, rng, mv_per_count=0.008):
+    """Gaussian P-QRS-T beats with RR jitter, baseline wander and noise, as int16 ADC counts"""
+    t = np.arange(int(seconds * fs)) / fs
+    signal = np.zeros_like(t)
+    beat = 0.5
+    rr = 60.0 / heart_rate
+    # (offset s, width s, amplitude mV) for P, Q, R, S, T
+    waves = [(-0.2, 0.025, 0.15), (-0.03, 0.01, -0.1), (0.0, 0.012, 1.2), (0.03, 0.01, -0.25), (0.25, 0.04, 0.3)]
+    while beat < seconds:
+        for offset, width, amplitude in waves:
+            signal += amplitude * np.exp(-((t - beat - offset) ** 2) / (2 * width ** 2))
+        beat += rr * rng.uniform(0.95, 1.05)
+    signal += 0.15 * np.sin(2 * np.pi * 0.3 * t) + rng.normal(0, 0.03, len(t))
+    return np.round(signal / mv_per_count).astype(np.int16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--fs", type=int, default=500)
+    parser.add_argument("--chunk", type=float, default=2.0, help="seconds of samples per upload")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    heart_rates = rng.integers(50, 130, args.devices)
+    print(f"Synthesizing {args.devices} devices x {args.seconds:g}s at {args.fs} Hz...")
+    recordings = [synthesize_ecg(args.seconds, args.fs, hr, rng) for hr in heart_rates]
+    analyzers = [WaveformAnalyzer(args.fs) for _ in range(args.devices)]
+
+    chunk = int(args.chunk * args.fs)
+    chunks = int(len(recordings[0]) // chunk)
+    estimates = [[] for _ in range(args.devices)]
+
+    started = time.perf_counter()
+    # Interleave devices the way concurrent uploads would arrive
+    for c in range(chunks):
+        for d in range(args.devices):
+            samples = recordings[d][c * chunk:(c + 1) * chunk].astype(np.float64)
+            summary = analyzers[d].process(samples)
+            if summary:
+                estimates[d].append(summary["heart_rate"])
+    elapsed = time.perf_counter() - started
+
+    total_samples = chunks * chunk * args.devices
+    errors = [abs(np.median(est) - hr) for est, hr in zip(estimates, heart_rates) if est]
+    print(f"chunks: {chunks * args.devices}, samples: {total_samples}, seconds: {elapsed:.2f}")
+    print(f"throughput: {total_samples / elapsed:,.0f} samples/s, {chunks * args.devices / elapsed:,.0f} chunks/s")
+    print(f"real-time devices per core at {args.fs} Hz: {total_samples / elapsed / args.fs:,.0f}")
+    print(f"heart rate error: median {np.median(errors):.1f} bpm, max {np.max(errors):.1f} bpm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+ECG wire format benchmark
+Sends the same readings (with seq and device timestamps, as esp_uploader
+does) to a local serve.py in three ways and reports, per reading:
+
+  json    one JSON reading per POST /submit-ecg
+  batch   --batch-size JSON readings per POST /submit-ecg/batch
+  frames  --batch-size readings as binary frames per POST /submit-ecg/frames
+
+  body B   request body bytes
+  wire B   body plus HTTP/1.1 request line and headers (no TCP/TLS framing)
+  CPU us   server worker CPU time (user + system from /proc) until every row is written
+  parse us decoding and validating the body alone, in this process
+
+Linux only (reads /proc)
+
+Usage: python bench_wire.py [--readings 5000] [--batch-size 50] [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from bench_workers import PATIENT_EMAIL, child_pids, seed_profile, wait_ready
+from ecg_wire import decode_frames, encode_frames
+
+FORMATS = ("json", "batch", "frames")
+
+
+def synthesize_readings(count, start_seq, rng_seed=3):
+    rng = random.Random(rng_seed)
+    start = datetime.now(timezone.utc) - timedelta(seconds=count)
+    readings = []
+    for i in range(count):
+        heart_rate = rng.randint(62, 90)
+        readings.append({
+            "heart_rate": heart_rate,
+            "rr_interval": int(60000 / heart_rate),
+            "temperature": round(98.6 + rng.uniform(-0.5, 0.5), 2),
+            "qrs_duration": rng.randint(80, 110),
+            "heart_rate_variability": rng.randint(30, 60),
+            "st_segment": round(rng.uniform(0.0, 0.08), 3),
+            "seq": start_seq + i,
+            "timestamp": (start + timedelta(seconds=i)).isoformat(),
+        })
+    return readings
+
+
+def build_requests(fmt, readings, patient_id, batch_size):
+    """(path, params, body, content type, readings in it) for every request of this format"""
+    requests = []
+    if fmt == "json":
+        for reading in readings:
+            requests.append(("/submit-ecg", None, json.dumps({"patient_id": patient_id, **reading}).encode(), "application/json", 1))
+        return requests
+    for start in range(0, len(readings), batch_size):
+        chunk = readings[start:start + batch_size]
+        if fmt == "batch":
+            body = json.dumps([{"patient_id": patient_id, **r} for r in chunk]).encode()
+            requests.append(("/submit-ecg/batch", None, body, "application/json", len(chunk)))
+        else:
+            requests.append(("/submit-ecg/frames", {"patient_id": patient_id}, encode_frames(chunk),
+                             "application/octet-stream", len(chunk)))
+    return requests
+
+
+def request_head_bytes(client, path, params, body, content_type):
+    request = client.build_request("POST", path, params=params, content=body, headers={"Content-Type": content_type})
+    line = len(f"POST {request.url.raw_path.decode()} HTTP/1.1\r\n")
+    return line + sum(len(k) + len(v) + 4 for k, v in request.headers.raw) + 2
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of the full line
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def parse_cost(fmt, requests):
+    """Microseconds per reading to turn request bodies into validated readings"""
+    from pydantic import TypeAdapter
+    from main import ECGData, ecg_readings_adapter
+
+    single = TypeAdapter(ECGData)
+    started = time.perf_counter()
+    total = 0
+    for path, params, body, _, count in requests:
+        # FastAPI parses a JSON body with json.loads and then validates the objects
+        if fmt == "json":
+            single.validate_python(json.loads(body))
+        elif fmt == "batch":
+            ecg_readings_adapter.validate_python(json.loads(body))
+        else:
+            ecg_readings_adapter.validate_python([{"patient_id": params["patient_id"], **v} for v in decode_frames(body)])
+        total += count
+    return (time.perf_counter() - started) * 1e6 / total
+
+
+async def drive(client, requests, concurrency):
+    queue = list(reversed(requests))
+    failures = 0
+
+    async def loop():
+        nonlocal failures
+        while queue:
+            path, params, body, content_type, _ = queue.pop()
+            r = await client.post(path, params=params, content=body, headers={"Content-Type": content_type})
+            if r.status_code != 200 or r.json().get("success") is False:
+                failures += 1
+
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return failures
+
+
+async def wait_flushed(client):
+    while (await client.get("/submit-ecg/stats")).json()["buffer"]["pending"]:
+        await asyncio.sleep(0.05)
+
+
+async def run(args, workdir):
+    db_path = os.path.join(workdir, "wire.db")
+    await seed_profile(db_path)
+    env = {**os.environ, "STORAGE_BACKEND": "sqlite", "SQLITE_PATH": db_path, "MODEL_LOAD_MODE": "off",
+           "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"), "ECG_FLUSH_INTERVAL_MS": "100"}
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", "1", "--host", "127.0.0.1", "--port", str(args.port),
+         "--memory-report-s", "0"],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    results = []
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60, limits=limits) as client:
+            await wait_ready(client, proc, 120)
+            patient_id = (await client.post("/setup-ecg-device", json={"patient_email": PATIENT_EMAIL})).json()["patient_id"]
+            (worker,) = child_pids(proc.pid)
+            seq = 1
+            for fmt in FORMATS:
+                readings = synthesize_readings(args.readings, seq)
+                seq += args.readings
+                requests = build_requests(fmt, readings, patient_id, args.batch_size)
+                body = sum(len(r[2]) for r in requests)
+                head = sum(request_head_bytes(client, *r[:4]) for r in requests)
+
+                cpu_before = cpu_seconds(worker)
+                started = time.perf_counter()
+                failures = await drive(client, requests, args.concurrency)
+                await wait_flushed(client)
+                elapsed = time.perf_counter() - started
+                cpu = cpu_seconds(worker) - cpu_before
+
+                results.append({
+                    "format": fmt,
+                    "requests": len(requests),
+                    "failures": failures,
+                    "body": body / args.readings,
+                    "wire": (body + head) / args.readings,
+                    "cpu_us": cpu * 1e6 / args.readings,
+                    "readings_per_s": args.readings / elapsed,
+                    "parse_us": parse_cost(fmt, requests),
+                })
+                print(f"{fmt}: {results[-1]['readings_per_s']:.0f} readings/s", flush=True)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=5000, help="readings sent in each format")
+    parser.add_argument("--batch-size", type=int, default=50, help="readings per batch/frames request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    # parse_cost() imports main in this process; keep it off the network and the model
+    os.environ.setdefault("SUPABASE_URL", "http://memory.local")
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "memory")
+    os.environ.setdefault("GEMINI_API_KEY", "memory")
+    os.environ["MODEL_LOAD_MODE"] = "off"
+
+    with tempfile.TemporaryDirectory(prefix="wire_bench_") as workdir:
+        results = asyncio.run(run(args, workdir))
+
+    print(f"\nreadings per format: {args.readings}, batch size: {args.batch_size}, concurrency: {args.concurrency}")
+    print(f"{'format':<7} {'requests':>8} {'fail':>5} {'body B':>7} {'wire B':>7} {'CPU us':>7} {'parse us':>9} {'readings/s':>11}")
+    for r in results:
+        print(f"{r['format']:<7} {r['requests']:>8} {r['failures']:>5} {r['body']:>7.1f} {r['wire']:>7.1f} "
+              f"{r['cpu_us']:>7.0f} {r['parse_us']:>9.2f} {r['readings_per_s']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
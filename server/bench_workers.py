@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Worker-count benchmark for serve.py
+For each worker count, starts serve.py on a fresh local SQLite database,
+waits for /health/ready, drives a fixed number of concurrent requests and
+reports throughput, p50/p99 latency and per-worker plus total memory (RSS
+counts shared model pages in every worker, PSS splits them, so total PSS is
+what the machine actually spends)
+
+  ecg - POST /submit-ecg readings for one patient
+  mri - POST /upload-mri with distinct random scans; Gemini gets an invalid
+        key and a short deadline so only the imaging classifier does work
+
+Linux only (reads /proc)
+
+Usage: python bench_workers.py [--workers 1,2,4] [--endpoint ecg|mri] [--requests 400] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from storage import SQLiteStorage
+from telemetry import process_memory
+
+PATIENT_EMAIL = "bench@medipulse.local"
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid is the second field after its closing parenthesis
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def random_scans(count, side, rng):
+    scans = []
+    for _ in range(count):
+        pixels = rng.integers(0, 255, (side, side), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(pixels, mode="L").save(buf, format="JPEG", quality=90)
+        scans.append(buf.getvalue())
+    return scans
+
+
+async def seed_profile(path):
+    storage = SQLiteStorage(path)
+    try:
+        await storage.create_profile({"email": PATIENT_EMAIL, "full_name": "Bench Patient", "role": "patient"})
+    finally:
+        await storage.close()
+
+
+async def wait_ready(client, proc, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"serve.py exited with {proc.returncode}")
+        try:
+            r = await client.get("/health/ready")
+            if r.status_code == 200:
+                return r.json()
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {timeout:.0f}s")
+
+
+async def drive(client, args, patient_id, scans):
+    rng = random.Random(1)
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def one(index):
+        if args.endpoint == "ecg":
+            return await client.post("/submit-ecg", json={
+                "patient_id": patient_id,
+                "heart_rate": rng.randint(60, 100),
+                "rr_interval": rng.randint(600, 1000),
+                "temperature": round(rng.uniform(36.2, 37.4), 1),
+                "qrs_duration": rng.randint(80, 110),
+                "heart_rate_variability": rng.randint(20, 60),
+                "st_segment": round(rng.uniform(-0.05, 0.05), 3),
+            })
+        return await client.post(
+            "/upload-mri",
+            data={"patient_id": patient_id, "uploaded_by": patient_id},
+            files={"file": (f"scan{index}.jpg", scans[index % len(scans)], "image/jpeg")},
+        )
+
+    async def loop():
+        nonlocal next_index, errors
+        while next_index < args.requests:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                r = await one(index)
+                ok = r.status_code == 200 and r.json().get("success", True) is not False
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(loop() for _ in range(args.concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+async def run_one(workers, args, workdir, scans):
+    db_path = os.path.join(workdir, f"bench-{workers}.db")
+    await seed_profile(db_path)
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "sqlite",
+        "SQLITE_PATH": db_path,
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    }
+    if args.endpoint == "mri":
+        env.update({"GEMINI_API_KEY": "bench-invalid-key", "GEMINI_DEADLINE_S": "0.05"})
+
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(args.port),
+         "--threads-per-worker", str(args.threads_per_worker), "--memory-report-s", "0"],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=120, limits=limits) as client:
+            ready = await wait_ready(client, proc, args.ready_timeout)
+            r = await client.post("/setup-ecg-device", json={"patient_email": PATIENT_EMAIL})
+            patient_id = r.json()["patient_id"]
+            elapsed, latencies, errors = await drive(client, args, patient_id, scans)
+
+        pids = child_pids(proc.pid)
+        memory = [process_memory(pid) for pid in pids]
+        supervisor = process_memory(proc.pid)
+        latencies.sort()
+        return {
+            "workers": workers,
+            "model": f"{ready['model']} ({ready['backend']})",
+            "rps": len(latencies) / elapsed,
+            "p50": statistics.median(latencies),
+            "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            "errors": errors,
+            "rss": statistics.mean(m["rss"] for m in memory) / 2**20,
+            "pss": statistics.mean(m["pss"] for m in memory) / 2**20,
+            "shared": statistics.mean(m["shared"] for m in memory) / 2**20,
+            "total_pss": (supervisor["pss"] + sum(m["pss"] for m in memory)) / 2**20,
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+async def run(args):
+    counts = [int(n) for n in args.workers.split(",")]
+    scans = random_scans(args.requests, args.image_side, np.random.default_rng(7)) if args.endpoint == "mri" else []
+    with tempfile.TemporaryDirectory(prefix="worker_bench_") as workdir:
+        results = []
+        for workers in counts:
+            result = await run_one(workers, args, workdir, scans)
+            results.append(result)
+            print(f"{workers} workers: {result['rps']:.1f} req/s", flush=True)
+
+    print(f"\nendpoint: {args.endpoint}, model: {results[0]['model']}, requests: {args.requests}, "
+          f"concurrency: {args.concurrency}, threads/worker: {args.threads_per_worker}")
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6} "
+          f"{'RSS/worker':>11} {'PSS/worker':>11} {'shared':>8} {'total PSS':>10}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['rps']:>8.1f} {r['p50']:>8.1f} {r['p99']:>8.1f} {r['errors']:>6} "
+              f"{r['rss']:>9.0f}MB {r['pss']:>9.0f}MB {r['shared']:>6.0f}MB {r['total_pss']:>8.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--endpoint", choices=["ecg", "mri"], default="ecg")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--image-side", type=int, default=512, help="with --endpoint mri: scan width and height")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=600, help="seconds to wait for the model to load")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
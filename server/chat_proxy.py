@@ -0,0 +1,206 @@
+"""
+Gemini proxy behind /chat.
+
+One long-lived httpx.AsyncClient (HTTP/2 when h2 is installed, bounded
+connections, keep-alive) is shared by every chat request, so a message costs
+a request on a warm connection instead of a new TLS handshake. A semaphore
+caps concurrent upstream calls and a bounded wait queue turns bursts into
+PoolSaturatedError (503 + Retry-After) instead of piling up sockets.
+
+Answers to identical (context, prompt) pairs are served from an LRU with a
+TTL. stream() yields text chunks as Gemini produces them (its SSE endpoint)
+and stores the joined answer in the same cache once the stream completes.
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import json
+import time
+
+import httpx
+
+from device_cache import TTLCache
+from inference import PoolSaturatedError
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+
+
+class ChatUpstreamError(Exception):
+    """Raised when Gemini answers with an error or an unusable body."""
+
+
+class GeminiChat:
+    def __init__(self, api_key, model="gemini-1.5-flash", timeout=30.0, connect_timeout=5.0, deadline=60.0,
+                 max_concurrent=8, max_waiting=32, retry_after=2, max_connections=16, keepalive_expiry=60.0,
+                 cache_entries=512, cache_ttl=3600.0, http2=True, transport=None):
+        # transport replaces the network (tests and load runs)
+        self.model = model
+        self.deadline = deadline
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.retry_after = retry_after
+        self.client = httpx.AsyncClient(
+            base_url=GEMINI_API_BASE,
+            headers={"x-goog-api-key": api_key or ""},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2 and importlib.util.find_spec("h2") is not None,
+            transport=transport,
+        )
+        self.cache = TTLCache(max_entries=cache_entries, ttl=cache_ttl)
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.stats = {"requests": 0, "streams": 0, "rejected": 0, "errors": 0, "upstream_calls": 0,
+                      "first_chunks": 0, "total_ms": 0.0, "first_chunk_ms_total": 0.0}
+
+    def cache_key(self, context, prompt):
+        digest = hashlib.sha256()
+        for part in (self.model, context, prompt):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _payload(self, context, prompt):
+        return {"contents": [{"role": "user", "parts": [{"text": f"{context}\n{prompt}" if context else prompt}]}]}
+
+    @staticmethod
+    def _text(data):
+        candidates = data.get("candidates") or [{}]
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        return "".join(part.get("text", "") for part in parts)
+
+    def check_capacity(self):
+        """Raise PoolSaturatedError if a new request would have to queue behind a full wait queue."""
+        if self.active + self.waiting >= self.max_concurrent + self.max_waiting:
+            self.stats["rejected"] += 1
+            raise PoolSaturatedError(
+                f"Chat is at capacity ({self.active} running, {self.waiting} waiting)",
+                retry_after=self.retry_after,
+            )
+
+    async def _acquire(self):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def _release(self):
+        self.active -= 1
+        self._slots.release()
+
+    async def _raise_for_status(self, r):
+        if r.status_code != 200:
+            body = (await r.aread()).decode(errors="replace")
+            try:
+                message = json.loads(body)["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = body[:200]
+            raise ChatUpstreamError(f"Gemini returned {r.status_code}: {message}")
+
+    async def complete(self, context, prompt):
+        """Whole answer as (text, cached)."""
+        self.stats["requests"] += 1
+        key = self.cache_key(context, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, True
+
+        self.check_capacity()
+        await self._acquire()
+        started = time.perf_counter()
+        try:
+            self.stats["upstream_calls"] += 1
+            r = await asyncio.wait_for(
+                self.client.post(f"/models/{self.model}:generateContent", json=self._payload(context, prompt)),
+                timeout=self.deadline,
+            )
+            await self._raise_for_status(r)
+            text = self._text(r.json())
+        except asyncio.TimeoutError:
+            self.stats["errors"] += 1
+            raise ChatUpstreamError(f"Gemini did not answer within {self.deadline:g}s")
+        except (httpx.HTTPError, ValueError) as e:
+            # Unreachable host, read stall or a body that is not JSON
+            self.stats["errors"] += 1
+            raise ChatUpstreamError(f"Gemini request failed: {e!r}") from e
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["total_ms"] += (time.perf_counter() - started) * 1000
+            self._release()
+
+        self.cache.set(key, text)
+        return text, False
+
+    async def stream(self, context, prompt):
+        """Yield the answer in chunks as they arrive; a cached answer is yielded as a single chunk."""
+        self.stats["requests"] += 1
+        self.stats["streams"] += 1
+        key = self.cache_key(context, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        await self._acquire()
+        started = time.perf_counter()
+        chunks = []
+        try:
+            self.stats["upstream_calls"] += 1
+            async with self.client.stream(
+                "POST",
+                f"/models/{self.model}:streamGenerateContent",
+                params={"alt": "sse"},
+                json=self._payload(context, prompt),
+            ) as r:
+                await self._raise_for_status(r)
+                async for line in r.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    if time.perf_counter() - started > self.deadline:
+                        raise ChatUpstreamError(f"Gemini did not finish within {self.deadline:g}s")
+                    text = self._text(json.loads(line[5:]))
+                    if text:
+                        if not chunks:
+                            self.stats["first_chunks"] += 1
+                            self.stats["first_chunk_ms_total"] += (time.perf_counter() - started) * 1000
+                        chunks.append(text)
+                        yield text
+        except (httpx.HTTPError, ValueError) as e:
+            self.stats["errors"] += 1
+            raise ChatUpstreamError(f"Gemini stream failed: {e!r}") from e
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["total_ms"] += (time.perf_counter() - started) * 1000
+            self._release()
+
+        self.cache.set(key, "".join(chunks))
+
+    async def close(self):
+        await self.client.aclose()
+
+    def snapshot(self):
+        calls = self.stats["upstream_calls"]
+        first_chunks = self.stats["first_chunks"]
+        return {
+            "model": self.model,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_waiting": self.max_waiting,
+            "avg_upstream_ms": round(self.stats["total_ms"] / calls, 1) if calls else 0.0,
+            "avg_first_chunk_ms": round(self.stats["first_chunk_ms_total"] / first_chunks, 1) if first_chunks else 0.0,
+            "cache": self.cache.snapshot(),
+            **{k: v for k, v in self.stats.items() if k not in ("total_ms", "first_chunk_ms_total")},
+        }
@@ -0,0 +1,93 @@
+"""
+Async data-access layer for Supabase (PostgREST).
+
+Every query goes through one pooled httpx.AsyncClient (bounded connections,
+keep-alive, HTTP/2 when h2 is installed) and runs under its own deadline, so
+concurrent requests overlap their database round trips instead of blocking
+the event loop one after another.
+
+Usage mirrors the supabase client, with the execute step awaited through
+the pool:
+
+    resp = await db.execute(db.table("patients").select("id").eq("user_id", uid))
+"""
+
+import asyncio
+import importlib.util
+import time
+
+import httpx
+from postgrest import AsyncPostgrestClient
+
+
+class QueryTimeoutError(Exception):
+    """Raised when a query misses its deadline."""
+
+
+class SupabaseDB:
+    def __init__(self, url, key, timeout=10.0, max_connections=20, max_keepalive=10, keepalive_expiry=30.0, http2=True,
+                 transport=None):
+        # transport replaces the network (e.g. memory_postgrest.MemoryPostgREST for load tests)
+        self.timeout = timeout
+        headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+        # Build the pooled session first and hand it to postgrest, which sends every request through it
+        self.http = httpx.AsyncClient(
+            base_url=f"{url}/rest/v1",
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2 and importlib.util.find_spec("h2") is not None,
+            follow_redirects=True,
+            transport=transport,
+        )
+        self.client = AsyncPostgrestClient(f"{url}/rest/v1", headers=headers, http_client=self.http)
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.stats = {
+            "queries": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "total_ms": 0.0,
+            "max_in_flight": 0,
+        }
+
+    def table(self, name):
+        return self.client.table(name)
+
+    def rpc(self, fn, params):
+        return self.client.rpc(fn, params)
+
+    async def execute(self, query, timeout=None):
+        """Run a built query on the shared pool, failing with QueryTimeoutError after `timeout` seconds."""
+        timeout = timeout if timeout is not None else self.timeout
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(query.execute(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise QueryTimeoutError(f"Database query timed out after {timeout:g}s")
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.stats["queries"] += 1
+            self.stats["total_ms"] += (time.perf_counter() - started) * 1000
+
+    async def close(self):
+        await self.http.aclose()
+
+    def snapshot(self):
+        queries = self.stats["queries"]
+        return {
+            "in_flight": self.in_flight,
+            "max_connections": self.max_connections,
+            "avg_ms": round(self.stats["total_ms"] / queries, 2) if queries else 0.0,
+            **{k: v for k, v in self.stats.items() if k != "total_ms"},
+        }
@@ -0,0 +1,138 @@
+"""
+Write-behind buffer for ECG readings.
+
+Readings are queued in memory and flushed to Supabase as one multi-row
+insert whenever the queue reaches `flush_rows` or `flush_interval` seconds
+have passed, whichever comes first. The queue is bounded by `max_rows` so a
+slow or unreachable database cannot grow memory without limit. Rows that
+a failed flush cannot put back are handed to `on_drop`, so whoever
+acknowledged them can take that back.
+"""
+
+import asyncio
+import logging
+import time
+
+log = logging.getLogger("medipulse.ecg_ingest")
+
+
+class BufferFullError(Exception):
+    """Raised when the buffer cannot accept more rows."""
+
+
+class ECGWriteBuffer:
+    def __init__(self, insert_rows, flush_rows=200, flush_interval=1.0, max_rows=10000, on_drop=None):
+        # insert_rows is an async callable taking a list of row dicts; on_drop a plain one taking the rows lost
+        self.insert_rows = insert_rows
+        self.on_drop = on_drop
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+
+        self._rows = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+        self.stats = {
+            "accepted": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "dropped": 0,
+            "rejected": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    @property
+    def pending(self):
+        return len(self._rows)
+
+    async def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flusher and write out everything still queued."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def add(self, rows):
+        """Queue rows for insertion. All-or-nothing: raises BufferFullError if they don't fit."""
+        if self._closing:
+            raise BufferFullError("ECG buffer is shutting down")
+        async with self._lock:
+            if len(self._rows) + len(rows) > self.max_rows:
+                self.stats["rejected"] += len(rows)
+                raise BufferFullError(
+                    f"ECG buffer full ({len(self._rows)}/{self.max_rows} rows pending)"
+                )
+            self._rows.extend(rows)
+            self.stats["accepted"] += len(rows)
+            if len(self._rows) >= self.flush_rows:
+                self._wakeup.set()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._rows = self._rows, []
+        if not batch:
+            return 0
+
+        for start in range(0, len(batch), self.flush_rows):
+            chunk = batch[start:start + self.flush_rows]
+            started = time.perf_counter()
+            try:
+                await self.insert_rows(chunk)
+            except Exception as e:
+                self.stats["failed_flushes"] += 1
+                await self._requeue(batch[start:], e)
+                return start
+            self.stats["flushes"] += 1
+            self.stats["flushed"] += len(chunk)
+            self.stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+        return len(batch)
+
+    async def _requeue(self, rows, error):
+        # Put unwritten rows back at the front so ordering is preserved,
+        # keeping only as many as the bound allows.
+        async with self._lock:
+            room = max(0, self.max_rows - len(self._rows))
+            kept, lost = rows[:room], rows[room:]
+            self._rows = kept + self._rows
+        dropped = len(lost)
+        self.stats["dropped"] += dropped
+        log.error(f"ECG buffer flush failed ({len(rows)} rows, {dropped} dropped): {error}")
+        if lost and self.on_drop is not None:
+            try:
+                self.on_drop(lost)
+            except Exception as e:
+                log.error(f"ECG buffer on_drop callback failed: {e}")
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._closing:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error(f"ECG buffer flusher error: {e}")
+
+    def snapshot(self):
+        return {
+            "pending": self.pending,
+            "max_rows": self.max_rows,
+            "flush_rows": self.flush_rows,
+            "flush_interval_s": self.flush_interval,
+            **self.stats,
+        }
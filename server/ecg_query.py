@@ -0,0 +1,107 @@
+"""
+Helpers for the ECG history API: keyset cursors, column projection and
+downsampling.
+
+Pages are ordered by (timestamp, id) and the cursor is the key of the last
+row returned, so deep pages cost the same as the first one.
+"""
+
+import base64
+from datetime import datetime
+
+# Columns a caller may project; leaving out ecg_data (the bulky JSONB) is what keeps pages small
+ECG_COLUMNS = (
+    "id",
+    "timestamp",
+    "heart_rate",
+    "temperature",
+    "signal_quality",
+    "battery_level",
+    "anomaly_detected",
+    "anomaly_type",
+    "device_id",
+    "ecg_data",
+)
+
+
+def parse_fields(fields):
+    """Validate a comma-separated projection; the keyset columns are always included."""
+    if not fields or fields.strip() == "*":
+        return ["*"]
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in ECG_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    for key in ("id", "timestamp"):
+        if key not in requested:
+            requested.append(key)
+    return requested
+
+
+def encode_cursor(row):
+    raw = f"{row['timestamp']}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor; the timestamp must parse as an ISO datetime."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        datetime.fromisoformat(timestamp)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not row_id:
+        raise ValueError("Invalid cursor")
+    return timestamp, row_id
+
+
+def postgrest_quote(value):
+    """Double-quote a value for a PostgREST logic filter so ',', '.', ':' and ')' in it stay data."""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def keyset_filter(cursor, descending=True):
+    """PostgREST or= filter selecting rows strictly after the cursor in (timestamp, id) order."""
+    timestamp, row_id = decode_cursor(cursor)
+    op = "lt" if descending else "gt"
+    ts, key = postgrest_quote(timestamp), postgrest_quote(row_id)
+    return f"timestamp.{op}.{ts},and(timestamp.eq.{ts},id.{op}.{key})"
+
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    points is a list of (x, y) sorted by x; returns at most `threshold` points
+    that keep the visual shape of the series (peaks survive, flat runs collapse).
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        span = max(1, next_end - next_start)
+        avg_x = sum(p[0] for p in points[next_start:next_end]) / span
+        avg_y = sum(p[1] for p in points[next_start:next_end]) / span
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a][0], points[a][1]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
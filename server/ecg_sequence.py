@@ -0,0 +1,108 @@
+"""
+Duplicate suppression for sequence-numbered ECG readings.
+
+Readers stamp every reading with a per-device sequence number that only
+grows (esp_uploader sends the spool row id), so a retried request or a
+replayed spool carries the same numbers again. SequenceTracker keeps, per
+device, the highest number seen plus a bitmap of the `window` numbers below
+it. A reading above the high-water mark is new; one below it but inside the
+window is a late arrival if its bit is clear and a duplicate if it is set.
+Duplicates are dropped before they reach the anomaly engine, the live feed
+or the database.
+
+A reading stays pending from check() until the caller reports it stored
+(confirm) or not (discard). A copy that arrives meanwhile is a duplicate,
+but stored() lets its handler wait for the first copy's outcome before
+acknowledging it, so a device never drops a reading whose write then fails.
+
+A number more than `window` below the mark cannot be told apart from a
+device whose counter started over (spool deleted, firmware reflashed), so it
+resets that device's state and is accepted. The state lives in process
+memory: after a restart, or with several serve.py workers, a retry that lands
+on another process is not caught.
+"""
+
+import asyncio
+from collections import OrderedDict
+
+NEW = "new"
+LATE = "late"
+DUPLICATE = "duplicate"
+RESET = "reset"
+
+
+class SequenceTracker:
+    def __init__(self, window=4096, max_devices=10000):
+        self.window = window
+        self.max_devices = max_devices
+        self._mask = (1 << window) - 1
+        # device -> [high-water mark, bitmap]; bit i set means hwm - i was seen
+        self._devices = OrderedDict()
+        # (device, seq) -> future, or None until someone waits, while the first copy's write is unresolved
+        self._pending = {}
+        self.stats = {NEW: 0, LATE: 0, DUPLICATE: 0, RESET: 0, "evicted": 0}
+
+    def check(self, device, seq):
+        """Classify seq for this device and mark it seen unless it is a duplicate."""
+        state = self._devices.get(device)
+        if state is None:
+            state = self._devices[device] = [seq, 1]
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+                self.stats["evicted"] += 1
+            outcome = NEW
+        else:
+            self._devices.move_to_end(device)
+            hwm, bits = state
+            if seq > hwm:
+                shift = seq - hwm
+                state[0] = seq
+                state[1] = ((bits << shift) | 1) & self._mask if shift < self.window else 1
+                outcome = NEW
+            elif hwm - seq >= self.window:
+                state[0], state[1] = seq, 1
+                outcome = RESET
+            elif bits >> (hwm - seq) & 1:
+                outcome = DUPLICATE
+            else:
+                state[1] = bits | 1 << (hwm - seq)
+                outcome = LATE
+        if outcome != DUPLICATE:
+            self._pending[(device, seq)] = None
+        self.stats[outcome] += 1
+        return outcome
+
+    def confirm(self, device, seq):
+        """The reading accepted for this seq was stored."""
+        future = self._pending.pop((device, seq), None)
+        if future is not None:
+            future.set_result(True)
+
+    def discard(self, device, seq):
+        """Forget a seq whose reading was not stored after all, so its retry is accepted."""
+        state = self._devices.get(device)
+        if state is not None and 0 <= state[0] - seq < self.window:
+            state[1] &= ~(1 << (state[0] - seq))
+        future = self._pending.pop((device, seq), None)
+        if future is not None:
+            future.set_result(False)
+
+    async def stored(self, device, seq):
+        """For a duplicate: wait for the first copy, True once it is stored, False if it was discarded."""
+        key = (device, seq)
+        if key not in self._pending:
+            return True
+        future = self._pending[key]
+        if future is None:
+            future = self._pending[key] = asyncio.get_running_loop().create_future()
+        # shield: a waiter going away must not cancel the future other copies wait on
+        return await asyncio.shield(future)
+
+    def snapshot(self):
+        return {
+            "devices": len(self._devices),
+            "max_devices": self.max_devices,
+            "window": self.window,
+            "pending": len(self._pending),
+            **self.stats,
+        }
@@ -0,0 +1,109 @@
+"""
+In-memory live ECG channel.
+
+Each patient gets a fixed-size ring buffer of recent readings that
+submit_ecg fills. Viewers (WebSocket subscribers) don't get a queue each;
+they remember the last sequence number they saw and wait on one shared
+future per patient that is resolved on every publish. Publishing is O(1)
+regardless of viewer count, and each reading is serialized to JSON once.
+
+Streams are kept in least-recently-published order. One that nobody is
+watching is dropped once it has been idle for `idle_ttl` seconds, or sooner
+when more than `max_patients` streams exist, so the hub does not grow with
+every patient id it has ever seen.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+
+
+class PatientStream:
+    def __init__(self, size):
+        self.readings = deque(maxlen=size)
+        self.seq = 0
+        self.subscribers = 0
+        self.last_publish = time.monotonic()
+        self._changed = None
+
+    def publish(self, reading):
+        self.seq += 1
+        self.last_publish = time.monotonic()
+        message = json.dumps({"type": "reading", "seq": self.seq, "data": reading})
+        self.readings.append((self.seq, reading, message))
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+    async def wait(self, after_seq):
+        """Wait until a reading newer than after_seq has been published."""
+        if self.seq > after_seq:
+            return
+        if self._changed is None:
+            self._changed = asyncio.get_running_loop().create_future()
+        # shield: one subscriber disconnecting must not cancel the shared future
+        await asyncio.shield(self._changed)
+
+    def since(self, after_seq):
+        """Pre-serialized messages newer than after_seq still held in the ring."""
+        count = min(self.seq - after_seq, len(self.readings))
+        # Sequence numbers are contiguous, so the new items are the last `count`
+        items = [self.readings[-1 - i] for i in range(count)]
+        return [(seq, message) for seq, _, message in reversed(items)]
+
+    def latest(self, limit):
+        """Most recent readings, newest first, like the ecg_readings query."""
+        items = list(self.readings)[-limit:]
+        return [reading for _, reading, _ in reversed(items)]
+
+
+class ECGHub:
+    def __init__(self, ring_size=256, max_patients=10000, idle_ttl=900.0):
+        self.ring_size = ring_size
+        self.max_patients = max_patients
+        self.idle_ttl = idle_ttl
+        self.evicted = 0
+        self._streams = OrderedDict()
+
+    def get(self, patient_id):
+        """The patient's stream if one exists; reads must not create streams."""
+        return self._streams.get(patient_id)
+
+    def stream(self, patient_id):
+        stream = self._streams.get(patient_id)
+        if stream is None:
+            stream = PatientStream(self.ring_size)
+            self._streams[patient_id] = stream
+            self._evict()
+        return stream
+
+    def publish(self, patient_id, reading):
+        stream = self.stream(patient_id)
+        stream.publish(reading)
+        self._streams.move_to_end(patient_id)
+        self._evict()
+
+    def _evict(self):
+        """Drop idle, unwatched streams from the least recently published end."""
+        now = time.monotonic()
+        for _ in range(len(self._streams)):
+            patient_id, stream = next(iter(self._streams.items()))
+            if len(self._streams) <= self.max_patients and now - stream.last_publish < self.idle_ttl:
+                break
+            if stream.subscribers:
+                # Watched streams stay; look past this one
+                self._streams.move_to_end(patient_id)
+                continue
+            del self._streams[patient_id]
+            self.evicted += 1
+
+    def snapshot(self):
+        return {
+            "patients": len(self._streams),
+            "max_patients": self.max_patients,
+            "evicted": self.evicted,
+            "ring_size": self.ring_size,
+            "subscribers": sum(s.subscribers for s in self._streams.values()),
+            "buffered_readings": sum(len(s.readings) for s in self._streams.values()),
+        }
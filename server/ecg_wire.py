@@ -0,0 +1,150 @@
+"""
+Compact binary framing for ECG readings (POST /submit-ecg/frames).
+
+A JSON reading costs ~200 bytes of field names and digits. A frame carries
+up to 65535 readings of one patient in 14 bytes each after an 18-byte
+header, all little-endian:
+
+  header  magic "EF", version (u8), flags (u8), count (u16),
+          base_seq (u32), base_ms (i64, Unix milliseconds)
+  record  dt_ms (u16)  ms since the previous reading, 0 for the first
+          dseq (u8)    seq minus the previous reading's, 0 for the first
+          heart_rate (u8), rr_interval (u16), temperature (i16, 1/100 degree),
+          qrs_duration (u16), heart_rate_variability (u16), st_segment (i16, 1/1000)
+
+Flag bit 0 says the readings carry sequence numbers and bit 1 that they
+carry device timestamps; without them dseq/dt_ms are zero and ignored.
+Timestamps and sequence numbers are delta-encoded against the previous
+reading, so they fit in 3 bytes instead of 12. A body may hold several
+frames back to back. encode_frames() starts a new frame whenever a delta or
+the count would not fit.
+
+decode_frames() reads the records in place with np.frombuffer over a
+memoryview of the request body; nothing is copied until the columns are
+turned into Python values.
+"""
+
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+
+MAGIC = b"EF"
+VERSION = 1
+FLAG_SEQ = 1
+FLAG_TIME = 2
+
+HEADER = struct.Struct("<2sBBHIq")
+RECORD = np.dtype([
+    ("dt_ms", "<u2"),
+    ("dseq", "u1"),
+    ("heart_rate", "u1"),
+    ("rr_interval", "<u2"),
+    ("temperature", "<i2"),
+    ("qrs_duration", "<u2"),
+    ("heart_rate_variability", "<u2"),
+    ("st_segment", "<i2"),
+])
+MAX_COUNT = 0xFFFF
+
+# Field -> fixed-point scale on the wire
+SCALES = {
+    "heart_rate": 1,
+    "rr_interval": 1,
+    "temperature": 100,
+    "qrs_duration": 1,
+    "heart_rate_variability": 1,
+    "st_segment": 1000,
+}
+
+
+def _epoch_ms(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(round(timestamp.timestamp() * 1000))
+
+
+def _pack(readings, flags, seqs, times):
+    records = np.zeros(len(readings), dtype=RECORD)
+    for field, scale in SCALES.items():
+        values = np.rint(np.array([r[field] for r in readings], dtype=np.float64) * scale)
+        info = np.iinfo(RECORD[field])
+        if values.min() < info.min or values.max() > info.max:
+            raise ValueError(f"{field} out of range for the binary format")
+        records[field] = values
+    if flags & FLAG_SEQ:
+        records["dseq"][1:] = np.diff(seqs)
+    if flags & FLAG_TIME:
+        records["dt_ms"][1:] = np.diff(times)
+    header = HEADER.pack(MAGIC, VERSION, flags, len(readings), seqs[0] if flags & FLAG_SEQ else 0,
+                         times[0] if flags & FLAG_TIME else 0)
+    return header + records.tobytes()
+
+
+def encode_frames(readings):
+    """
+    Frames for a list of reading dicts (the /submit-ecg fields; seq and timestamp
+    optional). Raises ValueError if a value does not fit the format.
+    """
+    frames = []
+    start = 0
+    while start < len(readings):
+        first = readings[start]
+        flags = (FLAG_SEQ if first.get("seq") is not None else 0) | (FLAG_TIME if first.get("timestamp") else 0)
+        seqs = [first["seq"]] if flags & FLAG_SEQ else []
+        times = [_epoch_ms(first["timestamp"])] if flags & FLAG_TIME else []
+        if flags & FLAG_SEQ and not 0 <= first["seq"] <= 0xFFFFFFFF:
+            raise ValueError("seq out of range for the binary format")
+        end = start + 1
+        while end < len(readings) and end - start < MAX_COUNT:
+            reading = readings[end]
+            has_seq = reading.get("seq") is not None
+            has_time = bool(reading.get("timestamp"))
+            if has_seq != bool(flags & FLAG_SEQ) or has_time != bool(flags & FLAG_TIME):
+                break
+            if has_seq and not 0 <= reading["seq"] - seqs[-1] <= 0xFF:
+                break
+            if has_time:
+                ms = _epoch_ms(reading["timestamp"])
+                if not 0 <= ms - times[-1] <= 0xFFFF:
+                    break
+                times.append(ms)
+            if has_seq:
+                seqs.append(reading["seq"])
+            end += 1
+        frames.append(_pack(readings[start:end], flags, seqs, times))
+        start = end
+    return b"".join(frames)
+
+
+def decode_frames(body):
+    """Reading dicts (the /submit-ecg fields, plus seq and timestamp when sent) from one or more frames"""
+    view = memoryview(body)
+    readings = []
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < HEADER.size:
+            raise ValueError("Truncated frame header")
+        magic, version, flags, count, base_seq, base_ms = HEADER.unpack_from(view, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not an ECG frame (magic {bytes(magic)!r}, version {version})")
+        offset += HEADER.size
+        if len(view) - offset < count * RECORD.itemsize:
+            raise ValueError(f"Frame declares {count} readings but the body ends early")
+        records = np.frombuffer(view, dtype=RECORD, count=count, offset=offset)
+        offset += count * RECORD.itemsize
+
+        columns = {
+            field: (records[field] / scale if scale != 1 else records[field]).tolist()
+            for field, scale in SCALES.items()
+        }
+        if flags & FLAG_SEQ:
+            columns["seq"] = (base_seq + np.cumsum(records["dseq"], dtype=np.int64)).tolist()
+        if flags & FLAG_TIME:
+            seconds = (base_ms + np.cumsum(records["dt_ms"], dtype=np.int64)) / 1000
+            columns["timestamp"] = [datetime.fromtimestamp(t, timezone.utc) for t in seconds.tolist()]
+        names = tuple(columns)
+        readings.extend(dict(zip(names, values)) for values in zip(*columns.values()))
+    return readings
@@ -1,13 +1,25 @@
 import serial
 import requests
+import threading
 import time
 import json
 import sys
+from datetime import datetime, timezone
+
+from esp_uploader import ECGSpool, ECGUploader
 
 SERIAL_PORT = '/dev/cu.SLAB_USBtoUART'  # Change to your port, e.g., COM3 on Windows
 BAUD_RATE = 9600
 BACKEND_URL = 'http://localhost:8000'
 
+# Readings are spooled to disk and uploaded in batches; the spool survives restarts and backend outages
+SPOOL_PATH = 'ecg_spool.db'
+UPLOAD_BATCH_SIZE = 50
+UPLOAD_FLUSH_INTERVAL_S = 1.0
+# 'frames' sends compact binary batches (~14 bytes per reading, for metered links); 'json' sends plain JSON
+UPLOAD_WIRE_FORMAT = 'frames'
+STATS_INTERVAL_S = 10
+
 # Get patient email from command line or prompt user
 if len(sys.argv) > 1:
     PATIENT_EMAIL = sys.argv[1]
@@ -38,62 +50,85 @@ else:
     print(f"❌ Failed to connect to backend: {setup_response.status_code}")
     exit(1)
 
-ser = serial.Serial(SERIAL_PORT, BAUD_RATE)
-print(f"Listening on {SERIAL_PORT} at {BAUD_RATE} baud...")
+spool = ECGSpool(SPOOL_PATH)
+backlog = spool.backlog()
+if backlog:
+    print(f"📦 Replaying {backlog} spooled readings from a previous run")
+uploader = ECGUploader(
+    spool,
+    BACKEND_URL,
+    batch_size=UPLOAD_BATCH_SIZE,
+    flush_interval=UPLOAD_FLUSH_INTERVAL_S,
+    stats_interval=STATS_INTERVAL_S,
+    wire=UPLOAD_WIRE_FORMAT,
+)
+uploader.start()
 
-while True:
+def parse_line(line):
+    # Expecting: heartRate,rrInterval,tempF,qrs,hrv,st
+    parts = line.split(",")
+    if len(parts) != 6:
+        print(f"Malformed line: {line} (expected 6 values, got {len(parts)})")
+        return None
+    
+    heart_rate, rr_interval, temp_f, qrs, hrv, st = parts
+    
+    # Convert to proper data types; stamped now so a reading replayed from the spool keeps its sample time
     try:
-        line = ser.readline().decode().strip()
-        if not line:
-            continue
-        # Expecting: heartRate,rrInterval,tempF,qrs,hrv,st
-        parts = line.split(",")
-        if len(parts) != 6:
-            print(f"Malformed line: {line} (expected 6 values, got {len(parts)})")
-            continue
-        
-        heart_rate, rr_interval, temp_f, qrs, hrv, st = parts
-        
-        # Convert to proper data types
-        try:
-            heart_rate = int(heart_rate) if heart_rate != '0' else 0
-            rr_interval = int(rr_interval) if rr_interval != '0' else 0
-            temp_f = float(temp_f)
-            qrs = int(qrs)
-            hrv = int(hrv)
-            st = float(st)
-        except ValueError as e:
-            print(f"Error converting values: {e}, line: {line}")
-            continue
-        
-        payload = {
+        return {
             "patient_id": PATIENT_ID,
-            "heart_rate": heart_rate,
-            "rr_interval": rr_interval,
-            "temperature": temp_f,
-            "qrs_duration": qrs,
-            "heart_rate_variability": hrv,
-            "st_segment": st
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "heart_rate": int(heart_rate),
+            "rr_interval": int(rr_interval),
+            "temperature": float(temp_f),
+            "qrs_duration": int(qrs),
+            "heart_rate_variability": int(hrv),
+            "st_segment": float(st)
         }
-        r = requests.post(f"{BACKEND_URL}/submit-ecg", json=payload)
-        if r.status_code == 200:
-            response_data = r.json()
-            if response_data.get("success"):
-                print(f"✅ Sent ECG data: HR={heart_rate}, Temp={temp_f:.1f}°F")
-            else:
-                print(f"❌ Backend error: {response_data}")
-        else:
-            print(f"❌ HTTP error {r.status_code}: {r.text}")
-        time.sleep(0.5)  # Reduced delay for more responsive updates
-    except serial.SerialException as e:
-        print(f"Serial error: {e}")
-        time.sleep(2)
+    except ValueError as e:
+        print(f"Error converting values: {e}, line: {line}")
+        return None
+
+def read_serial(stop):
+    """Serial-reading thread: parse each line and spool it; never waits on the network"""
+    ser = serial.Serial(SERIAL_PORT, BAUD_RATE)
+    print(f"Listening on {SERIAL_PORT} at {BAUD_RATE} baud...")
+    
+    while not stop.is_set():
         try:
-            ser.close()
-            ser = serial.Serial(SERIAL_PORT, BAUD_RATE)
-            print("Reconnected to serial port")
-        except:
-            print("Failed to reconnect to serial port")
-    except Exception as e:
-        print(f"Error: {e}")
-        time.sleep(2)
+            line = ser.readline().decode().strip()
+            if not line:
+                continue
+            payload = parse_line(line)
+            if payload is None:
+                continue
+            spool.append(payload)
+            uploader.notify()
+        except serial.SerialException as e:
+            print(f"Serial error: {e}")
+            time.sleep(2)
+            try:
+                ser.close()
+                ser = serial.Serial(SERIAL_PORT, BAUD_RATE)
+                print("Reconnected to serial port")
+            except:
+                print("Failed to reconnect to serial port")
+        except Exception as e:
+            print(f"Error: {e}")
+            time.sleep(2)
+    ser.close()
+    spool.close()
+
+stop = threading.Event()
+reader = threading.Thread(target=read_serial, args=(stop,), name="serial-reader", daemon=True)
+reader.start()
+
+try:
+    while reader.is_alive():
+        reader.join(1)
+except KeyboardInterrupt:
+    print("\nStopping...")
+finally:
+    stop.set()
+    uploader.stop()
+    print(f"Stopped with {ECGSpool(SPOOL_PATH).backlog()} readings spooled for the next run")
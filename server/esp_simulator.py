@@ -1,97 +1,337 @@
 #!/usr/bin/env python3
 """
 ESP32 ECG Data Simulator
-Simulates ECG data for testing without requiring actual hardware
+Simulates many virtual ECG devices without requiring actual hardware and
+reports achieved throughput and p50/p95/p99 latency per endpoint
+
+By default the FastAPI app runs in-process against an in-memory stand-in for
+Supabase, so no server, database or network is needed. --storage sqlite runs
+it on the local SQLite backend instead, and --target sends the same load to a
+running backend.
+
+Usage:
+  python esp_simulator.py                                        # 50 devices, 1 reading/s each, 30 s
+  python esp_simulator.py --devices 500 --rate 2 --mode batch --batch-size 20
+  python esp_simulator.py --devices 500 --rate 2 --mode frames --batch-size 20     # binary frames (ecg_wire.py)
+  python esp_simulator.py --mode raw --fs 250 --chunk 2 --anomaly-rate 0.02
+  python esp_simulator.py --db-latency-ms 20 --output baseline.json   # emulate a hosted database
+  python esp_simulator.py --storage sqlite --sqlite-path /tmp/sim.db
+  python esp_simulator.py --target http://localhost:8000 --patient-email patient@demo.com --devices 1 --rate 0.5
 """
 
-import requests
-import time
+import argparse
+import asyncio
+import base64
 import json
-import sys
+import os
 import random
-import math
-
-BACKEND_URL = 'http://localhost:8000'
-
-# Get patient email from command line or prompt user
-if len(sys.argv) > 1:
-    PATIENT_EMAIL = sys.argv[1]
-else:
-    PATIENT_EMAIL = input("Enter patient email address: ").strip()
-
-if not PATIENT_EMAIL:
-    print("❌ Patient email is required!")
-    exit(1)
-
-# Setup device and get patient ID
-print(f"Setting up ECG device for {PATIENT_EMAIL}...")
-setup_response = requests.post(f"{BACKEND_URL}/setup-ecg-device", json={
-    "patient_email": PATIENT_EMAIL,
-    "device_name": "ESP32 ECG Monitor (Simulator)"
-})
-
-if setup_response.status_code == 200:
-    setup_data = setup_response.json()
-    if setup_data.get("success"):
-        PATIENT_ID = setup_data["patient_id"]
-        print(f"✅ Device setup complete! Patient ID: {PATIENT_ID}")
-    else:
-        print(f"❌ Device setup failed: {setup_data.get('error')}")
-        print("Make sure you are logged in to the web app and the user exists in the database.")
-        exit(1)
-else:
-    print(f"❌ Failed to connect to backend: {setup_response.status_code}")
-    exit(1)
-
-print("📊 Starting ECG simulation...")
-print("Press Ctrl+C to stop")
-
-# Simulation variables
-base_heart_rate = 72
-time_offset = 0
-
-try:
-    while True:
-        # Simulate realistic ECG values
-        time_offset += 1
-        
-        # Simulate heart rate with some variation (60-85 BPM)
-        heart_rate = base_heart_rate + random.randint(-8, 8)
-        
-        # Calculate RR interval from heart rate (in milliseconds)
-        rr_interval = int(60000 / heart_rate) if heart_rate > 0 else 0
-        
-        # Simulate temperature with small variations (98-99°F)
-        temp_f = 98.6 + random.uniform(-0.5, 0.5)
-        
-        # Simulate other ECG parameters
-        qrs = random.randint(80, 120)  # QRS duration in ms
-        hrv = random.randint(30, 60)   # Heart rate variability
-        st = random.uniform(0.0, 0.2)  # ST segment elevation
-        
-        payload = {
-            "patient_id": PATIENT_ID,
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+from bench_qrs import synthesize_ecg
+from ecg_wire import encode_frames
+
+# Anomaly episodes injected with --anomaly-rate: (kind, readings it lasts)
+EPISODES = [("tachycardia", 15), ("bradycardia", 15), ("st_elevation", 5), ("fever", 30)]
+
+
+class VirtualDevice:
+    def __init__(self, index, patient_id, rng, anomaly_rate):
+        self.index = index
+        self.patient_id = patient_id
+        self.rng = rng
+        self.anomaly_rate = anomaly_rate
+        # Each device gets its own resting heart rate, like the original single-device simulator's 72 BPM
+        self.base_heart_rate = rng.randint(62, 82)
+        self.episode = None
+        self.episode_left = 0
+        self.anomalies_injected = 0
+
+    def _advance_episode(self):
+        if self.episode_left:
+            self.episode_left -= 1
+        elif self.rng.random() < self.anomaly_rate:
+            self.episode, self.episode_left = self.rng.choice(EPISODES)
+            self.anomalies_injected += 1
+        else:
+            self.episode = None
+        return self.episode if self.episode_left else None
+
+    def reading(self):
+        episode = self._advance_episode()
+        heart_rate = self.base_heart_rate + self.rng.randint(-8, 8)
+        temp_f = 98.6 + self.rng.uniform(-0.5, 0.5)
+        st = self.rng.uniform(0.0, 0.08)
+        if episode == "tachycardia":
+            heart_rate = self.rng.randint(125, 145)
+        elif episode == "bradycardia":
+            heart_rate = self.rng.randint(38, 48)
+        elif episode == "st_elevation":
+            st = self.rng.uniform(0.15, 0.3)
+        elif episode == "fever":
+            temp_f = self.rng.uniform(100.8, 102.5)
+        return {
+            "patient_id": self.patient_id,
             "heart_rate": heart_rate,
-            "rr_interval": rr_interval,
-            "temperature": temp_f,
-            "qrs_duration": qrs,
-            "heart_rate_variability": hrv,
-            "st_segment": st
+            "rr_interval": int(60000 / heart_rate),
+            "temperature": round(temp_f, 2),
+            "qrs_duration": self.rng.randint(80, 110),
+            "heart_rate_variability": self.rng.randint(30, 60),
+            "st_segment": round(st, 3),
         }
-        
-        r = requests.post(f"{BACKEND_URL}/submit-ecg", json=payload)
-        if r.status_code == 200:
-            response_data = r.json()
-            if response_data.get("success"):
-                print(f"✅ Sent ECG data: HR={heart_rate} BPM, Temp={temp_f:.1f}°F, RR={rr_interval}ms")
-            else:
-                print(f"❌ Backend error: {response_data}")
+
+    def waveform(self, recordings, chunk):
+        """Next chunk of raw samples, switching to a tachycardic recording during an episode."""
+        episode = self._advance_episode()
+        normal, fast = recordings
+        source = fast if episode in ("tachycardia", "st_elevation") else normal
+        if not hasattr(self, "_offset"):
+            self._offset = self.rng.randrange(0, len(normal) - chunk)
+        if self._offset + chunk > len(source):
+            self._offset = 0
+        samples = source[self._offset:self._offset + chunk]
+        self._offset += chunk
+        return base64.b64encode(samples.astype("<i2").tobytes()).decode()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.readings = defaultdict(int)
+        self.behind_schedule = 0
+
+    async def send(self, client, endpoint, readings, **kwargs):
+        started = time.perf_counter()
+        try:
+            r = await client.post(endpoint, **kwargs)
+            status = r.status_code
+            ok = status == 200 and r.json().get("success", True) is not False
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+            ok = False
+        self.latencies[endpoint].append((time.perf_counter() - started) * 1000)
+        self.statuses[endpoint][status] += 1
+        if ok:
+            self.readings[endpoint] += readings
+        else:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed):
+        rows = []
+        for endpoint, latencies in sorted(self.latencies.items()):
+            lat = np.asarray(latencies)
+            rows.append({
+                "endpoint": endpoint,
+                "requests": len(lat),
+                "requests_per_s": round(len(lat) / elapsed, 1),
+                "readings_per_s": round(self.readings[endpoint] / elapsed, 1),
+                "errors": self.errors[endpoint],
+                "p50_ms": round(float(np.percentile(lat, 50)), 2),
+                "p95_ms": round(float(np.percentile(lat, 95)), 2),
+                "p99_ms": round(float(np.percentile(lat, 99)), 2),
+                "max_ms": round(float(lat.max()), 2),
+                "statuses": {str(k): v for k, v in self.statuses[endpoint].items()},
+            })
+        return rows
+
+
+async def run_device(device, client, recorder, args, deadline, recordings):
+    loop = asyncio.get_running_loop()
+    if args.mode in ("batch", "frames"):
+        interval = args.batch_size / args.rate
+    elif args.mode == "raw":
+        interval = args.chunk
+    else:
+        interval = 1.0 / args.rate
+    chunk = int(args.chunk * args.fs)
+
+    # Stagger devices across the first interval so they don't fire in lockstep
+    next_at = loop.time() + device.rng.uniform(0, interval)
+    while next_at < deadline:
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -interval:
+            # Open-loop schedule: count sends that started more than one interval late
+            recorder.behind_schedule += 1
+
+        if args.mode == "batch":
+            readings = [device.reading() for _ in range(args.batch_size)]
+            await recorder.send(client, "/submit-ecg/batch", len(readings), json=readings)
+        elif args.mode == "frames":
+            readings = [device.reading() for _ in range(args.batch_size)]
+            await recorder.send(
+                client, "/submit-ecg/frames", len(readings),
+                params={"patient_id": device.patient_id},
+                content=encode_frames(readings),
+                headers={"Content-Type": "application/octet-stream"},
+            )
+        elif args.mode == "raw":
+            payload = {
+                "patient_id": device.patient_id,
+                "sample_rate": args.fs,
+                "samples": device.waveform(recordings, chunk),
+                "temperature": 98.6,
+            }
+            await recorder.send(client, "/submit-ecg/raw", 1, json=payload)
         else:
-            print(f"❌ HTTP error {r.status_code}: {r.text}")
-        
-        time.sleep(2)  # Send data every 2 seconds
-        
-except KeyboardInterrupt:
-    print("\n🛑 Simulation stopped by user")
-except Exception as e:
-    print(f"❌ Error: {e}")
+            await recorder.send(client, "/submit-ecg", 1, json=device.reading())
+        next_at += interval
+
+
+async def setup_devices(client, emails, concurrency=20):
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def setup(email):
+        async with limiter:
+            r = await client.post("/setup-ecg-device", json={
+                "patient_email": email,
+                "device_name": "ESP32 ECG Monitor (Simulator)"
+            })
+            data = r.json()
+            if not data.get("success"):
+                raise RuntimeError(f"Device setup failed for {email}: {data.get('error')}")
+            return data["patient_id"]
+
+    return await asyncio.gather(*(setup(email) for email in emails))
+
+
+async def simulate(args, client):
+    rng = random.Random(args.seed)
+    if args.target:
+        # A real backend only knows real users; every virtual device reports for the same patient
+        patient_ids = await setup_devices(client, [args.patient_email]) * args.devices
+    else:
+        patient_ids = await setup_devices(client, [f"sim-{i}@example.com" for i in range(args.devices)])
+    print(f"✅ {args.devices} virtual devices set up")
+
+    recordings = None
+    if args.mode == "raw":
+        np_rng = np.random.default_rng(args.seed)
+        recordings = (
+            synthesize_ecg(60, args.fs, 72, np_rng),
+            synthesize_ecg(60, args.fs, 135, np_rng),
+        )
+
+    devices = [
+        VirtualDevice(i, patient_id, random.Random(rng.random()), args.anomaly_rate)
+        for i, patient_id in enumerate(patient_ids)
+    ]
+    recorder = Recorder()
+    print(f"📊 Running {args.mode} load for {args.duration:g}s...")
+    started = time.perf_counter()
+    deadline = asyncio.get_running_loop().time() + args.duration
+    await asyncio.gather(*(run_device(d, client, recorder, args, deadline, recordings) for d in devices))
+    elapsed = time.perf_counter() - started
+
+    results = recorder.report(elapsed)
+    stats = (await client.get("/submit-ecg/stats")).json()
+    return {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 2),
+        "behind_schedule": recorder.behind_schedule,
+        "anomaly_episodes_injected": sum(d.anomalies_injected for d in devices),
+        "endpoints": results,
+        "server": stats,
+    }
+
+
+async def run_in_process(args):
+    # Configure the app before importing it: no model, no real Supabase or Gemini
+    os.environ.setdefault("SUPABASE_URL", "http://memory.local")
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "memory")
+    os.environ.setdefault("GEMINI_API_KEY", "memory")
+    os.environ["MODEL_LOAD_MODE"] = "off"
+
+    import main
+    from db import SupabaseDB
+    from memory_postgrest import MemoryPostgREST
+    from storage import SupabaseStorage, SQLiteStorage
+
+    profiles = [
+        {"id": f"00000000-0000-0000-0000-{i:012d}", "email": f"sim-{i}@example.com", "full_name": f"Sim Patient {i}", "role": "patient"}
+        for i in range(args.devices)
+    ]
+    await main.storage.close()
+    if args.storage == "sqlite":
+        main.storage = SQLiteStorage(args.sqlite_path)
+        for profile in profiles:
+            if not await main.storage.get_profile_by_email(profile["email"]):
+                await main.storage.create_profile(profile)
+    else:
+        store = MemoryPostgREST(latency_ms=args.db_latency_ms)
+        store.seed("profiles", profiles)
+        main.storage = SupabaseStorage(SupabaseDB("http://memory.local", "memory", transport=store))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://simulator", timeout=args.timeout) as client:
+            result = await simulate(args, client)
+    if args.storage == "memory":
+        result["database_requests"] = store.requests
+        result["rows_written"] = len(store.table("ecg_readings"))
+    return result
+
+
+async def run_against_target(args):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout, limits=limits) as client:
+        return await simulate(args, client)
+
+
+def print_report(result):
+    print(f"\n{'endpoint':<20} {'requests':>8} {'req/s':>8} {'readings/s':>10} {'errors':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for row in result["endpoints"]:
+        print(f"{row['endpoint']:<20} {row['requests']:>8} {row['requests_per_s']:>8} {row['readings_per_s']:>10} "
+              f"{row['errors']:>6} {row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8} {row['max_ms']:>8}")
+        if row["errors"]:
+            print(f"  statuses: {row['statuses']}")
+    print(f"\nelapsed {result['elapsed_s']}s, sends behind schedule: {result['behind_schedule']}, "
+          f"anomaly episodes injected: {result['anomaly_episodes_injected']}")
+    if "rows_written" in result:
+        print(f"in-memory database: {result['database_requests']} requests, {result['rows_written']} ECG rows written")
+    buffer = result["server"].get("buffer", {})
+    print(f"server buffer: flushed {buffer.get('flushed')}, pending {buffer.get('pending')}, rejected {buffer.get('rejected')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=1.0, help="readings per second per device (json/batch/frames modes)")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mode", choices=["json", "batch", "frames", "raw"], default="json")
+    parser.add_argument("--batch-size", type=int, default=20, help="readings per batch/frames request")
+    parser.add_argument("--fs", type=int, default=250, help="raw mode sample rate")
+    parser.add_argument("--chunk", type=float, default=2.0, help="raw mode seconds of samples per upload")
+    parser.add_argument("--anomaly-rate", type=float, default=0.0, help="chance per reading of starting an anomaly episode")
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="memory", help="in-process storage backend")
+    parser.add_argument("--sqlite-path", default=":memory:", help="with --storage sqlite: database file")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="in-process memory storage: emulated database round trip")
+    parser.add_argument("--target", help="base URL of a running backend instead of the in-process app")
+    parser.add_argument("--patient-email", default="patient@demo.com", help="with --target: patient every device reports for")
+    parser.add_argument("--connections", type=int, default=100, help="with --target: HTTP connection pool size")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the full result as JSON (for comparing runs)")
+    args = parser.parse_args()
+
+    try:
+        result = asyncio.run(run_against_target(args) if args.target else run_in_process(args))
+    except KeyboardInterrupt:
+        print("\n🛑 Simulation stopped by user")
+        return
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Durable, batching uploader for ECG readings coming off a device.
+
+Readings are appended to an on-disk SQLite spool (WAL mode) as soon as they
+are parsed, so the serial side never waits on the network. A separate
+uploader thread sends the oldest spooled readings to /submit-ecg/batch over
+one pooled HTTP session and deletes them only once the backend has accepted
+them. While the backend is slow or down the spool simply grows and is
+replayed in order when it comes back. A batch the backend refuses outright
+(a 4xx, or a 200 with success false) is dropped so it cannot block the spool.
+
+Each reading goes out with its spool row id as `seq`. AUTOINCREMENT never
+reuses an id, so the numbers keep growing across restarts, and a batch that
+is re-sent after a lost response is recognised and dropped by the backend.
+
+With wire="frames" batches are sent as compact binary frames (ecg_wire.py)
+to /submit-ecg/frames, about 14 bytes per reading instead of ~200 of JSON.
+A batch the format cannot hold goes as JSON, and a backend without the
+frames endpoint switches the uploader back to JSON for good.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ecg_wire import encode_frames
+
+
+class ECGSpool:
+    """Append-only FIFO of readings in SQLite; each thread gets its own connection."""
+
+    def __init__(self, path, max_rows=1_000_000):
+        self.path = path
+        self.max_rows = max_rows
+        self.dropped = 0
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS readings (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL survives process crashes; only an OS crash can lose the last commits
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, reading):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO readings (payload) VALUES (?)", (json.dumps(reading),))
+
+    def peek(self, limit):
+        """Oldest `limit` readings as (id, reading) pairs."""
+        rows = self._conn().execute("SELECT id, payload FROM readings ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def ack(self, last_id):
+        """Remove every reading up to and including last_id."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM readings WHERE id <= ?", (last_id,))
+
+    def trim(self):
+        """Drop the oldest readings beyond max_rows so a long outage cannot fill the disk."""
+        excess = self.backlog() - self.max_rows
+        if excess > 0:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM readings WHERE id IN (SELECT id FROM readings ORDER BY id LIMIT ?)", (excess,))
+            self.dropped += excess
+        return max(0, excess)
+
+    def backlog(self):
+        return self._conn().execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class ECGUploader(threading.Thread):
+    """Drains an ECGSpool to the backend's batch endpoint."""
+
+    def __init__(self, spool, backend_url, batch_size=50, flush_interval=1.0, timeout=10.0,
+                 max_backoff=30.0, stats_interval=10.0, wire="json"):
+        super().__init__(name="ecg-uploader", daemon=True)
+        self.spool = spool
+        self.url = f"{backend_url}/submit-ecg/batch"
+        self.frames_url = f"{backend_url}/submit-ecg/frames"
+        self.wire = wire
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.stats_interval = stats_interval
+
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._drain_deadline = 0.0
+        self._last_send = 0.0
+        self._backoff = 0.0
+
+        self.stats = {"spooled": 0, "uploaded": 0, "duplicates": 0, "rejected": 0, "batches": 0, "failures": 0, "bytes_sent": 0}
+
+    def notify(self, spooled=1):
+        """Called by the reader after appending to the spool."""
+        self.stats["spooled"] += spooled
+        self._wakeup.set()
+
+    def stop(self, drain_timeout=5.0):
+        """Stop the thread, giving it up to drain_timeout seconds to send what is spooled."""
+        self._drain_deadline = time.monotonic() + drain_timeout
+        self._stopping.set()
+        self._wakeup.set()
+        self.join(drain_timeout + self.timeout)
+
+    def run(self):
+        last_stats = time.monotonic()
+        last_uploaded = 0
+        while True:
+            if self._stopping.is_set() and time.monotonic() >= self._drain_deadline:
+                break
+
+            batch = self.spool.peek(self.batch_size)
+            if not batch:
+                if self._stopping.is_set():
+                    break
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+            elif len(batch) < self.batch_size and not self._stopping.is_set() and time.monotonic() - self._last_send < self.flush_interval:
+                # Let a partial batch fill up until the flush interval has passed
+                self._wakeup.wait(self.flush_interval - (time.monotonic() - self._last_send))
+                self._wakeup.clear()
+            elif not self._send(batch):
+                if self._stopping.is_set():
+                    break
+                self._stopping.wait(self._backoff)
+
+            now = time.monotonic()
+            if now - last_stats >= self.stats_interval:
+                rate = (self.stats["uploaded"] - last_uploaded) / (now - last_stats)
+                print(f"📊 Uploaded {self.stats['uploaded']} ({rate:.1f}/s), backlog {self.spool.backlog()}, "
+                      f"sent {self.stats['bytes_sent'] // 1024} KB, failures {self.stats['failures']}, duplicates {self.stats['duplicates']}, rejected {self.stats['rejected']}, dropped {self.spool.dropped}")
+                last_stats, last_uploaded = now, self.stats["uploaded"]
+        self.session.close()
+        self.spool.close()
+
+    def _send(self, batch):
+        """Post one batch; returns True once it is off the spool, False to retry after a backoff."""
+        self._last_send = time.monotonic()
+        try:
+            payload = [{"seq": row_id, **reading} for row_id, reading in batch]
+            r = self._post_frames(payload) if self.wire == "frames" else None
+            if r is None:
+                body = json.dumps(payload).encode()
+                self.stats["bytes_sent"] += len(body)
+                r = self.session.post(self.url, data=body, headers={"Content-Type": "application/json"}, timeout=self.timeout)
+        except requests.RequestException as e:
+            return self._failed(f"Backend unreachable: {e}")
+
+        if self.wire == "frames" and r.status_code in (404, 405):
+            print("⚠️ Backend has no /submit-ecg/frames endpoint; uploading JSON from now on")
+            self.wire = "json"
+            return self._send(batch)
+
+        if r.status_code == 503:
+            return self._failed("Backend busy", retry_after=r.headers.get("Retry-After"))
+        if r.status_code != 200:
+            if 400 <= r.status_code < 500:
+                # The backend will never accept this batch; retrying would block the spool forever
+                print(f"❌ Dropping batch of {len(batch)}: HTTP {r.status_code}: {r.text[:200]}")
+                self.stats["rejected"] += len(batch)
+                self.spool.ack(batch[-1][0])
+                return True
+            return self._failed(f"HTTP error {r.status_code}")
+
+        body = r.json()
+        if not body.get("success"):
+            # A 200 means the backend handled the batch and refused it; transient errors come back as 5xx
+            print(f"❌ Dropping batch of {len(batch)}: {body.get('error')}")
+            self.stats["rejected"] += len(batch)
+            self.spool.ack(batch[-1][0])
+            self._backoff = 0.0
+            return True
+        for item in body.get("rejected", []):
+            print(f"❌ Reading rejected: {item.get('error')}")
+        self.stats["rejected"] += len(body.get("rejected", []))
+        self.stats["uploaded"] += body.get("accepted", 0)
+        self.stats["duplicates"] += body.get("duplicates", 0)
+        self.stats["batches"] += 1
+        self.spool.ack(batch[-1][0])
+        self._backoff = 0.0
+        return True
+
+    def _post_frames(self, payload):
+        """POST the batch as binary frames, or return None if it has to go as JSON."""
+        patient_ids = {reading["patient_id"] for reading in payload}
+        if len(patient_ids) != 1:
+            return None
+        try:
+            body = encode_frames(payload)
+        except ValueError as e:
+            print(f"⚠️ Sending batch as JSON: {e}")
+            return None
+        self.stats["bytes_sent"] += len(body)
+        return self.session.post(
+            self.frames_url,
+            params={"patient_id": patient_ids.pop()},
+            data=body,
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=self.timeout,
+        )
+
+    def _failed(self, reason, retry_after=None):
+        self.stats["failures"] += 1
+        self._backoff = min(self.max_backoff, max(1.0, self._backoff * 2))
+        if retry_after and retry_after.isdigit():
+            self._backoff = max(self._backoff, float(retry_after))
+        self.spool.trim()
+        print(f"⚠️ {reason}; retrying in {self._backoff:.0f}s (backlog {self.spool.backlog()})")
+        return False
@@ -0,0 +1,221 @@
+"""
+Bounded worker pool and micro-batching for blocking model inference.
+
+FastAPI endpoints are async, so a CPU forward pass run inline blocks every
+other request on the event loop. InferencePool runs those calls on a
+dedicated thread pool and caps how many can be queued; once the cap is hit
+callers get PoolSaturatedError and should answer 503 with Retry-After.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the inference queue is full."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    def __init__(self, workers=1, max_queue=8, retry_after=2):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "total_run_ms": 0.0,
+            "last_wait_ms": 0.0,
+            "last_run_ms": 0.0,
+        }
+
+    @property
+    def queue_depth(self):
+        return self._queued
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool and await its result."""
+        with self._lock:
+            # Requests waiting for a free worker count against the bound;
+            # ones already running do not.
+            if self._queued >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise PoolSaturatedError(
+                    f"Inference queue full ({self._queued} waiting, {self._running} running)",
+                    retry_after=self.retry_after,
+                )
+            self._queued += 1
+            self.stats["submitted"] += 1
+
+        enqueued_at = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                wait_ms = (started - enqueued_at) * 1000
+                self.stats["total_wait_ms"] += wait_ms
+                self.stats["last_wait_ms"] = wait_ms
+                self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                run_ms = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    self._running -= 1
+                    self.stats["total_run_ms"] += run_ms
+                    self.stats["last_run_ms"] = run_ms
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, job)
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        self.stats["completed"] += 1
+        return result
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def snapshot(self):
+        started = self.stats["completed"] + self.stats["failed"]
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self._queued,
+            "running": self._running,
+            "avg_wait_ms": round(self.stats["total_wait_ms"] / started, 2) if started else 0.0,
+            "avg_run_ms": round(self.stats["total_run_ms"] / started, 2) if started else 0.0,
+            **self.stats,
+        }
+
+
+class MicroBatcher:
+    """
+    Collects single-item requests into batches for one batched forward pass.
+
+    A batch is dispatched when `max_batch` items are waiting or the oldest
+    has waited `max_wait_ms`, whichever comes first. `batch_fn` takes a list
+    of items and returns a list of results in the same order; it runs on
+    `pool`, with at most one batch in flight per pool worker.
+    """
+
+    def __init__(self, batch_fn, pool, max_batch=8, max_wait_ms=10, max_pending=32):
+        self.batch_fn = batch_fn
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._inflight = set()
+
+        self.stats = {
+            "items": 0,
+            "batches": 0,
+            "rejected": 0,
+            "max_batch_seen": 0,
+        }
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.pool.workers)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def check_capacity(self):
+        """Raise PoolSaturatedError if submit() would be rejected right now."""
+        if self._queue is not None and self._queue.qsize() >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise PoolSaturatedError(
+                f"Inference queue full ({self._queue.qsize()} images waiting)",
+                retry_after=self.pool.retry_after,
+            )
+
+    async def submit(self, item):
+        """Queue one item and wait for its result."""
+        if self._task is None:
+            await self.start()
+        self.check_capacity()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            # Wait for a free worker before collecting, so items that arrive
+            # while every worker is busy end up in the next batch.
+            await self._slots.acquire()
+            item, future = await self._queue.get()
+            batch = [(item, future)]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            items = [item for item, _ in batch]
+            self.stats["items"] += len(items)
+            self.stats["batches"] += 1
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(items))
+            try:
+                results = await self.pool.run(self.batch_fn, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def snapshot(self):
+        batches = self.stats["batches"]
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_pending": self.max_pending,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "avg_batch_size": round(self.stats["items"] / batches, 2) if batches else 0.0,
+            **self.stats,
+        }
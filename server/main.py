@@ -1,17 +1,39 @@
+import time
+_startup_started = time.perf_counter()
+startup_timings = {}
+
 import os
-from fastapi import FastAPI, UploadFile, File, Form, Request
+import asyncio
+import hmac
+import logging
+from fastapi import FastAPI, UploadFile, File, Form, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, TypeAdapter
 from dotenv import load_dotenv
-import httpx
-import supabase
-import torch
-from transformers import AutoModelForImageClassification, AutoImageProcessor
-from PIL import Image
-import io
+import json
 import google.generativeai as genai
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from ecg_ingest import ECGWriteBuffer, BufferFullError
+from ecg_sequence import SequenceTracker, DUPLICATE, LATE
+from ecg_wire import decode_frames
+from device_cache import DeviceCache, TTLCache
+from inference import InferencePool, MicroBatcher, PoolSaturatedError
+from result_cache import ResultCache
+from scan_image import decode_scan, encode_jpeg
+from ecg_stream import ECGHub
+from ecg_query import parse_fields, encode_cursor, decode_cursor, lttb
+from qrs_detect import WaveformAnalyzer, decode_int16
+from anomaly_engine import AnomalyEngine
+from db import SupabaseDB
+from storage import SupabaseStorage, SQLiteStorage
+from reports import ReportJobs
+from chat_proxy import GeminiChat, ChatUpstreamError
+from telemetry import MetricsRegistry, MetricsMiddleware, configure_logging, process_memory
+from profiler import RequestProfiler, ProfilerMiddleware
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +43,119 @@ SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
 
+# Logging: level, "text" (key=value) or "json" lines, the fraction of per-reading events kept, and the slow-request threshold
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "2000"))
+
+# Admin endpoints (/admin/*) require this token in X-Admin-Token; they are not served at all when it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Sampling profiler: enabled at startup here or at runtime via /admin/profiler; route prefixes, fraction of their
+# requests profiled, stack sampling interval and where the collapsed-stack (flame graph) files go
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_ROUTES = [r.strip() for r in os.getenv("PROFILER_ROUTES", "/upload-mri,/submit-ecg").split(",") if r.strip()]
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0.05"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_DIR = os.getenv("PROFILER_DIR", "profiles")
+
+# Storage backend: "supabase" (hosted) or "sqlite" (local WAL database at SQLITE_PATH, no cloud dependency)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "medipulse.db")
+
+# Supabase connection pool: per-query deadline, pooled connections and how long idle keep-alive connections live
+SUPABASE_TIMEOUT_S = float(os.getenv("SUPABASE_TIMEOUT_S", "10"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+SUPABASE_KEEPALIVE_S = float(os.getenv("SUPABASE_KEEPALIVE_S", "30"))
+
+# ECG write-behind buffer: flush after this many rows or this many ms, whichever comes first
+ECG_FLUSH_ROWS = int(os.getenv("ECG_FLUSH_ROWS", "200"))
+ECG_FLUSH_INTERVAL_MS = int(os.getenv("ECG_FLUSH_INTERVAL_MS", "1000"))
+ECG_BUFFER_MAX_ROWS = int(os.getenv("ECG_BUFFER_MAX_ROWS", "10000"))
+
+# Device-sequenced readings: sequence numbers remembered per device for duplicate suppression, devices tracked, and
+# how far a device timestamp may run ahead of or behind server time before arrival time is stored instead
+ECG_SEQ_WINDOW = int(os.getenv("ECG_SEQ_WINDOW", "4096"))
+ECG_SEQ_MAX_DEVICES = int(os.getenv("ECG_SEQ_MAX_DEVICES", "10000"))
+ECG_MAX_CLOCK_SKEW_S = float(os.getenv("ECG_MAX_CLOCK_SKEW_S", "300"))
+ECG_MAX_BACKFILL_H = float(os.getenv("ECG_MAX_BACKFILL_H", "168"))
+
+# Anomaly engine: patients whose rolling windows and counters are kept in memory (least recently seen are dropped)
+ANOMALY_MAX_PATIENTS = int(os.getenv("ANOMALY_MAX_PATIENTS", "10000"))
+
+# Raw waveform ingest: streaming QRS detectors kept per patient, and how long one survives without a new chunk
+WAVEFORM_ANALYZER_MAX = int(os.getenv("WAVEFORM_ANALYZER_MAX", "10000"))
+WAVEFORM_ANALYZER_TTL_S = float(os.getenv("WAVEFORM_ANALYZER_TTL_S", "300"))
+
+# patient_id -> device UUID cache used on the ECG ingest path
+DEVICE_CACHE_TTL_S = float(os.getenv("DEVICE_CACHE_TTL_S", "300"))
+DEVICE_CACHE_MAX_ENTRIES = int(os.getenv("DEVICE_CACHE_MAX_ENTRIES", "10000"))
+
+# /list-patients roster: pages are cached this long (patient writes made here clear them sooner) and capped at this size
+ROSTER_CACHE_TTL_S = float(os.getenv("ROSTER_CACHE_TTL_S", "30"))
+ROSTER_PAGE_MAX = int(os.getenv("ROSTER_PAGE_MAX", "500"))
+
+# Live ECG channel: recent readings kept in memory per patient, and when an unwatched patient's ring is dropped
+ECG_RING_SIZE = int(os.getenv("ECG_RING_SIZE", "256"))
+ECG_LIVE_MAX_PATIENTS = int(os.getenv("ECG_LIVE_MAX_PATIENTS", "10000"))
+ECG_LIVE_IDLE_S = float(os.getenv("ECG_LIVE_IDLE_S", "900"))
+
+# ECG history API: largest page (PostgREST caps responses at 1000 rows by default) and the most rows LTTB will read
+ECG_HISTORY_PAGE_ROWS = int(os.getenv("ECG_HISTORY_PAGE_ROWS", "1000"))
+ECG_HISTORY_MAX_ROWS = int(os.getenv("ECG_HISTORY_MAX_ROWS", "50000"))
+
+# Imaging inference pool: worker threads, requests allowed to wait, and the Retry-After sent when full
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "8"))
+INFERENCE_RETRY_AFTER_S = int(os.getenv("INFERENCE_RETRY_AFTER_S", "2"))
+
+# Micro-batching: run one forward pass per INFERENCE_MAX_BATCH images or INFERENCE_MAX_WAIT_MS, whichever comes first
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+INFERENCE_MAX_WAIT_MS = int(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+
+# CPU inference backend: torch (eager fp32), int8 (dynamic quantization) or onnx (ONNX Runtime, export cached in MODEL_CACHE_DIR)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+INFERENCE_BACKEND_ATOL = float(os.getenv("INFERENCE_BACKEND_ATOL", "0.05"))
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "model_cache")
+
+# /upload-mri result cache: in-memory LRU plus an optional size-bounded disk tier (disabled when MRI_CACHE_DIR is empty)
+MRI_CACHE_MAX_ENTRIES = int(os.getenv("MRI_CACHE_MAX_ENTRIES", "256"))
+MRI_CACHE_DIR = os.getenv("MRI_CACHE_DIR", "")
+MRI_CACHE_DISK_MAX_MB = int(os.getenv("MRI_CACHE_DISK_MAX_MB", "512"))
+
+# /upload-mri decoding: largest accepted upload, long edge of the decoded scan, size cap of the JPEG sent to Gemini,
+# and how many scans may be decoded at once (each decode holds about one MRI_DECODE_MAX_SIDE^2 RGB buffer)
+MRI_MAX_UPLOAD_MB = int(os.getenv("MRI_MAX_UPLOAD_MB", "100"))
+MRI_DECODE_MAX_SIDE = int(os.getenv("MRI_DECODE_MAX_SIDE", "1024"))
+MRI_GEMINI_MAX_KB = int(os.getenv("MRI_GEMINI_MAX_KB", "1024"))
+MRI_DECODE_CONCURRENCY = int(os.getenv("MRI_DECODE_CONCURRENCY", "2"))
+
+# Per-branch deadlines for /upload-mri; a branch that misses its deadline yields a partial result
+HF_DEADLINE_S = float(os.getenv("HF_DEADLINE_S", "30"))
+GEMINI_DEADLINE_S = float(os.getenv("GEMINI_DEADLINE_S", "45"))
+
+# PDF reports: render worker processes, jobs allowed in flight before 503, chart resolution and the on-disk PDF cache
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "1"))
+REPORT_MAX_PENDING = int(os.getenv("REPORT_MAX_PENDING", "16"))
+REPORT_CHART_POINTS = int(os.getenv("REPORT_CHART_POINTS", "400"))
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "report_cache")
+REPORT_CACHE_MAX_FILES = int(os.getenv("REPORT_CACHE_MAX_FILES", "200"))
+
+# /chat proxy: Gemini model, upstream timeouts, concurrent calls plus queued requests before 503, and the answer cache
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gemini-1.5-flash")
+CHAT_TIMEOUT_S = float(os.getenv("CHAT_TIMEOUT_S", "30"))
+CHAT_DEADLINE_S = float(os.getenv("CHAT_DEADLINE_S", "60"))
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "8"))
+CHAT_MAX_WAITING = int(os.getenv("CHAT_MAX_WAITING", "32"))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "512"))
+CHAT_CACHE_TTL_S = float(os.getenv("CHAT_CACHE_TTL_S", "3600"))
+
+# "background" serves ECG/CRUD routes immediately and loads the imaging model in a thread; "eager" loads it before serving;
+# "off" never loads it (ECG-only deployments and load tests). serve.py loads it eagerly once and forks workers that share it
+MODEL_LOAD_MODE = os.getenv("MODEL_LOAD_MODE", "background").lower()
+
 # Medical imaging models - try multiple models for better accuracy
 MEDICAL_MODELS = [
     "chanelcolgate/vit-base-patch16-224-chest-x-ray",  # Chest X-ray specific
@@ -28,37 +163,179 @@ MEDICAL_MODELS = [
     "google/vit-base-patch16-224-in21k"                # Fallback general model
 ]
 
-# Initialize Supabase client
-supabase_client = supabase.create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+startup_timings["imports"] = round((time.perf_counter() - _startup_started) * 1000, 1)
+
+configure_logging(LOG_LEVEL, LOG_FORMAT)
+log = logging.getLogger("medipulse.main")
+
+# Prometheus metrics served at /metrics; gauges over the components are registered where those are created
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    "medipulse_stage_duration_seconds",
+    "Time spent in each processing stage (device lookup, DB writes, decode, inference, Gemini)",
+    ("stage",)
+)
+
+def record_startup(stage, started):
+    startup_timings[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+# Initialize the storage backend
+_started = time.perf_counter()
+if STORAGE_BACKEND == "sqlite":
+    storage = SQLiteStorage(SQLITE_PATH)
+else:
+    storage = SupabaseStorage(SupabaseDB(
+        SUPABASE_URL,
+        SUPABASE_SERVICE_ROLE_KEY,
+        timeout=SUPABASE_TIMEOUT_S,
+        max_connections=SUPABASE_MAX_CONNECTIONS,
+        max_keepalive=SUPABASE_MAX_KEEPALIVE,
+        keepalive_expiry=SUPABASE_KEEPALIVE_S,
+    ))
+record_startup("storage", _started)
 
 # Initialize Gemini
+_started = time.perf_counter()
 genai.configure(api_key=GEMINI_API_KEY)
 gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+chat_client = GeminiChat(
+    GEMINI_API_KEY,
+    model=CHAT_MODEL,
+    timeout=CHAT_TIMEOUT_S,
+    deadline=CHAT_DEADLINE_S,
+    max_concurrent=CHAT_MAX_CONCURRENT,
+    max_waiting=CHAT_MAX_WAITING,
+    cache_entries=CHAT_CACHE_MAX_ENTRIES,
+    cache_ttl=CHAT_CACHE_TTL_S,
+)
+record_startup("gemini_client", _started)
 
-# Load best available medical model
+# Medical model state; filled in by load_medical_model()
 medical_processor = None
 medical_model = None
+medical_forward = None
+medical_config = None
 active_model_name = "None"
+active_backend = "None"
+medical_model_state = "unavailable" if MODEL_LOAD_MODE == "off" else "loading"  # loading | ready | unavailable
 
-for model_name in MEDICAL_MODELS:
+def load_medical_model():
+    """Import torch/transformers, load the best available medical model and build its inference backend"""
+    global medical_processor, medical_model, medical_forward, medical_config
+    global active_model_name, active_backend, medical_model_state
+    
     try:
-        print(f"[INFO] Attempting to load medical model: {model_name}")
-        medical_processor = AutoImageProcessor.from_pretrained(model_name, token=HUGGINGFACE_TOKEN)
-        medical_model = AutoModelForImageClassification.from_pretrained(model_name, token=HUGGINGFACE_TOKEN)
-        active_model_name = model_name
-        print(f"[INFO] Successfully loaded medical model: {model_name}")
-        break
-    except Exception as e:
-        print(f"[WARNING] Failed to load {model_name}: {e}")
-        continue
+        started = time.perf_counter()
+        import torch  # noqa: F401 - heavy import, deferred until the model is actually loaded
+        record_startup("import_torch", started)
+        
+        started = time.perf_counter()
+        from transformers import AutoModelForImageClassification, AutoImageProcessor
+        from model_backends import build_backend
+        record_startup("import_transformers", started)
+    except ImportError as e:
+        log.warning(f"Imaging dependencies unavailable, medical analysis limited to Gemini AI only: {e}")
+        medical_model_state = "unavailable"
+        return
+    
+    # Load best available medical model
+    processor = None
+    model = None
+    model_name_loaded = "None"
+    started = time.perf_counter()
+    for model_name in MEDICAL_MODELS:
+        try:
+            log.info(f"Attempting to load medical model: {model_name}")
+            # Fetch the processor and the weights at the same time
+            with ThreadPoolExecutor(max_workers=2) as loader:
+                processor_future = loader.submit(AutoImageProcessor.from_pretrained, model_name, token=HUGGINGFACE_TOKEN)
+                model_future = loader.submit(AutoModelForImageClassification.from_pretrained, model_name, token=HUGGINGFACE_TOKEN)
+                processor = processor_future.result()
+                model = model_future.result()
+            model_name_loaded = model_name
+            log.info(f"Successfully loaded medical model: {model_name}")
+            break
+        except Exception as e:
+            log.warning(f"Failed to load {model_name}: {e}")
+            processor = None
+            model = None
+            continue
+    record_startup("model_load", started)
+    
+    if model is None:
+        log.warning("No medical models could be loaded. Medical analysis will be limited to Gemini AI only.")
+        medical_model_state = "unavailable"
+    else:
+        try:
+            # Pick the CPU inference backend; non-eager backends are validated against eager logits first
+            started = time.perf_counter()
+            forward, backend = build_backend(
+                INFERENCE_BACKEND,
+                model,
+                processor,
+                model_name_loaded,
+                cache_dir=MODEL_CACHE_DIR,
+                atol=INFERENCE_BACKEND_ATOL,
+            )
+            record_startup("backend_build", started)
+            log.info(f"Inference backend: {backend}")
+            
+            # Publish everything before flipping the state so requests never see a half-loaded model
+            medical_processor = processor
+            medical_config = model.config
+            # The eager fp32 weights are no longer needed once another backend is serving
+            medical_model = model if backend == "torch" else None
+            medical_forward = forward
+            active_model_name = model_name_loaded
+            active_backend = backend
+            medical_model_state = "ready"
+        except Exception as e:
+            # Without this the state would stay "loading" and /upload-mri would answer 503 forever
+            log.exception(f"Failed to prepare medical model {model_name_loaded}: {e}. Medical analysis will be limited to Gemini AI only.")
+            medical_model_state = "unavailable"
+    
+    startup_timings["total"] = round((time.perf_counter() - _startup_started) * 1000, 1)
+    breakdown = ", ".join(f"{stage}={ms:.0f}ms" for stage, ms in startup_timings.items())
+    log.info(f"MediPulse AI Backend initialized with model: {active_model_name} ({active_backend})")
+    log.info(f"Startup breakdown: {breakdown}")
 
-if medical_model is None:
-    print("[WARNING] No medical models could be loaded. Medical analysis will be limited to Gemini AI only.")
+def log_model_load_failure(future):
+    """Done-callback for the background load, whose future nobody awaits"""
+    global medical_model_state
+    if future.cancelled() or future.exception() is None:
+        return
+    log.error("Background medical model load crashed", exc_info=future.exception())
+    if medical_model_state == "loading":
+        medical_model_state = "unavailable"
 
-print(f"[INFO] MediPulse AI Backend initialized with model: {active_model_name}")
+if MODEL_LOAD_MODE not in ("background", "off"):
+    # Old behaviour: block until the model is loaded before serving anything
+    load_medical_model()
 
 app = FastAPI()
 
+request_profiler = RequestProfiler(
+    PROFILER_DIR,
+    routes=PROFILER_ROUTES,
+    sample_rate=PROFILER_SAMPLE_RATE,
+    interval_ms=PROFILER_INTERVAL_MS,
+)
+if PROFILER_ENABLED:
+    request_profiler.configure(enabled=True)
+
+app.add_middleware(ProfilerMiddleware, profiler=request_profiler)
+
+app.add_middleware(
+    MetricsMiddleware,
+    requests=metrics.counter(
+        "medipulse_http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+    ),
+    latency=metrics.histogram(
+        "medipulse_http_request_duration_seconds", "Request latency by route template", ("method", "route")
+    ),
+    slow_request_s=LOG_SLOW_REQUEST_MS / 1000,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -75,154 +352,600 @@ class ECGData(BaseModel):
     qrs_duration: int
     heart_rate_variability: int
     st_segment: float
+    # Optional: when the device took the reading, and its per-device sequence number (a retry sends the same one)
+    timestamp: Optional[datetime] = None
+    seq: Optional[int] = None
+
+# Validates decoded binary frames the way FastAPI validates a JSON batch body
+ecg_readings_adapter = TypeAdapter(List[ECGData])
+
+anomaly_engine = AnomalyEngine(max_patients=ANOMALY_MAX_PATIENTS)
+
+def reading_timestamp(data: ECGData, received: datetime):
+    """The device's timestamp when it is plausible, otherwise arrival time"""
+    if data.timestamp is None:
+        return received
+    timestamp = data.timestamp if data.timestamp.tzinfo else data.timestamp.replace(tzinfo=timezone.utc)
+    if received - timedelta(hours=ECG_MAX_BACKFILL_H) <= timestamp <= received + timedelta(seconds=ECG_MAX_CLOCK_SKEW_S):
+        return timestamp
+    return received
+
+def build_ecg_row(data: ECGData, device_uuid: str, anomalies: List[str]):
+    """Build the ecg_readings row for a single reading; anomalies come from anomaly_engine"""
+    received = datetime.now(timezone.utc)
+    timestamp = reading_timestamp(data, received)
+    ecg_data_json = {
+        "heart_rate": data.heart_rate,
+        "rr_interval": data.rr_interval,
+        "qrs_duration": data.qrs_duration,
+        "heart_rate_variability": data.heart_rate_variability,
+        "st_segment": data.st_segment,
+        "raw_value": data.heart_rate,
+        "anomalies": anomalies
+    }
+    if data.seq is not None:
+        ecg_data_json["seq"] = data.seq
+    if data.timestamp is not None:
+        # Arrival time, plus any device clock that was not believed, for tracking clock drift
+        ecg_data_json["received_at"] = received.isoformat()
+        if timestamp is received:
+            ecg_data_json["device_timestamp"] = data.timestamp.isoformat()
+    
+    # Calculate signal quality based on data consistency (normal HR is around 72)
+    base_heart_rate = 72
+    signal_quality = min(100, max(50, 100 - abs(data.heart_rate - base_heart_rate) * 2))
+    
+    return {
+        "patient_id": data.patient_id,
+        "device_id": device_uuid,
+        # Sample time from the device when it sent one, else arrival time; never now(), which would stamp flush time
+        "timestamp": timestamp.astimezone(timezone.utc).isoformat(),
+        "heart_rate": data.heart_rate,
+        "ecg_data": ecg_data_json,
+        "signal_quality": signal_quality,
+        "battery_level": 85,  # Simulated battery level
+        "temperature": data.temperature,
+        "anomaly_detected": bool(anomalies),
+        "anomaly_type": ", ".join(anomalies) if anomalies else None
+    }
+
+ecg_hub = ECGHub(ring_size=ECG_RING_SIZE, max_patients=ECG_LIVE_MAX_PATIENTS, idle_ttl=ECG_LIVE_IDLE_S)
+
+device_cache = DeviceCache(max_entries=DEVICE_CACHE_MAX_ENTRIES, ttl=DEVICE_CACHE_TTL_S)
+
+# Per-device sequence numbers already accepted, so retried and replayed readings are dropped
+sequence_tracker = SequenceTracker(window=ECG_SEQ_WINDOW, max_devices=ECG_SEQ_MAX_DEVICES)
+
+async def get_device_uuid(patient_id: str):
+    """Resolve the default device UUID for a patient, going to Supabase only on a cache miss"""
+    device_uuid = device_cache.get(patient_id)
+    if device_uuid is not None:
+        return device_uuid
+    
+    with stage_seconds.time(stage="device_lookup"):
+        device = await storage.get_device(patient_id, "esp32-default-device")
+    if device is None:
+        return None
+    
+    device_uuid = device["id"]
+    device_cache.set(patient_id, device_uuid)
+    return device_uuid
+
+async def insert_ecg_rows(rows):
+    """Multi-row insert used by the write-behind buffer"""
+    with stage_seconds.time(stage="ecg_db_insert"):
+        await storage.insert_readings(rows)
+
+def forget_dropped_rows(rows):
+    """Readings the buffer gave up on were never stored, so their retries must not look like duplicates"""
+    for row in rows:
+        seq = row["ecg_data"].get("seq")
+        if seq is not None:
+            sequence_tracker.discard(row["device_id"], seq)
+
+ecg_buffer = ECGWriteBuffer(
+    insert_ecg_rows,
+    flush_rows=ECG_FLUSH_ROWS,
+    flush_interval=ECG_FLUSH_INTERVAL_MS / 1000,
+    max_rows=ECG_BUFFER_MAX_ROWS,
+    on_drop=forget_dropped_rows,
+)
+
+@app.on_event("startup")
+async def start_ecg_buffer():
+    await ecg_buffer.start()
+
+@app.on_event("shutdown")
+async def stop_ecg_buffer():
+    pending = ecg_buffer.pending
+    await ecg_buffer.stop()
+    log.info("ECG buffer stopped", extra={"final_flush_rows": pending})
+
+@app.on_event("shutdown")
+async def close_storage():
+    # Registered after the ECG buffer hook so the final flush still has its connections
+    await storage.close()
 
 @app.post("/submit-ecg")
 async def submit_ecg(data: ECGData):
     try:
         # Get the device ID for this patient
-        device_resp = supabase_client.table("ecg_devices").select("id").eq("patient_id", data.patient_id).eq("device_id", "esp32-default-device").single().execute()
+        device_uuid = await get_device_uuid(data.patient_id)
         
-        if not device_resp.data:
+        if device_uuid is None:
             return {"success": False, "error": "Device not found for patient"}
         
-        device_uuid = device_resp.data["id"]
-        
-        # Store ECG data in Supabase
-        ecg_data_json = {
-            "heart_rate": data.heart_rate,
-            "rr_interval": data.rr_interval,
-            "qrs_duration": data.qrs_duration,
-            "heart_rate_variability": data.heart_rate_variability,
-            "st_segment": data.st_segment,
-            "raw_value": data.heart_rate
-        }
+        outcome = sequence_tracker.check(device_uuid, data.seq) if data.seq is not None else None
+        # A copy still being written may fail and be released; only then does this one take its place
+        while outcome == DUPLICATE and not await sequence_tracker.stored(device_uuid, data.seq):
+            outcome = sequence_tracker.check(device_uuid, data.seq)
+        if outcome == DUPLICATE:
+            # Stored already; this is a retry after a lost response, so let the device move on
+            return {"success": True, "duplicate": True, "data": []}
         
-        # Detect anomalies based on heart rate and other parameters
-        anomaly_detected = False
-        anomaly_type = None
-        
-        if data.heart_rate < 50 or data.heart_rate > 120:
-            anomaly_detected = True
-            anomaly_type = "Abnormal Heart Rate"
-        elif data.st_segment > 0.1:
-            anomaly_detected = True
-            anomaly_type = "ST Segment Elevation"
-        elif data.heart_rate_variability < 20:
-            anomaly_detected = True
-            anomaly_type = "Low Heart Rate Variability"
-        
-        # Calculate signal quality based on data consistency (normal HR is around 72)
-        base_heart_rate = 72
-        signal_quality = min(100, max(50, 100 - abs(data.heart_rate - base_heart_rate) * 2))
-        
-        # Insert ECG reading with all required fields
-        insert_data = {
-            "patient_id": data.patient_id,
-            "device_id": device_uuid,
-            "timestamp": "now()",
-            "heart_rate": data.heart_rate,
-            "ecg_data": ecg_data_json,
-            "signal_quality": signal_quality,
-            "battery_level": 85,  # Simulated battery level
-            "temperature": data.temperature,
-            "anomaly_detected": anomaly_detected,
-            "anomaly_type": anomaly_type
-        }
+        try:
+            # Insert ECG reading with all required fields; a late arrival must not disturb the temporal rules' history
+            if outcome == LATE:
+                anomalies = anomaly_engine.evaluate_late(data.dict())
+            else:
+                anomalies = anomaly_engine.evaluate(data.patient_id, data.dict())
+            insert_data = build_ecg_row(data, device_uuid, anomalies)
+            
+            log.debug("ECG reading stored", extra={
+                "patient_id": data.patient_id, "heart_rate": data.heart_rate,
+                "anomaly": insert_data["anomaly_type"], "sample": LOG_SAMPLE_RATE
+            })
+            with stage_seconds.time(stage="ecg_db_insert"):
+                stored = await storage.insert_readings([insert_data])
+        except Exception:
+            # Not stored, so the retry must not look like a duplicate
+            if data.seq is not None:
+                sequence_tracker.discard(device_uuid, data.seq)
+            raise
+        if data.seq is not None:
+            sequence_tracker.confirm(device_uuid, data.seq)
         
-        print(f"[DEBUG] Inserting ECG data: {insert_data}")
-        resp = supabase_client.table("ecg_readings").insert(insert_data).execute()
+        # Fan out to live viewers; prefer the stored row so it carries its id. Late arrivals are only stored,
+        # since the live feed never moves backwards
+        if outcome != LATE:
+            ecg_hub.publish(data.patient_id, stored[0] if stored else insert_data)
         
-        return {"success": True, "data": resp.data}
+        return {"success": True, "data": stored}
     except Exception as e:
-        print(f"Error in submit_ecg: {e}")
+        log.error(f"Error in submit_ecg: {e}")
         return {"success": False, "error": str(e)}
 
-@app.get("/ecg-data/{patient_id}")
-async def get_ecg_data(patient_id: str):
+async def queue_readings(readings: List[ECGData], device_uuids: dict):
+    """Drop duplicates, run the anomaly pass and queue rows for the write-behind buffer; shared by the batch endpoints"""
+    accepted = []
+    rejected = []
+    late = set()
+    claimed = set()
+    duplicates = 0
+    for index, reading in enumerate(readings):
+        device_uuid = device_uuids.get(reading.patient_id)
+        if device_uuid is None:
+            rejected.append({"index": index, "error": "Device not found for patient"})
+            continue
+        if reading.seq is not None:
+            key = (device_uuid, reading.seq)
+            outcome = sequence_tracker.check(*key)
+            # Wait out a copy another request is still writing, but not one claimed earlier in this batch
+            while outcome == DUPLICATE and key not in claimed and not await sequence_tracker.stored(*key):
+                outcome = sequence_tracker.check(*key)
+            if outcome == DUPLICATE:
+                duplicates += 1
+                continue
+            claimed.add(key)
+            if outcome == LATE:
+                late.add(key)
+        accepted.append(reading)
+    
+    # A replayed or retried batch may arrive out of order; evaluate and store it in device order
+    if all(r.seq is not None for r in accepted):
+        accepted.sort(key=lambda r: r.seq)
+    
     try:
-        resp = supabase_client.table("ecg_readings").select("*").eq("patient_id", patient_id).order("timestamp", desc=True).limit(100).execute()
-        print(f"[DEBUG] Retrieved {len(resp.data)} ECG readings for patient {patient_id}")
-        return {"data": resp.data}
+        # One vectorized anomaly pass over the in-order readings; late arrivals skip the temporal rules
+        in_order = [r for r in accepted if (device_uuids[r.patient_id], r.seq) not in late]
+        found = iter(anomaly_engine.evaluate_batch([r.patient_id for r in in_order], [r.dict() for r in in_order]))
+        anomalies = [
+            anomaly_engine.evaluate_late(r.dict()) if (device_uuids[r.patient_id], r.seq) in late else next(found)
+            for r in accepted
+        ]
+        rows = [
+            build_ecg_row(reading, device_uuids[reading.patient_id], reading_anomalies)
+            for reading, reading_anomalies in zip(accepted, anomalies)
+        ]
+        await ecg_buffer.add(rows)
     except Exception as e:
-        print(f"[ERROR] Failed to get ECG data: {e}")
-        return {"data": [], "error": str(e)}
+        # Nothing was queued, so the retry must not look like a duplicate
+        for key in claimed:
+            sequence_tracker.discard(*key)
+        if not isinstance(e, BufferFullError):
+            raise
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": "1"},
+            content={"success": False, "error": str(e)}
+        )
+    
+    # Queued rows are the buffer's to write (it requeues failed flushes and discards any it drops), so their copies can be acknowledged
+    for key in claimed:
+        sequence_tracker.confirm(*key)
+    for reading, row in zip(accepted, rows):
+        if (row["device_id"], reading.seq) not in late:
+            ecg_hub.publish(row["patient_id"], row)
+    
+    return {
+        "success": True,
+        "accepted": len(rows),
+        "duplicates": duplicates,
+        "rejected": rejected,
+        "pending": ecg_buffer.pending
+    }
 
-@app.post("/upload-mri")
-async def upload_mri(patient_id: str = Form(...), uploaded_by: str = Form(...), file: UploadFile = File(...)):
+@app.post("/submit-ecg/batch")
+async def submit_ecg_batch(readings: List[ECGData]):
+    """Queue many readings at once; rows are written by the write-behind buffer"""
     try:
-        print(f"[INFO] Processing MRI upload for patient: {patient_id}")
-        
-        # Read image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        # Initialize analysis results
-        medical_diagnosis = "Analysis pending"
-        medical_confidence = 0.0
-        primary_diagnosis = "Analysis pending"
-        confidence_score = 0.95
-        
-        # Run Medical Hugging Face Model Analysis
-        if medical_processor is not None and medical_model is not None:
-            try:
-                print("[INFO] Running medical Hugging Face analysis...")
-                inputs = medical_processor(images=image, return_tensors="pt")
-                
-                with torch.no_grad():
-                    outputs = medical_model(**inputs)
-                    predicted_class_id = outputs.logits.argmax(-1).item()
-                    confidence = torch.softmax(outputs.logits, dim=-1).max().item()
-                    
-                    # Get medical diagnosis from model
-                    if hasattr(medical_model.config, 'id2label'):
-                        raw_prediction = medical_model.config.id2label.get(predicted_class_id, f"Class {predicted_class_id}")
-                        
-                        # Interpret medical predictions with better context
-                        if "normal" in raw_prediction.lower():
-                            medical_diagnosis = "No significant abnormalities detected"
-                        elif "pneumonia" in raw_prediction.lower():
-                            medical_diagnosis = "Possible pneumonia - requires clinical correlation"
-                        elif "covid" in raw_prediction.lower():
-                            medical_diagnosis = "Possible COVID-19 findings - requires further testing"
-                        elif "tuberculosis" in raw_prediction.lower() or "tb" in raw_prediction.lower():
-                            medical_diagnosis = "Possible tuberculosis findings - requires clinical evaluation"
-                        elif "cardiomegaly" in raw_prediction.lower():
-                            medical_diagnosis = "Possible cardiac enlargement - cardiology consultation recommended"
-                        elif "effusion" in raw_prediction.lower():
-                            medical_diagnosis = "Possible pleural effusion - clinical correlation needed"
-                        elif "consolidation" in raw_prediction.lower():
-                            medical_diagnosis = "Possible pulmonary consolidation - further investigation required"
-                        elif "nodule" in raw_prediction.lower():
-                            medical_diagnosis = "Possible pulmonary nodule detected - follow-up imaging recommended"
-                        else:
-                            medical_diagnosis = f"Medical findings: {raw_prediction} - clinical interpretation required"
-                    else:
-                        medical_diagnosis = f"Medical analysis completed - Class {predicted_class_id}"
-                    
-                    medical_confidence = confidence
-                    primary_diagnosis = medical_diagnosis
-                    confidence_score = confidence
-                    
-                    print(f"[INFO] Medical Analysis: {medical_diagnosis}, Confidence: {medical_confidence:.2f}")
-                    
-            except Exception as e:
-                print(f"[ERROR] Medical analysis failed: {e}")
-                medical_diagnosis = f"Medical analysis failed: {str(e)}"
-                primary_diagnosis = "Analysis error - please retry"
-        
-        # Run Enhanced Gemini AI Medical Analysis
-        gemini_analysis = "Analysis in progress..."
-        structured_diagnosis = {}
+        # Resolve each patient's device once per batch rather than once per reading
+        device_uuids = {}
+        for patient_id in {r.patient_id for r in readings}:
+            device_uuids[patient_id] = await get_device_uuid(patient_id)
+        return await queue_readings(readings, device_uuids)
+    except Exception as e:
+        log.error(f"Error in submit_ecg_batch: {e}")
+        # 5xx so uploaders retry; a reading the backend will never take is reported in `rejected`
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+
+@app.post("/submit-ecg/frames")
+async def submit_ecg_frames(request: Request, patient_id: str):
+    """One patient's readings as binary frames (ecg_wire.py) in an application/octet-stream body"""
+    try:
+        decoded = decode_frames(await request.body())
+        readings = ecg_readings_adapter.validate_python([{"patient_id": patient_id, **values} for values in decoded])
+    except ValueError as e:
+        # Malformed frames and out-of-range values (pydantic's ValidationError is a ValueError)
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    try:
+        # An unknown patient shows up per reading in `rejected`, as on /submit-ecg/batch
+        return await queue_readings(readings, {patient_id: await get_device_uuid(patient_id)})
+    except Exception as e:
+        log.error(f"Error in submit_ecg_frames: {e}")
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+
+class ECGWaveform(BaseModel):
+    patient_id: str
+    sample_rate: int = 250
+    samples: str  # base64 of little-endian int16 ADC counts from one lead
+    temperature: Optional[float] = None
+    mv_per_count: float = 0.008  # AD8232 on a 12-bit 3.3 V ADC
+
+# One streaming detector per patient so beats and RR intervals continue across chunks; an idle one expires
+waveform_analyzers = TTLCache(max_entries=WAVEFORM_ANALYZER_MAX, ttl=WAVEFORM_ANALYZER_TTL_S)
+
+async def ingest_waveform(patient_id: str, sample_rate: int, samples, temperature, mv_per_count: float):
+    """Derive summary values from a chunk of raw samples and queue them like a regular reading"""
+    if not 100 <= sample_rate <= 1000:
+        return JSONResponse(status_code=400, content={"success": False, "error": "sample_rate must be between 100 and 1000 Hz"})
+    
+    device_uuid = await get_device_uuid(patient_id)
+    if device_uuid is None:
+        return {"success": False, "error": "Device not found for patient"}
+    
+    analyzer = waveform_analyzers.get(patient_id)
+    if analyzer is None or analyzer.fs != sample_rate or analyzer.mv_per_count != mv_per_count:
+        # A new sample rate or calibration can't continue the old detector's tail
+        analyzer = WaveformAnalyzer(sample_rate, mv_per_count=mv_per_count)
+    # Set on every chunk so the TTL runs from the patient's last upload
+    waveform_analyzers.set(patient_id, analyzer)
+    summary = analyzer.process(samples)
+    if summary is None:
+        # Not enough beats in this chunk yet; the samples are kept as the detector's tail
+        return {"success": True, "stored": False, "samples": len(samples)}
+    
+    reading = ECGData(
+        patient_id=patient_id,
+        heart_rate=summary["heart_rate"],
+        rr_interval=summary["rr_interval"],
+        temperature=temperature if temperature is not None else 0.0,
+        qrs_duration=summary["qrs_duration"],
+        heart_rate_variability=summary["heart_rate_variability"],
+        st_segment=summary["st_segment"]
+    )
+    reading_values = reading.dict()
+    if temperature is None:
+        # No temperature probe on this upload; keep the fever rule from seeing a fake 0
+        reading_values["temperature"] = 98.6
+    row = build_ecg_row(reading, device_uuid, anomaly_engine.evaluate(patient_id, reading_values))
+    row["temperature"] = temperature
+    row["ecg_data"].update({
+        "source": "waveform",
+        "sample_rate": sample_rate,
+        "beats": summary["beats"],
+        "rr_intervals": summary["rr_intervals"]
+    })
+    
+    try:
+        await ecg_buffer.add([row])
+    except BufferFullError as e:
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": "1"},
+            content={"success": False, "error": str(e)}
+        )
+    ecg_hub.publish(patient_id, row)
+    
+    return {"success": True, "stored": True, "samples": len(samples), **summary}
+
+@app.post("/submit-ecg/raw")
+async def submit_ecg_raw(waveform: ECGWaveform):
+    """Raw lead samples as base64 int16 in JSON"""
+    try:
+        samples = decode_int16(waveform.samples)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    try:
+        return await ingest_waveform(waveform.patient_id, waveform.sample_rate, samples, waveform.temperature, waveform.mv_per_count)
+    except Exception as e:
+        log.error(f"Error in submit_ecg_raw: {e}")
+        return {"success": False, "error": str(e)}
+
+@app.post("/submit-ecg/raw/binary")
+async def submit_ecg_raw_binary(
+    request: Request,
+    patient_id: str,
+    sample_rate: int = 250,
+    temperature: Optional[float] = None,
+    mv_per_count: float = 0.008
+):
+    """Raw lead samples as an application/octet-stream body of little-endian int16"""
+    try:
+        samples = decode_int16(await request.body())
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    try:
+        return await ingest_waveform(patient_id, sample_rate, samples, temperature, mv_per_count)
+    except Exception as e:
+        log.error(f"Error in submit_ecg_raw_binary: {e}")
+        return {"success": False, "error": str(e)}
+
+@app.get("/submit-ecg/stats")
+async def ecg_buffer_stats():
+    return {
+        "buffer": ecg_buffer.snapshot(),
+        "device_cache": device_cache.snapshot(),
+        "sequence": sequence_tracker.snapshot(),
+        "waveform_analyzers": waveform_analyzers.snapshot(),
+        "live": ecg_hub.snapshot(),
+        "anomaly_engine": anomaly_engine.snapshot(),
+        "storage": storage.snapshot()
+    }
+
+async def fetch_ecg_series(patient_id: str, since: str, until: str, max_rows: int):
+    """Narrow (timestamp, heart_rate) rows in ascending order, walking keyset pages"""
+    rows = []
+    cursor = None
+    while len(rows) < max_rows:
+        page_size = min(ECG_HISTORY_PAGE_ROWS, max_rows - len(rows))
+        page = await storage.query_readings(
+            patient_id, ["id", "timestamp", "heart_rate"], since, until, cursor, page_size, descending=False
+        )
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        cursor = encode_cursor(page[-1])
+    return rows
+
+@app.get("/ecg-data/{patient_id}")
+async def get_ecg_data(
+    patient_id: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    downsample: Optional[str] = None,
+    bucket_seconds: int = 60,
+    points: int = 500
+):
+    """
+    ECG history, newest first. since/until bound the time range, cursor continues
+    from a previous page's next_cursor and fields projects columns. downsample=buckets
+    returns per-bucket min/max/avg computed in the database; downsample=lttb returns
+    at most `points` heart-rate points that keep the shape of the series.
+    """
+    try:
+        # Serve the default view from the live ring buffer once it holds a full window of stored rows.
+        # Rows published from the write-behind buffer have no id yet, so they neither anchor a cursor
+        # nor match the database's shape; any of those in the window means asking storage instead.
+        stream = ecg_hub.get(patient_id)
+        if not any([since, until, cursor, fields, downsample]) and limit == 100 and stream and len(stream.readings) >= 100:
+            rows = stream.latest(100)
+            if all("id" in row and "created_at" in row for row in rows):
+                # Older rows may exist; a client that follows the cursor finds out from storage
+                return {"data": rows, "next_cursor": encode_cursor(rows[-1]), "has_more": True}
         
         try:
-            print("[INFO] Running Enhanced Gemini AI medical analysis...")
-            # Convert image to base64 for Gemini
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='JPEG')
-            img_byte_arr.seek(0)
+            since_ts = datetime.fromisoformat(since).isoformat() if since else None
+            until_ts = datetime.fromisoformat(until).isoformat() if until else None
+            columns = parse_fields(fields)
+            if cursor:
+                decode_cursor(cursor)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"data": [], "error": str(e)})
+        
+        if downsample:
+            # Downsampled views always need a bounded range; default to the last 24 hours
+            until_ts = until_ts or datetime.now(timezone.utc).isoformat()
+            since_ts = since_ts or (datetime.fromisoformat(until_ts) - timedelta(days=1)).isoformat()
+            
+            if downsample == "buckets":
+                buckets = await storage.reading_buckets(patient_id, since_ts, until_ts, max(1, bucket_seconds))
+                return {"data": buckets, "downsample": "buckets", "bucket_seconds": max(1, bucket_seconds)}
             
-            # Enhanced medical analysis prompt
-            prompt = """
+            if downsample == "lttb":
+                rows = await fetch_ecg_series(patient_id, since_ts, until_ts, ECG_HISTORY_MAX_ROWS)
+                series = [(datetime.fromisoformat(r["timestamp"]).timestamp(), r["heart_rate"], r["timestamp"]) for r in rows]
+                sampled = lttb(series, max(3, points))
+                return {
+                    "data": [{"timestamp": ts, "heart_rate": hr} for _, hr, ts in sampled],
+                    "downsample": "lttb",
+                    "source_rows": len(rows),
+                    "truncated": len(rows) >= ECG_HISTORY_MAX_ROWS
+                }
+            
+            return JSONResponse(status_code=400, content={"data": [], "error": "downsample must be 'buckets' or 'lttb'"})
+        
+        limit = max(1, min(limit, ECG_HISTORY_PAGE_ROWS))
+        # Fetch one extra row to learn whether another page exists
+        rows = await storage.query_readings(patient_id, columns, since_ts, until_ts, cursor, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        log.debug("ECG history page served", extra={"patient_id": patient_id, "rows": len(rows), "sample": LOG_SAMPLE_RATE})
+        return {
+            "data": rows,
+            "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+            "has_more": has_more
+        }
+    except Exception as e:
+        log.error(f"Failed to get ECG data: {e}")
+        return {"data": [], "error": str(e)}
+
+@app.websocket("/ws/ecg/{patient_id}")
+async def ecg_live(websocket: WebSocket, patient_id: str):
+    """Push new readings for a patient to every connected viewer"""
+    await websocket.accept()
+    stream = ecg_hub.stream(patient_id)
+    stream.subscribers += 1
+    
+    async def until_disconnect():
+        # Viewers send nothing, but reading is the only way to notice that one has gone
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    
+    disconnected = asyncio.create_task(until_disconnect())
+    try:
+        # Initial history from memory; only an empty ring costs a database read
+        history = stream.latest(100)
+        if not history:
+            history = await storage.query_readings(patient_id, limit=100)
+        last_seq = stream.seq
+        await websocket.send_json({"type": "snapshot", "seq": last_seq, "data": history})
+        
+        while True:
+            published = asyncio.create_task(stream.wait(last_seq))
+            await asyncio.wait({published, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                published.cancel()
+                break
+            for seq, message in stream.since(last_seq):
+                await websocket.send_text(message)
+                last_seq = seq
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        log.error(f"Live ECG stream for {patient_id} closed: {e}")
+    finally:
+        disconnected.cancel()
+        stream.subscribers -= 1
+
+def interpret_medical_prediction(raw_prediction: str):
+    """Map a raw classifier label to a clinical-sounding diagnosis"""
+    label = raw_prediction.lower()
+    if "normal" in label:
+        return "No significant abnormalities detected"
+    elif "pneumonia" in label:
+        return "Possible pneumonia - requires clinical correlation"
+    elif "covid" in label:
+        return "Possible COVID-19 findings - requires further testing"
+    elif "tuberculosis" in label or "tb" in label:
+        return "Possible tuberculosis findings - requires clinical evaluation"
+    elif "cardiomegaly" in label:
+        return "Possible cardiac enlargement - cardiology consultation recommended"
+    elif "effusion" in label:
+        return "Possible pleural effusion - clinical correlation needed"
+    elif "consolidation" in label:
+        return "Possible pulmonary consolidation - further investigation required"
+    elif "nodule" in label:
+        return "Possible pulmonary nodule detected - follow-up imaging recommended"
+    return f"Medical findings: {raw_prediction} - clinical interpretation required"
+
+def classify_medical_images(images):
+    """Blocking HF preprocess + one batched forward pass; runs on the inference pool, never on the event loop"""
+    import torch
+    
+    with stage_seconds.time(stage="hf_preprocess"):
+        inputs = medical_processor(images=images, return_tensors="pt")
+    
+    with torch.no_grad(), stage_seconds.time(stage="hf_forward"):
+        logits = medical_forward(inputs["pixel_values"])
+        probabilities = torch.softmax(logits, dim=-1)
+        confidences, predicted_class_ids = probabilities.max(dim=-1)
+    
+    results = []
+    for predicted_class_id, confidence in zip(predicted_class_ids.tolist(), confidences.tolist()):
+        # Get medical diagnosis from model
+        if hasattr(medical_config, 'id2label'):
+            raw_prediction = medical_config.id2label.get(predicted_class_id, f"Class {predicted_class_id}")
+            medical_diagnosis = interpret_medical_prediction(raw_prediction)
+        else:
+            medical_diagnosis = f"Medical analysis completed - Class {predicted_class_id}"
+        results.append((medical_diagnosis, confidence))
+    return results
+
+inference_pool = InferencePool(
+    workers=INFERENCE_WORKERS,
+    max_queue=INFERENCE_MAX_QUEUE,
+    retry_after=INFERENCE_RETRY_AFTER_S,
+)
+
+# Concurrent uploads share forward passes; the batcher's queue is the request bound
+inference_batcher = MicroBatcher(
+    classify_medical_images,
+    inference_pool,
+    max_batch=INFERENCE_MAX_BATCH,
+    max_wait_ms=INFERENCE_MAX_WAIT_MS,
+    max_pending=INFERENCE_MAX_QUEUE,
+)
+
+@app.on_event("startup")
+async def start_inference_batcher():
+    await inference_batcher.start()
+    if MODEL_LOAD_MODE == "background" and medical_model_state == "loading":
+        loader = asyncio.get_running_loop().run_in_executor(None, load_medical_model)
+        loader.add_done_callback(log_model_load_failure)
+
+@app.get("/health/ready")
+async def health_ready():
+    """Ready once the imaging model has finished loading (or definitively failed to)"""
+    status = {
+        "ready": medical_model_state != "loading",
+        "imaging_model": medical_model_state,
+        "model": active_model_name,
+        "backend": active_backend,
+        "pid": os.getpid(),
+        "startup_ms": startup_timings
+    }
+    if medical_model_state == "loading":
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.on_event("shutdown")
+async def stop_inference_pool():
+    await inference_batcher.stop()
+    inference_pool.shutdown(wait=False)
+
+@app.get("/inference/stats")
+async def inference_stats():
+    return {"pool": inference_pool.snapshot(), "batcher": inference_batcher.snapshot()}
+
+# Bump when MRI_ANALYSIS_PROMPT changes so cached analyses from the old prompt are not reused
+MRI_PROMPT_VERSION = "1"
+
+# Enhanced medical analysis prompt
+MRI_ANALYSIS_PROMPT = """
             You are an expert medical AI radiologist analyzing this medical image. Please provide a comprehensive, structured analysis in the following format:
 
             **IMAGE ASSESSMENT:**
@@ -255,36 +978,150 @@ async def upload_mri(patient_id: str = Form(...), uploaded_by: str = Form(...),
             
             Please provide a thorough but concise analysis focusing on medically relevant observations.
             """
-            
-            # Prepare image for Gemini
-            image_parts = [
-                {
-                    "mime_type": "image/jpeg",
-                    "data": img_byte_arr.getvalue()
-                }
-            ]
-            
-            response = gemini_model.generate_content([prompt, image_parts[0]])
-            gemini_analysis = response.text
-            
-            # Extract key information for structured diagnosis
-            if "normal" in gemini_analysis.lower() and "abnormal" not in gemini_analysis.lower():
-                primary_diagnosis = "No significant abnormalities detected"
-                confidence_score = 0.92
-            elif any(word in gemini_analysis.lower() for word in ["abnormal", "lesion", "mass", "concern"]):
-                primary_diagnosis = "Findings requiring clinical correlation"
-                confidence_score = 0.88
-            else:
-                primary_diagnosis = "Further analysis recommended"
-                confidence_score = 0.85
-                
-            print(f"[INFO] Enhanced Gemini analysis completed successfully")
-            
-        except Exception as e:
-            print(f"[ERROR] Gemini analysis failed: {e}")
-            gemini_analysis = f"AI analysis temporarily unavailable. Error: {str(e)}"
-            primary_diagnosis = "Analysis failed - please retry"
-            confidence_score = 0.0
+
+mri_result_cache = ResultCache(
+    max_entries=MRI_CACHE_MAX_ENTRIES,
+    disk_dir=MRI_CACHE_DIR,
+    disk_max_bytes=MRI_CACHE_DISK_MAX_MB * 1024 * 1024,
+)
+
+@app.get("/upload-mri/cache-stats")
+async def mri_cache_stats():
+    return mri_result_cache.snapshot()
+
+mri_decode_slots = asyncio.Semaphore(MRI_DECODE_CONCURRENCY)
+
+async def run_medical_analysis(image):
+    """HF classification branch. Returns (medical_diagnosis, medical_confidence, ok)."""
+    if medical_processor is None or medical_forward is None:
+        return "Analysis pending", 0.0, True
+    try:
+        log.debug("Running medical Hugging Face analysis")
+        medical_diagnosis, medical_confidence = await asyncio.wait_for(inference_batcher.submit(image), timeout=HF_DEADLINE_S)
+        log.info("Medical analysis done", extra={"diagnosis": medical_diagnosis, "confidence": round(medical_confidence, 3)})
+        return medical_diagnosis, medical_confidence, True
+    except PoolSaturatedError:
+        raise
+    except asyncio.TimeoutError:
+        log.warning(f"Medical analysis exceeded {HF_DEADLINE_S}s deadline")
+        return f"Medical analysis timed out after {HF_DEADLINE_S:g}s", 0.0, False
+    except Exception as e:
+        log.error(f"Medical analysis failed: {e}")
+        return f"Medical analysis failed: {str(e)}", 0.0, False
+
+async def run_gemini_analysis(image):
+    """Gemini branch. Returns (gemini_analysis, ok)."""
+    try:
+        log.debug("Running Gemini medical analysis")
+        # One bounded JPEG of the already-downscaled scan
+        image_part = {
+            "mime_type": "image/jpeg",
+            "data": await asyncio.to_thread(encode_jpeg, image, MRI_GEMINI_MAX_KB * 1024)
+        }
+        
+        with stage_seconds.time(stage="gemini_call"):
+            response = await asyncio.wait_for(
+                gemini_model.generate_content_async([MRI_ANALYSIS_PROMPT, image_part]),
+                timeout=GEMINI_DEADLINE_S
+            )
+        del image_part
+        log.debug("Gemini analysis completed")
+        return response.text, True
+    except asyncio.TimeoutError:
+        log.warning(f"Gemini analysis exceeded {GEMINI_DEADLINE_S}s deadline")
+        return f"AI analysis timed out after {GEMINI_DEADLINE_S:g}s. Please retry.", False
+    except Exception as e:
+        log.error(f"Gemini analysis failed: {e}")
+        return f"AI analysis temporarily unavailable. Error: {str(e)}", False
+
+async def analyze_mri(scan_file):
+    """Run the HF model and Gemini concurrently over an uploaded scan file. Returns (analysis, complete)."""
+    started = time.perf_counter()
+    if medical_processor is not None and medical_forward is not None:
+        # Shed load before decoding or paying for a Gemini call
+        inference_batcher.check_capacity()
+    async with mri_decode_slots:
+        with stage_seconds.time(stage="image_decode"):
+            image, source_size = await asyncio.to_thread(decode_scan, scan_file, MRI_DECODE_MAX_SIDE)
+    log.info("Scan decoded", extra={
+        "source": f"{source_size[0]}x{source_size[1]}", "decoded": f"{image.width}x{image.height}",
+        "ms": round((time.perf_counter() - started) * 1000)
+    })
+    
+    # Both branches run at once under their own deadlines, so latency is max(HF, Gemini)
+    gemini_task = asyncio.create_task(run_gemini_analysis(image))
+    try:
+        medical_diagnosis, medical_confidence, medical_ok = await run_medical_analysis(image)
+    except BaseException:
+        # The queue filled up since the check above (or the request went away); don't pay for an unused answer
+        gemini_task.cancel()
+        raise
+    gemini_analysis, gemini_ok = await gemini_task
+    
+    # Extract key information for structured diagnosis
+    if gemini_ok:
+        if "normal" in gemini_analysis.lower() and "abnormal" not in gemini_analysis.lower():
+            primary_diagnosis = "No significant abnormalities detected"
+            confidence_score = 0.92
+        elif any(word in gemini_analysis.lower() for word in ["abnormal", "lesion", "mass", "concern"]):
+            primary_diagnosis = "Findings requiring clinical correlation"
+            confidence_score = 0.88
+        else:
+            primary_diagnosis = "Further analysis recommended"
+            confidence_score = 0.85
+    elif medical_ok and medical_confidence > 0:
+        # Partial result: Gemini missed its deadline or failed, the HF model did not
+        primary_diagnosis = medical_diagnosis
+        confidence_score = medical_confidence
+    else:
+        primary_diagnosis = "Analysis failed - please retry"
+        confidence_score = 0.0
+    
+    return {
+        "medical_diagnosis": medical_diagnosis,
+        "medical_confidence": medical_confidence,
+        "primary_diagnosis": primary_diagnosis,
+        "confidence_score": confidence_score,
+        "gemini_analysis": gemini_analysis
+    }, medical_ok and gemini_ok
+
+@app.post("/upload-mri")
+async def upload_mri(patient_id: str = Form(...), uploaded_by: str = Form(...), file: UploadFile = File(...)):
+    try:
+        log.info("Processing MRI upload", extra={"patient_id": patient_id, "file_name": file.filename})
+        
+        if medical_model_state == "loading":
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": str(INFERENCE_RETRY_AFTER_S)},
+                content={"error": "Imaging model is still loading, please retry shortly", "success": False}
+            )
+        
+        # The upload stays in its spooled temp file; it is hashed and decoded from there, never read whole
+        if file.size is not None and file.size > MRI_MAX_UPLOAD_MB * 1024 * 1024:
+            return JSONResponse(
+                status_code=413,
+                content={"error": f"Scan exceeds the {MRI_MAX_UPLOAD_MB} MB upload limit", "success": False}
+            )
+        
+        # Identical scan + model + prompt means an identical analysis; skip both model passes
+        cache_key, file_size = await asyncio.to_thread(ResultCache.make_key_from_file, file.file, active_model_name, MRI_PROMPT_VERSION)
+        analysis = await mri_result_cache.aget(cache_key)
+        cache_hit = analysis is not None
+        complete = True
+        if cache_hit:
+            log.info(f"MRI analysis cache hit for {cache_key[:12]}")
+        else:
+            analysis, complete = await analyze_mri(file.file)
+            # Failed or partial analyses are worth retrying, so only cache complete ones
+            if complete:
+                await mri_result_cache.aset(cache_key, analysis)
+        
+        medical_diagnosis = analysis["medical_diagnosis"]
+        medical_confidence = analysis["medical_confidence"]
+        primary_diagnosis = analysis["primary_diagnosis"]
+        confidence_score = analysis["confidence_score"]
+        gemini_analysis = analysis["gemini_analysis"]
         
         # Create comprehensive medical report
         comprehensive_analysis = f"""**MEDIPULSE AI DIAGNOSTIC REPORT**
@@ -326,28 +1163,29 @@ This AI-generated report is intended for educational and research purposes only.
             file_ext = file.filename.split('.')[-1] if '.' in file.filename else 'unknown'
             unique_filename = f"{patient_id}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
             
-            result = supabase_client.table("mri_scans").insert({
-                "patient_id": patient_id,
-                "uploaded_by": uploaded_by,
-                "file_name": file.filename,
-                "file_path": unique_filename,  # Add the file path
-                "file_size": len(contents),    # Use actual file size
-                "ai_analysis_result": {
-                    "medical_diagnosis": medical_diagnosis,
-                    "medical_confidence": medical_confidence,
-                    "primary_diagnosis": primary_diagnosis,
-                    "confidence_score": confidence_score,
-                    "gemini_analysis": gemini_analysis,
-                    "comprehensive_report": comprehensive_analysis,
-                    "model_used": active_model_name
-                },
-                "ai_confidence_score": float(confidence_score),
-                "status": "analyzed",
-                "created_at": datetime.now().isoformat()
-            }).execute()
-            print(f"[INFO] MRI scan record saved to database")
+            with stage_seconds.time(stage="mri_db_write"):
+                await storage.insert_mri_scan({
+                    "patient_id": patient_id,
+                    "uploaded_by": uploaded_by,
+                    "file_name": file.filename,
+                    "file_path": unique_filename,  # Add the file path
+                    "file_size": file_size,        # Use actual file size
+                    "ai_analysis_result": {
+                        "medical_diagnosis": medical_diagnosis,
+                        "medical_confidence": medical_confidence,
+                        "primary_diagnosis": primary_diagnosis,
+                        "confidence_score": confidence_score,
+                        "gemini_analysis": gemini_analysis,
+                        "comprehensive_report": comprehensive_analysis,
+                        "model_used": active_model_name
+                    },
+                    "ai_confidence_score": float(confidence_score),
+                    "status": "analyzed",
+                    "created_at": datetime.now().isoformat()
+                })
+            log.info("MRI scan record saved to database")
         except Exception as e:
-            print(f"[ERROR] Failed to save to database: {e}")
+            log.error(f"Failed to save to database: {e}")
             # Still return success since analysis was completed
             return {
                 "success": True,
@@ -359,6 +1197,8 @@ This AI-generated report is intended for educational and research purposes only.
                 "comprehensive_report": comprehensive_analysis,
                 "model_used": active_model_name,
                 "status": "completed",
+                "cache_hit": cache_hit,
+                "partial": not complete,
                 "database_error": str(e)
             }
         
@@ -371,11 +1211,20 @@ This AI-generated report is intended for educational and research purposes only.
             "gemini_analysis": gemini_analysis,
             "comprehensive_report": comprehensive_analysis,
             "model_used": active_model_name,
-            "status": "completed"
+            "status": "completed",
+            "cache_hit": cache_hit,
+            "partial": not complete
         }
         
+    except PoolSaturatedError as e:
+        log.warning(f"Rejecting MRI upload: {e}")
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"error": str(e), "success": False}
+        )
     except Exception as e:
-        print(f"[ERROR] Upload processing failed: {e}")
+        log.error(f"Upload processing failed: {e}")
         return JSONResponse(
             status_code=500, 
             content={"error": f"Processing failed: {str(e)}", "success": False}
@@ -390,57 +1239,48 @@ async def setup_ecg_device(setup: DeviceSetup):
     """Setup an ECG device for a patient"""
     try:
         # First, get the patient profile from email
-        profile_resp = supabase_client.table("profiles").select("id, role").eq("email", setup.patient_email).single().execute()
-        if not profile_resp.data:
+        profile = await storage.get_profile_by_email(setup.patient_email)
+        if not profile:
             return {"error": f"User with email {setup.patient_email} not found. Please make sure the user is registered."}
         
-        if profile_resp.data["role"] != "patient":
+        if profile["role"] != "patient":
             return {"error": f"User {setup.patient_email} is not a patient."}
         
-        user_id = profile_resp.data["id"]
+        user_id = profile["id"]
         
         # Get or create patient record
-        patient_resp = supabase_client.table("patients").select("id").eq("user_id", user_id).execute()
+        patient = await storage.get_patient_by_user(user_id)
         
-        if not patient_resp.data:
+        if not patient:
             # Create patient record if it doesn't exist
-            print(f"Creating patient record for {setup.patient_email}")
-            create_patient_resp = supabase_client.table("patients").insert({
+            log.info(f"Creating patient record for {setup.patient_email}")
+            patient = await storage.create_patient({
                 "user_id": user_id,
                 "date_of_birth": "1990-01-01",  # Default values
                 "gender": "other",
                 "medical_history": "Created automatically for ECG monitoring"
-            }).execute()
+            })
             
-            if not create_patient_resp.data:
+            if not patient:
                 return {"error": "Failed to create patient record"}
             
-            patient_id = create_patient_resp.data[0]["id"]
-        else:
-            patient_id = patient_resp.data[0]["id"]
+            roster_cache.clear()
+        
+        patient_id = patient["id"]
         
         # Create or update ECG device
-        # First check if device already exists
-        existing_device = supabase_client.table("ecg_devices").select("id").eq("device_id", "esp32-default-device").eq("patient_id", patient_id).execute()
-        
-        if existing_device.data:
-            # Update existing device
-            device_resp = supabase_client.table("ecg_devices").update({
-                "device_name": setup.device_name,
-                "is_active": True,
-                "last_sync": "now()",
-                "battery_level": 90
-            }).eq("device_id", "esp32-default-device").eq("patient_id", patient_id).execute()
+        device = await storage.save_device(patient_id, "esp32-default-device", {
+            "device_name": setup.device_name,
+            "is_active": True,
+            "last_sync": "now()",
+            "battery_level": 90
+        })
+        
+        # Keep the ingest path's cache in step with the device we just wrote
+        if device:
+            device_cache.set(patient_id, device["id"])
         else:
-            # Create new device
-            device_resp = supabase_client.table("ecg_devices").insert({
-                "device_id": "esp32-default-device",
-                "patient_id": patient_id,
-                "device_name": setup.device_name,
-                "is_active": True,
-                "last_sync": "now()",
-                "battery_level": 90
-            }).execute()
+            device_cache.invalidate(patient_id)
         
         return {
             "success": True, 
@@ -449,28 +1289,273 @@ async def setup_ecg_device(setup: DeviceSetup):
             "message": f"Device setup complete for {setup.patient_email}"
         }
     except Exception as e:
-        print(f"Error in setup_ecg_device: {e}")
+        log.error(f"Error in setup_ecg_device: {e}")
         return {"error": str(e)}
 
 class ChatRequest(BaseModel):
     prompt: str
     context: str = ""
+    stream: bool = False
+
+@app.on_event("shutdown")
+async def close_chat_client():
+    await chat_client.close()
+
+def sse_event(data, event=None):
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+async def chat_events(req: ChatRequest):
+    try:
+        async for text in chat_client.stream(req.context, req.prompt):
+            yield sse_event({"text": text})
+        yield sse_event({"success": True}, event="done")
+    except Exception as e:
+        # Headers are already sent, so errors travel in-band
+        log.error(f"Chat stream failed: {e}")
+        yield sse_event({"success": False, "error": str(e)}, event="error")
 
 @app.post("/chat")
-async def chat(req: ChatRequest):
-    # Call Gemini API (pseudo, replace with real call)
-    headers = {"Authorization": f"Bearer {GEMINI_API_KEY}"}
-    payload = {"contents": [{"parts": [{"text": req.context + "\n" + req.prompt}]}]}
-    async with httpx.AsyncClient() as client:
-        r = await client.post("https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key=" + GEMINI_API_KEY, json=payload, headers=headers)
-        data = r.json()
-    return {"response": data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")}
+async def chat(req: ChatRequest, request: Request):
+    """Answer as JSON, or as server-sent events when stream is set or the client accepts text/event-stream"""
+    try:
+        if req.stream or "text/event-stream" in request.headers.get("accept", ""):
+            # Checked here, before the 200 goes out; the stream itself waits for a free slot
+            chat_client.check_capacity()
+            return StreamingResponse(
+                chat_events(req),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        text, cached = await chat_client.complete(req.context, req.prompt)
+        return {"success": True, "response": text, "cached": cached}
+    except PoolSaturatedError as e:
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"success": False, "error": str(e)}
+        )
+    except ChatUpstreamError as e:
+        log.error(f"Chat request failed: {e}")
+        return JSONResponse(status_code=502, content={"success": False, "error": str(e)})
+
+@app.get("/chat/stats")
+async def chat_stats():
+    return chat_client.snapshot()
+
+async def report_watermark(patient_id: str):
+    """Newest reading and newest MRI scan; a report is fully determined by these plus its length"""
+    latest = await storage.query_readings(patient_id, ["id", "timestamp"], limit=1)
+    scans = await storage.list_mri_scans(patient_id, limit=1)
+    return (
+        latest[0]["timestamp"] if latest else None,
+        latest[0]["id"] if latest else None,
+        scans[0]["id"] if scans else None
+    )
+
+async def collect_report_data(patient_id: str, days: int, watermark):
+    """Aggregates for the report window: per-bucket ECG stats (never raw rows) and recent MRI analyses"""
+    latest_ts = watermark[0]
+    # The window ends just after the newest reading rather than at "now", so cached reports stay valid
+    until = datetime.fromisoformat(latest_ts) + timedelta(seconds=1) if latest_ts else datetime.now(timezone.utc)
+    since = until - timedelta(days=days)
+    bucket_seconds = max(60, -(-days * 86400 // REPORT_CHART_POINTS))
+    
+    buckets = await storage.reading_buckets(patient_id, since.isoformat(), until.isoformat(), bucket_seconds)
+    scans = await storage.list_mri_scans(patient_id, limit=20)
+    
+    points = [{
+        "t": datetime.fromisoformat(b["bucket"]).timestamp(),
+        "readings": b["readings"],
+        "anomalies": b["anomalies"] or 0,
+        "heart_rate_min": b["heart_rate_min"],
+        "heart_rate_max": b["heart_rate_max"],
+        "heart_rate_avg": float(b["heart_rate_avg"]),
+        "temperature_avg": float(b["temperature_avg"]) if b["temperature_avg"] is not None else None,
+        "temperature_min": b["temperature_min"],
+        "temperature_max": b["temperature_max"]
+    } for b in buckets]
+    
+    readings = sum(p["readings"] for p in points)
+    temperatures = [p for p in points if p["temperature_avg"] is not None]
+    summary = {
+        "readings": readings,
+        "anomalies": sum(p["anomalies"] for p in points),
+        "heart_rate_min": min((p["heart_rate_min"] for p in points), default=None),
+        "heart_rate_max": max((p["heart_rate_max"] for p in points), default=None),
+        "heart_rate_avg": round(sum(p["heart_rate_avg"] * p["readings"] for p in points) / readings, 1) if readings else None,
+        "temperature_min": min((p["temperature_min"] for p in temperatures), default=None),
+        "temperature_max": max((p["temperature_max"] for p in temperatures), default=None),
+        "temperature_avg": round(sum(p["temperature_avg"] for p in temperatures) / len(temperatures), 2) if temperatures else None
+    }
+    
+    return {
+        "patient_id": patient_id,
+        "days": days,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "bucket_seconds": bucket_seconds,
+        "buckets": points,
+        "summary": summary,
+        "mri_scans": scans
+    }
+
+report_jobs = ReportJobs(
+    collect_report_data,
+    report_watermark,
+    REPORT_CACHE_DIR,
+    workers=REPORT_WORKERS,
+    max_pending=REPORT_MAX_PENDING,
+    max_cached=REPORT_CACHE_MAX_FILES,
+)
+
+@app.on_event("shutdown")
+async def stop_report_jobs():
+    await report_jobs.shutdown()
+
+class ReportRequest(BaseModel):
+    days: int = 30
+
+@app.post("/generate-report/{patient_id}")
+async def generate_report(patient_id: str, req: Optional[ReportRequest] = None):
+    """Queue a PDF report; poll the returned status_url, then download from pdf_url"""
+    days = max(1, min((req or ReportRequest()).days, 366))
+    try:
+        job = await report_jobs.submit(patient_id, days)
+    except PoolSaturatedError as e:
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"success": False, "error": str(e)}
+        )
+    except Exception as e:
+        log.error(f"Failed to queue report for {patient_id}: {e}")
+        return {"success": False, "error": str(e)}
+    
+    job_id = job["job_id"]
+    return JSONResponse(status_code=202, content={
+        "success": True,
+        "job_id": job_id,
+        "status": job["status"],
+        "cached": job["cached"],
+        "status_url": f"/generate-report/jobs/{job_id}",
+        "pdf_url": f"/generate-report/jobs/{job_id}/pdf"
+    })
+
+@app.get("/generate-report/jobs/{job_id}")
+async def report_job_status(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Unknown report job"})
+    if job["status"] == "done":
+        job["pdf_url"] = f"/generate-report/jobs/{job_id}/pdf"
+    return job
+
+@app.get("/generate-report/jobs/{job_id}/pdf")
+async def report_job_pdf(job_id: str):
+    path = report_jobs.pdf_path(job_id)
+    job = report_jobs.get(job_id)
+    if path is None or job is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "Report not ready"})
+    return FileResponse(path, media_type="application/pdf", filename=f"medipulse_report_{job['patient_id']}.pdf")
+
+@app.get("/generate-report/stats")
+async def report_stats():
+    return report_jobs.snapshot()
 
 @app.get("/generate-report/{patient_id}")
-async def generate_report(patient_id: str):
-    # Generate PDF (pseudo, not implemented)
-    # Save to Supabase Storage, return link
-    return {"url": "https://your-supabase-storage-link/report.pdf"}
+async def generate_report_legacy(patient_id: str, days: int = 30):
+    """Earlier GET form; queues the same job and keeps its `url` field, which is the PDF once status is done"""
+    response = await generate_report(patient_id, ReportRequest(days=days))
+    if not isinstance(response, JSONResponse) or response.status_code != 202:
+        return response
+    content = json.loads(response.body)
+    return JSONResponse(status_code=202, content={"url": content["pdf_url"], **content})
+
+# Scrape-time metrics read from the components' existing counters
+metrics.gauge("medipulse_imaging_model_ready", "1 once the imaging model is serving", lambda: int(medical_model_state == "ready"))
+metrics.gauge("medipulse_ecg_buffer_pending_rows", "ECG rows waiting in the write-behind buffer", lambda: ecg_buffer.pending)
+metrics.counter_callback(
+    "medipulse_ecg_buffer_rows_total",
+    "ECG rows by write-behind outcome",
+    lambda: {(outcome,): ecg_buffer.stats[outcome] for outcome in ("accepted", "flushed", "dropped", "rejected")},
+    ("outcome",)
+)
+metrics.counter_callback(
+    "medipulse_ecg_sequence_total",
+    "Sequence-numbered ECG readings by outcome (new, late, duplicate, reset)",
+    lambda: {(outcome,): sequence_tracker.stats[outcome] for outcome in ("new", "late", "duplicate", "reset")},
+    ("outcome",)
+)
+metrics.gauge("medipulse_device_cache_entries", "Cached patient -> device mappings", lambda: device_cache.snapshot()["entries"])
+metrics.gauge("medipulse_live_ecg_subscribers", "Open live ECG WebSocket viewers", lambda: ecg_hub.snapshot()["subscribers"])
+metrics.gauge(
+    "medipulse_inference_queue_depth",
+    "Imaging requests waiting for a forward pass",
+    lambda: {("pool",): inference_pool.snapshot()["queue_depth"], ("batcher",): inference_batcher.snapshot()["pending"]},
+    ("queue",)
+)
+metrics.gauge(
+    "medipulse_chat_requests",
+    "Chat requests talking to Gemini or waiting for a slot",
+    lambda: {("active",): chat_client.active, ("waiting",): chat_client.waiting},
+    ("state",)
+)
+metrics.gauge("medipulse_report_jobs_pending", "PDF report jobs queued or rendering", lambda: report_jobs.pending)
+metrics.gauge(
+    "medipulse_process_memory_bytes",
+    "Resident memory of this worker; shared pages include model weights inherited from serve.py",
+    lambda: {(kind,): value for kind, value in process_memory().items()},
+    ("kind",)
+)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def admin_denied(token: Optional[str]):
+    """Error response for an admin call, or None when the token matches"""
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        return JSONResponse(status_code=401, content={"success": False, "error": "Invalid admin token"})
+    return None
+
+class ProfilerSettings(BaseModel):
+    enabled: Optional[bool] = None
+    routes: Optional[List[str]] = None
+    sample_rate: Optional[float] = None
+    interval_ms: Optional[float] = None
+
+@app.get("/admin/profiler")
+async def profiler_status(x_admin_token: Optional[str] = Header(None)):
+    denied = admin_denied(x_admin_token)
+    if denied:
+        return denied
+    return request_profiler.snapshot()
+
+@app.post("/admin/profiler")
+async def configure_profiler(settings: ProfilerSettings, x_admin_token: Optional[str] = Header(None)):
+    """Turn profiling on or off and adjust routes, sample rate and interval; turning it off writes the profiles"""
+    denied = admin_denied(x_admin_token)
+    if denied:
+        return denied
+    request_profiler.configure(**settings.dict())
+    files = await asyncio.to_thread(request_profiler.flush) if settings.enabled is False else []
+    return {"success": True, "files": files, **request_profiler.snapshot()}
+
+@app.post("/admin/profiler/flush")
+async def flush_profiler(x_admin_token: Optional[str] = Header(None)):
+    """Write the collapsed stacks gathered so far, one file per route"""
+    denied = admin_denied(x_admin_token)
+    if denied:
+        return denied
+    return {"success": True, "files": await asyncio.to_thread(request_profiler.flush)}
+
+@app.on_event("shutdown")
+async def stop_profiler():
+    request_profiler.stop()
+    await asyncio.to_thread(request_profiler.flush)
 
 @app.get("/")
 async def root():
@@ -481,17 +1566,17 @@ async def create_demo_patient():
     """Create a demo patient for testing"""
     try:
         # First check if patient exists
-        profile_resp = supabase_client.table("profiles").select("*").eq("email", "patient@demo.com").execute()
+        profile = await storage.get_profile_by_email("patient@demo.com")
         
-        if profile_resp.data:
-            print("Demo patient profile exists")
-            user_id = profile_resp.data[0]["id"]
+        if profile:
+            log.info("Demo patient profile exists")
+            user_id = profile["id"]
             
             # Check if patient record exists
-            patient_resp = supabase_client.table("patients").select("*").eq("user_id", user_id).execute()
+            patient = await storage.get_patient_by_user(user_id)
             
-            if patient_resp.data:
-                patient_id = patient_resp.data[0]["id"]
+            if patient:
+                patient_id = patient["id"]
                 return {
                     "success": True,
                     "message": "Demo patient already exists",
@@ -500,14 +1585,15 @@ async def create_demo_patient():
                 }
             else:
                 # Create patient record
-                patient_create = supabase_client.table("patients").insert({
+                patient = await storage.create_patient({
                     "user_id": user_id,
                     "date_of_birth": "1990-01-01",
                     "gender": "male"
-                }).execute()
+                })
                 
-                if patient_create.data:
-                    patient_id = patient_create.data[0]["id"]
+                if patient:
+                    patient_id = patient["id"]
+                    roster_cache.clear()
                     return {
                         "success": True,
                         "message": "Demo patient created",
@@ -520,28 +1606,40 @@ async def create_demo_patient():
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+roster_cache = TTLCache(max_entries=64, ttl=ROSTER_CACHE_TTL_S)
+
 @app.get("/list-patients")
-async def list_patients():
-    """List all available patients for debugging"""
+async def list_patients(limit: int = 100, offset: int = 0):
+    """List patients, one page per round trip; pages are cached briefly"""
     try:
-        # Get all profiles with patient role
-        profiles_resp = supabase_client.table("profiles").select("id, email, full_name, role").eq("role", "patient").execute()
+        limit = max(1, min(limit, ROSTER_PAGE_MAX))
+        offset = max(0, offset)
+        cached = roster_cache.get((limit, offset))
+        if cached is not None:
+            return cached
+        
+        # Profiles joined to their patient record, so the roster is a single query
+        profiles, total = await storage.list_patient_profiles(limit, offset)
         
         patients_info = []
-        for profile in profiles_resp.data or []:
-            # Get patient record if exists
-            patient_resp = supabase_client.table("patients").select("id").eq("user_id", profile["id"]).execute()
-            patient_id = patient_resp.data[0]["id"] if patient_resp.data else None
-            
+        for profile in profiles:
             patients_info.append({
                 "email": profile["email"],
                 "name": profile["full_name"],
                 "user_id": profile["id"],
-                "patient_id": patient_id,
-                "has_patient_record": patient_id is not None
+                "patient_id": profile["patient_id"],
+                "has_patient_record": profile["patient_id"] is not None
             })
         
-        return {"patients": patients_info}
+        has_more = offset + len(patients_info) < total if total is not None else len(patients_info) == limit
+        result = {
+            "patients": patients_info,
+            "total": total,
+            "next_offset": offset + len(patients_info) if has_more else None,
+            "has_more": has_more
+        }
+        roster_cache.set((limit, offset), result)
+        return result
     except Exception as e:
         return {"error": str(e)}
 
@@ -550,25 +1648,23 @@ async def debug_user(email: str):
     """Debug endpoint to check user data"""
     try:
         # Get profile
-        profile_resp = supabase_client.table("profiles").select("*").eq("email", email).execute()
+        profiles = await storage.list_profiles_by_email(email)
         
         # Get patient record if exists
-        patient_resp = None
-        if profile_resp.data:
-            user_id = profile_resp.data[0]["id"]
-            patient_resp = supabase_client.table("patients").select("*").eq("user_id", user_id).execute()
+        patients = None
+        if profiles:
+            patients = await storage.list_patients_by_user(profiles[0]["id"])
         
         # Get devices if patient exists
-        devices_resp = None
-        if patient_resp and patient_resp.data:
-            patient_id = patient_resp.data[0]["id"]
-            devices_resp = supabase_client.table("ecg_devices").select("*").eq("patient_id", patient_id).execute()
+        devices = None
+        if patients:
+            devices = await storage.list_devices(patients[0]["id"])
         
         return {
             "email": email,
-            "profile": profile_resp.data,
-            "patient": patient_resp.data if patient_resp else None,
-            "devices": devices_resp.data if devices_resp else None
+            "profile": profiles,
+            "patient": patients,
+            "devices": devices
         }
     except Exception as e:
         return {"error": str(e)}
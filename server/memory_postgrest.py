@@ -0,0 +1,138 @@
+"""
+In-memory stand-in for Supabase's PostgREST API, used as an httpx transport.
+
+It implements the subset of PostgREST the backend uses: eq/neq/gt/gte/lt/lte
+filters, order, limit/offset, column projection, single-object responses,
+count=exact, and insert/update with returned rows. Optional latency emulates
+the network round trip to a hosted database. It is meant for load tests and
+local runs (SupabaseDB(..., transport=MemoryPostgREST())), not for tests of
+query semantics.
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+
+import httpx
+
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+}
+
+
+def _coerce(value, sample):
+    """Filter values arrive as strings; compare them as the stored column's type."""
+    if isinstance(sample, bool):
+        return value == "true"
+    if isinstance(sample, (int, float)):
+        return type(sample)(value)
+    return value
+
+
+class MemoryPostgREST(httpx.AsyncBaseTransport):
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000
+        self.tables = {}
+        self.requests = 0
+
+    def table(self, name):
+        return self.tables.setdefault(name, [])
+
+    def seed(self, name, rows):
+        """Insert rows directly, filling in id like the database default would."""
+        return [self._insert(name, row) for row in rows]
+
+    def _insert(self, name, row):
+        row = dict(row)
+        row.setdefault("id", str(uuid.uuid4()))
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        for key, value in row.items():
+            if value == "now()":
+                row[key] = datetime.now(timezone.utc).isoformat()
+        self.table(name).append(row)
+        return row
+
+    async def handle_async_request(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            return self._handle(request)
+        except (ValueError, KeyError) as e:
+            return self._error(400, str(e))
+
+    def _handle(self, request):
+        path = request.url.path.split("/rest/v1/", 1)[-1]
+        if path.startswith("rpc/"):
+            return self._error(404, f"Function {path[4:]} is not available in memory")
+
+        rows = self.table(path)
+        select = "*"
+        order = []
+        limit = offset = None
+        filters = []
+        for key, value in parse_qsl(request.url.query.decode(), keep_blank_values=True):
+            if key == "select":
+                select = value
+            elif key == "order":
+                order = [part.split(".") for part in value.split(",")]
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            elif key in ("columns", "on_conflict"):
+                continue
+            else:
+                op, _, operand = value.partition(".")
+                if op not in OPERATORS:
+                    raise ValueError(f"Unsupported filter {key}={value}")
+                filters.append((key, OPERATORS[op], operand))
+
+        def matches(row):
+            return all(fn(row.get(col), _coerce(operand, row.get(col))) for col, fn, operand in filters)
+
+        if request.method == "POST":
+            body = json.loads(request.content)
+            created = [self._insert(path, row) for row in (body if isinstance(body, list) else [body])]
+            return self._respond(request, created, 201)
+        if request.method == "PATCH":
+            changes = json.loads(request.content)
+            updated = [row for row in rows if matches(row)]
+            for row in updated:
+                row.update(changes)
+            return self._respond(request, updated, 200)
+        if request.method != "GET":
+            raise ValueError(f"Unsupported method {request.method}")
+
+        found = [row for row in rows if matches(row)]
+        for column, *direction in reversed(order):
+            found.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse="desc" in direction)
+        total = len(found)
+        start = offset or 0
+        found = found[start:start + limit if limit is not None else None]
+        if select != "*":
+            columns = [c for c in select.split(",") if "(" not in c]
+            found = [{c: row.get(c) for c in columns} for row in found]
+        response = self._respond(request, found, 200)
+        if "count=exact" in request.headers.get("prefer", ""):
+            end = start + len(found) - 1
+            response.headers["content-range"] = f"{start}-{end}/{total}" if found else f"*/{total}"
+        return response
+
+    def _respond(self, request, rows, status):
+        if request.headers.get("accept") == "application/vnd.pgrst.object+json":
+            if len(rows) != 1:
+                return self._error(406, f"JSON object requested, {len(rows)} rows returned")
+            return httpx.Response(status, json=rows[0])
+        return httpx.Response(status, json=rows)
+
+    def _error(self, status, message):
+        # Same shape as PostgREST errors so postgrest-py raises APIError with the message
+        return httpx.Response(status, json={"message": message, "code": str(status), "hint": None, "details": None})
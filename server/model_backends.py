@@ -0,0 +1,126 @@
+"""
+CPU inference backends for the imaging classifier.
+
+  torch - eager fp32 PyTorch (the reference)
+  int8  - torch dynamic int8 quantization of the Linear layers
+  onnx  - ONNX export cached on disk, run with ONNX Runtime
+
+build_backend() returns a forward(pixel_values) -> logits callable. Non-eager
+backends are checked against eager logits on a synthetic batch at startup and
+fall back to eager if they disagree beyond the tolerance.
+"""
+
+import copy
+import logging
+import os
+import time
+
+import torch
+from PIL import Image, ImageDraw
+
+log = logging.getLogger("medipulse.model_backends")
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def _eager_forward(model):
+    def forward(pixel_values):
+        with torch.no_grad():
+            return model(pixel_values=pixel_values).logits
+    return forward
+
+
+def _int8_forward(model):
+    quantized = torch.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+    quantized.eval()
+    return _eager_forward(quantized)
+
+
+def _onnx_path(model_name, cache_dir):
+    safe_name = model_name.replace("/", "__")
+    return os.path.join(cache_dir, f"{safe_name}.onnx")
+
+
+def _onnx_forward(model, model_name, cache_dir, sample):
+    import onnxruntime as ort
+
+    path = _onnx_path(model_name, cache_dir)
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        log.info(f"Exporting {model_name} to ONNX at {path}")
+        tmp_path = path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample,),
+                tmp_path,
+                input_names=["pixel_values"],
+                output_names=["logits"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+                opset_version=17,
+            )
+        # Only publish a complete export so a crash mid-write can't poison the cache
+        os.replace(tmp_path, path)
+    else:
+        log.info(f"Using cached ONNX export {path}")
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = torch.get_num_threads()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def forward(pixel_values):
+        logits = session.run(["logits"], {"pixel_values": pixel_values.numpy()})[0]
+        return torch.from_numpy(logits)
+    return forward
+
+
+def _validation_batch(processor):
+    images = []
+    for i in range(2):
+        img = Image.new('RGB', (320, 320), color='black')
+        draw = ImageDraw.Draw(img)
+        draw.ellipse([40 + i * 20, 40, 280, 280 - i * 20], fill='gray', outline='white', width=3)
+        images.append(img)
+    return processor(images=images, return_tensors="pt")["pixel_values"]
+
+
+def build_backend(kind, model, processor, model_name, cache_dir="model_cache", atol=0.05):
+    """
+    Return (forward, backend_name). backend_name is the backend actually in
+    use, which is "torch" if the requested one failed to build or validate.
+    """
+    model.eval()
+    eager = _eager_forward(model)
+    if kind not in BACKENDS:
+        log.warning(f"Unknown INFERENCE_BACKEND '{kind}', using torch")
+        return eager, "torch"
+    if kind == "torch":
+        return eager, "torch"
+
+    try:
+        sample = _validation_batch(processor)
+        if kind == "int8":
+            forward = _int8_forward(model)
+        else:
+            forward = _onnx_forward(model, model_name, cache_dir, sample)
+
+        # Validate against eager on logits and predicted class
+        started = time.perf_counter()
+        reference = eager(sample)
+        eager_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        candidate = forward(sample)
+        candidate_ms = (time.perf_counter() - started) * 1000
+    except Exception as e:
+        log.warning(f"Could not build {kind} backend, using torch: {e}")
+        return eager, "torch"
+
+    max_diff = (reference - candidate).abs().max().item()
+    same_class = torch.equal(reference.argmax(-1), candidate.argmax(-1))
+    if not torch.allclose(reference, candidate, atol=atol) or not same_class:
+        log.warning(f"{kind} backend disagrees with eager (max logit diff {max_diff:.4f}, same class {same_class}), using torch")
+        return eager, "torch"
+
+    log.info(f"{kind} backend validated: max logit diff {max_diff:.4f}, eager {eager_ms:.0f} ms vs {kind} {candidate_ms:.0f} ms on batch of {len(sample)}")
+    return forward, kind
@@ -0,0 +1,196 @@
+"""
+Opt-in wall-clock sampling profiler for chosen routes.
+
+ProfilerMiddleware picks a `sample_rate` fraction of requests whose path
+starts with one of `routes`. While at least one picked request is in
+flight, a wall-clock interval timer (setitimer/SIGALRM) fires every
+`interval_ms`. The handler runs on the event loop thread and records the
+interrupted stack plus the stacks of busy worker threads (asyncio.to_thread,
+the inference pool), so time spent waiting on I/O shows up as well as CPU.
+
+Sampling from a signal handler rather than a sampler thread matters: a
+thread can only look at the event loop's stack when the loop releases the
+GIL, which skews samples towards whatever syscall happens to release it.
+
+Requests share one event loop, so samples taken while two profiled requests
+overlap are credited to both of their routes; at low sample rates overlap is
+rare. Samples are aggregated in memory and flush() writes one collapsed
+stack file per route ("frame;frame;frame count" lines), the input format of
+flamegraph.pl, inferno and speedscope.
+
+When disabled the middleware costs one attribute check per request, and the
+timer only runs while a profiled request is in flight. Needs a platform with
+setitimer (Linux, macOS).
+"""
+
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+log = logging.getLogger("medipulse.profiler")
+
+# Leaf frames that mean a worker thread is parked with nothing to do
+IDLE_LEAVES = ("threading.py", "queue.py", os.path.join("concurrent", "futures", "thread.py"))
+
+
+class RequestProfiler:
+    def __init__(self, output_dir, routes=(), sample_rate=0.05, interval_ms=5.0, max_depth=96):
+        self.output_dir = output_dir
+        self.routes = tuple(routes)
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.max_depth = max_depth
+        self.enabled = False
+
+        # Reentrant: the signal handler runs on the event loop thread, possibly while begin()/end() hold it
+        self._lock = threading.RLock()
+        self._active = Counter()      # route -> profiled requests in flight
+        self._stacks = {}             # route -> Counter of collapsed stacks
+        self._requests = Counter()    # route -> profiled requests since the last flush
+        self._ticking = False
+        self._installed = False
+        self.stats = {"profiled_requests": 0, "samples": 0, "sampling_ms": 0.0, "files_written": 0}
+
+    def configure(self, enabled=None, routes=None, sample_rate=None, interval_ms=None):
+        """Change settings at runtime. Enabling installs the SIGALRM handler, so call it from the main thread."""
+        if routes is not None:
+            self.routes = tuple(routes)
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, sample_rate))
+        if interval_ms is not None:
+            self.interval = max(1.0, interval_ms) / 1000
+        if enabled and not self._installed:
+            if not hasattr(signal, "setitimer"):
+                raise RuntimeError("Sampling profiler needs signal.setitimer, which this platform lacks")
+            signal.signal(signal.SIGALRM, self._on_alarm)
+            self._installed = True
+        if enabled is not None:
+            self.enabled = enabled
+        log.info("Profiler configured", extra={
+            "enabled": self.enabled, "routes": ",".join(self.routes),
+            "sample_rate": self.sample_rate, "interval_ms": self.interval * 1000
+        })
+
+    def stop(self):
+        self.enabled = False
+        with self._lock:
+            self._active.clear()
+            self._set_timer(False)
+
+    def pick(self, path):
+        """Route prefix to profile this request under, or None"""
+        if not self.enabled:
+            return None
+        for route in self.routes:
+            if path.startswith(route):
+                return route if random.random() < self.sample_rate else None
+        return None
+
+    def begin(self, route):
+        with self._lock:
+            self._active[route] += 1
+            self._requests[route] += 1
+            self.stats["profiled_requests"] += 1
+            self._set_timer(True)
+
+    def end(self, route):
+        with self._lock:
+            self._active[route] -= 1
+            if self._active[route] <= 0:
+                del self._active[route]
+            if not self._active:
+                self._set_timer(False)
+
+    def _set_timer(self, on):
+        if on != self._ticking:
+            signal.setitimer(signal.ITIMER_REAL, self.interval if on else 0, self.interval if on else 0)
+            self._ticking = on
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            # Function granularity (no line numbers) so a function's samples merge into one frame
+            names.append(f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+    def _on_alarm(self, signum, frame):
+        started = time.perf_counter()
+        main_id = threading.get_ident()
+        # frame is where the event loop thread was interrupted
+        stacks = [f"event-loop;{self._collapse(frame)}"] if frame is not None else []
+        names = None
+        for thread_id, thread_frame in sys._current_frames().items():
+            if thread_id == main_id or thread_frame.f_code.co_filename.endswith(IDLE_LEAVES):
+                continue
+            if names is None:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            stacks.append(f"{names.get(thread_id, 'thread')};{self._collapse(thread_frame)}")
+        with self._lock:
+            for route in self._active:
+                self._stacks.setdefault(route, Counter()).update(stacks)
+            self.stats["samples"] += 1
+            self.stats["sampling_ms"] += (time.perf_counter() - started) * 1000
+
+    def flush(self):
+        """Write one collapsed-stack file per route sampled since the last flush; returns their paths"""
+        with self._lock:
+            stacks, self._stacks = self._stacks, {}
+            requests, self._requests = self._requests, Counter()
+        if not stacks:
+            return []
+        os.makedirs(self.output_dir, exist_ok=True)
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+        paths = []
+        for route, counts in stacks.items():
+            slug = route.strip("/").replace("/", "_") or "root"
+            path = os.path.join(self.output_dir, f"{slug}-{stamp}.folded")
+            with open(path, "w") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+            log.info("Profile written", extra={"route": route, "path": path, "requests": requests[route],
+                                               "samples": sum(counts.values())})
+        self.stats["files_written"] += len(paths)
+        return paths
+
+    def snapshot(self):
+        with self._lock:
+            pending = {route: sum(counts.values()) for route, counts in self._stacks.items()}
+            active = dict(self._active)
+            samples = self.stats["samples"]
+            return {
+                "enabled": self.enabled,
+                "routes": list(self.routes),
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval * 1000,
+                "active": active,
+                "unflushed_samples": pending,
+                "avg_sample_ms": round(self.stats["sampling_ms"] / samples, 3) if samples else 0.0,
+                **{k: v for k, v in self.stats.items() if k != "sampling_ms"},
+            }
+
+
+class ProfilerMiddleware:
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        route = self.profiler.pick(scope["path"]) if scope["type"] == "http" else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        self.profiler.begin(route)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.end(route)
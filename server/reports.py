@@ -0,0 +1,273 @@
+"""
+Background PDF reports: ECG trend charts plus MRI analysis summaries.
+
+A report is a job. submit() returns at once with a job id; gathering the data
+happens on the event loop (a handful of aggregate queries, never raw rows)
+and rendering happens in a separate worker process, so even multi-month
+reports cost API workers nothing but a few awaits.
+
+Reports cover the `days` before the patient's data watermark (newest reading
+and newest MRI scan), so the rendered PDF is fully determined by
+(patient, days, watermark). Finished PDFs are cached on disk under that key:
+asking again before new data arrives returns the cached file, and identical
+requests made while a job is running share that job.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+from inference import PoolSaturatedError
+
+log = logging.getLogger("medipulse.reports")
+
+# Bump when the layout changes so cached PDFs are re-rendered
+REPORT_VERSION = "1"
+
+
+def render_report(path, data):
+    """Render one report to `path`. Runs in a worker process; data is plain dicts and lists."""
+    from reportlab.graphics.charts.lineplots import LinePlot
+    from reportlab.graphics.shapes import Drawing, String
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph("MediPulse AI - Patient Report", styles["Title"]),
+        Paragraph(f"Patient ID: {data['patient_id']}", styles["Normal"]),
+        Paragraph(f"Period: {data['since'][:16]} to {data['until'][:16]} UTC ({data['days']} days)", styles["Normal"]),
+        Paragraph(f"Generated: {data['generated_at'][:19]} UTC", styles["Normal"]),
+        Spacer(1, 0.5 * cm),
+        Paragraph("ECG Summary", styles["Heading2"]),
+    ]
+
+    buckets = data["buckets"]
+    summary = data["summary"]
+    if not buckets:
+        story.append(Paragraph("No ECG readings in this period.", styles["Normal"]))
+    else:
+        rows = [
+            ["Readings", summary["readings"]],
+            ["Readings with anomalies", summary["anomalies"]],
+            ["Heart rate (min / avg / max)", f"{summary['heart_rate_min']} / {summary['heart_rate_avg']} / {summary['heart_rate_max']} BPM"],
+            ["Temperature (min / avg / max)", f"{summary['temperature_min']} / {summary['temperature_avg']} / {summary['temperature_max']} °F"],
+            ["Chart resolution", f"{data['bucket_seconds']} s per point"],
+        ]
+        table = Table(rows, colWidths=[7 * cm, 9 * cm])
+        table.setStyle(TableStyle([
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+            ("BACKGROUND", (0, 0), (0, -1), colors.whitesmoke),
+        ]))
+        story += [table, Spacer(1, 0.5 * cm)]
+
+        start = buckets[0]["t"]
+        hours = [(b["t"] - start) / 3600 for b in buckets]
+
+        def chart(title, xs, series, unit):
+            drawing = Drawing(16 * cm, 6 * cm)
+            plot = LinePlot()
+            plot.x, plot.y = 1.2 * cm, 0.8 * cm
+            plot.width, plot.height = 14.4 * cm, 4.4 * cm
+            plot.data = [list(zip(xs, values)) for values, _ in series]
+            for i, (_, color) in enumerate(series):
+                plot.lines[i].strokeColor = color
+                plot.lines[i].strokeWidth = 1.2 if i == 0 else 0.5
+            plot.xValueAxis.labelTextFormat = "%dh"
+            drawing.add(plot)
+            drawing.add(String(1.2 * cm, 5.5 * cm, f"{title} ({unit})", fontSize=9))
+            return drawing
+
+        story.append(chart("Heart rate: average, min and max", hours, [
+            ([b["heart_rate_avg"] for b in buckets], colors.darkred),
+            ([b["heart_rate_min"] for b in buckets], colors.lightcoral),
+            ([b["heart_rate_max"] for b in buckets], colors.lightcoral),
+        ], "BPM"))
+        temperatures = [b for b in buckets if b["temperature_avg"] is not None]
+        if temperatures:
+            story.append(chart("Temperature: average", [(b["t"] - start) / 3600 for b in temperatures], [
+                ([b["temperature_avg"] for b in temperatures], colors.darkblue),
+            ], "°F"))
+        story.append(chart("Readings with anomalies per point", hours, [([b["anomalies"] for b in buckets], colors.orange)], "count"))
+
+    story += [Spacer(1, 0.5 * cm), Paragraph("MRI Analyses", styles["Heading2"])]
+    if not data["mri_scans"]:
+        story.append(Paragraph("No MRI scans on record.", styles["Normal"]))
+    for scan in data["mri_scans"]:
+        result = scan.get("ai_analysis_result") or {}
+        story.append(Paragraph(
+            f"<b>{scan.get('file_name', 'scan')}</b> - {str(scan.get('created_at', ''))[:10]} - "
+            f"{result.get('primary_diagnosis', 'n/a')} (confidence {result.get('confidence_score', 'n/a')}, "
+            f"model {result.get('model_used', 'n/a')})",
+            styles["Normal"],
+        ))
+        gemini = (result.get("gemini_analysis") or "").strip()
+        if gemini:
+            excerpt = gemini[:600] + ("..." if len(gemini) > 600 else "")
+            story.append(Paragraph(excerpt.replace("\n", "<br/>").replace("**", ""), styles["BodyText"]))
+        story.append(Spacer(1, 0.3 * cm))
+
+    story.append(Paragraph(
+        "This AI-generated report is intended for educational and research purposes only. "
+        "All findings must be reviewed by a qualified medical professional.",
+        styles["Italic"],
+    ))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    SimpleDocTemplate(tmp_path, pagesize=A4, title="MediPulse AI Patient Report").build(story)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class ReportJobs:
+    def __init__(self, collect, watermark, cache_dir, workers=1, max_pending=16, max_cached=200, keep_jobs=500):
+        # watermark(patient_id) -> str and collect(patient_id, days, watermark) -> dict are async callables
+        self.collect = collect
+        self.watermark = watermark
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_cached = max_cached
+        self.keep_jobs = keep_jobs
+        # Started by the first render, so main can be imported in a parent that forks workers (serve.py)
+        self._pool = None
+        self._jobs = OrderedDict()
+        self._inflight = {}
+        # The loop only holds weak references to tasks; keep running jobs alive until they finish
+        self._tasks = set()
+        self.stats = {"submitted": 0, "cache_hits": 0, "coalesced": 0, "rendered": 0, "failed": 0, "last_render_ms": 0.0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _new_pool(self):
+        # spawn: render workers must not inherit the server's threads or loaded models
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @property
+    def pending(self):
+        return len(self._inflight)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def _new_job(self, patient_id, days, key, status):
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "patient_id": patient_id,
+            "days": days,
+            "status": status,
+            "cached": status == "done",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat() if status == "done" else None,
+            "error": None,
+            "_key": key,
+        }
+        self._jobs[job["job_id"]] = job
+        while len(self._jobs) > self.keep_jobs:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest["status"] in ("queued", "running"):
+                break
+            del self._jobs[oldest_id]
+        return job
+
+    async def submit(self, patient_id, days):
+        """Return a job for this report: already done if cached, shared if identical work is running."""
+        self.stats["submitted"] += 1
+        watermark = await self.watermark(patient_id)
+        key = hashlib.sha256(f"{REPORT_VERSION}|{patient_id}|{days}|{watermark}".encode()).hexdigest()
+
+        if os.path.exists(self._path(key)):
+            self.stats["cache_hits"] += 1
+            os.utime(self._path(key))
+            return self._new_job(patient_id, days, key, "done")
+        if key in self._inflight:
+            self.stats["coalesced"] += 1
+            return self._jobs[self._inflight[key]]
+        if self.pending >= self.max_pending:
+            raise PoolSaturatedError(f"Report queue full ({self.pending} jobs pending)", retry_after=5)
+
+        job = self._new_job(patient_id, days, key, "queued")
+        self._inflight[key] = job["job_id"]
+        task = asyncio.create_task(self._run(job, watermark))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job, watermark):
+        try:
+            data = await self.collect(job["patient_id"], job["days"], watermark)
+            job["status"] = "running"
+            started = time.perf_counter()
+            if self._pool is None:
+                self._pool = self._new_pool()
+            await asyncio.get_running_loop().run_in_executor(self._pool, render_report, self._path(job["_key"]), data)
+            self.stats["last_render_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.stats["rendered"] += 1
+            job["status"] = "done"
+            self._prune_cache()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM); fail this job but give later ones a fresh pool
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+            self.stats["failed"] += 1
+            job["status"] = "failed"
+            job["error"] = f"Report worker crashed: {e}"
+            log.error(f"Report job {job['job_id']} failed, restarting render pool: {e}")
+        except Exception as e:
+            self.stats["failed"] += 1
+            job["status"] = "failed"
+            job["error"] = str(e)
+            log.error(f"Report job {job['job_id']} failed: {e}")
+        finally:
+            job["finished_at"] = datetime.now(timezone.utc).isoformat()
+            self._inflight.pop(job["_key"], None)
+
+    def _prune_cache(self):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(".pdf")]
+        if len(files) <= self.max_cached:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_cached]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def pdf_path(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != "done":
+            return None
+        path = self._path(job["_key"])
+        return path if os.path.exists(path) else None
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "jobs": len(self._jobs),
+            **self.stats,
+        }
@@ -0,0 +1,203 @@
+"""
+Content-addressed cache for /upload-mri analysis results.
+
+Keys are a SHA-256 over the uploaded bytes, the active model name and the
+prompt version, so a re-upload of the same scan reuses the earlier analysis
+while a model or prompt change naturally misses. Entries live in an LRU
+memory tier and, when `disk_dir` is set, in a size-bounded directory of JSON
+files that survives restarts.
+
+On the event loop use aget()/aset(): memory hits are answered inline and
+disk reads and writes run on a worker thread.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger("medipulse.result_cache")
+
+
+class ResultCache:
+    def __init__(self, max_entries=256, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._disk_bytes = 0
+        # Disk work runs on worker threads; this guards _disk_bytes and eviction
+        self._disk_lock = threading.Lock()
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "disk_evictions": 0,
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_files())
+
+    @staticmethod
+    def make_key(contents, model_name, prompt_version):
+        digest = hashlib.sha256()
+        digest.update(contents)
+        return ResultCache._finish_key(digest, model_name, prompt_version)
+
+    @staticmethod
+    def make_key_from_file(f, model_name, prompt_version, chunk_size=1024 * 1024):
+        """Same key as make_key over the file's bytes, hashed in chunks. Returns (key, size) and rewinds f."""
+        digest = hashlib.sha256()
+        size = 0
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+        f.seek(0)
+        return ResultCache._finish_key(digest, model_name, prompt_version), size
+
+    @staticmethod
+    def _finish_key(digest, model_name, prompt_version):
+        digest.update(b"\0")
+        digest.update(model_name.encode())
+        digest.update(b"\0")
+        digest.update(str(prompt_version).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        value = self._get_memory(key)
+        if value is None and self.disk_dir:
+            value = self._disk_hit(key, self._read_disk(key))
+        if value is None:
+            self.stats["misses"] += 1
+        return value
+
+    async def aget(self, key):
+        """get() without blocking the event loop on the disk tier."""
+        value = self._get_memory(key)
+        if value is None and self.disk_dir:
+            value = self._disk_hit(key, await asyncio.to_thread(self._read_disk, key))
+        if value is None:
+            self.stats["misses"] += 1
+        return value
+
+    def set(self, key, value):
+        stored = self._store(key, value)
+        if self.disk_dir:
+            self._write_disk(key, stored)
+
+    async def aset(self, key, value):
+        """set() without blocking the event loop on the disk tier."""
+        stored = self._store(key, value)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, stored)
+
+    def _get_memory(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            return None
+        self._entries.move_to_end(key)
+        self.stats["memory_hits"] += 1
+        return dict(value)
+
+    def _disk_hit(self, key, value):
+        if value is None:
+            return None
+        self.stats["disk_hits"] += 1
+        self._remember(key, value)
+        return dict(value)
+
+    def _store(self, key, value):
+        stored = dict(value)
+        self._remember(key, stored)
+        self.stats["stores"] += 1
+        return stored
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+            # Touch so disk eviction approximates LRU
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning(f"Discarding unreadable MRI cache entry {key}: {e}")
+            with self._disk_lock:
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                if self._remove(path):
+                    self._disk_bytes -= size
+            return None
+
+    def _write_disk(self, key, value):
+        try:
+            with self._disk_lock:
+                self._write(key, value)
+        except OSError as e:
+            log.warning(f"Could not write MRI cache entry to disk: {e}")
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_files(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def _write(self, key, value):
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        if os.path.exists(path):
+            self._disk_bytes -= os.path.getsize(path)
+        os.replace(tmp_path, path)
+        self._disk_bytes += os.path.getsize(path)
+        if self._disk_bytes > self.disk_max_bytes:
+            self._evict()
+
+    def _evict(self):
+        # Oldest-touched first until back under the bound
+        for _, path, size in sorted(self._disk_files()):
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            if self._remove(path):
+                self._disk_bytes -= size
+                self.stats["disk_evictions"] += 1
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def snapshot(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk_dir": self.disk_dir,
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes if self.disk_dir else 0,
+            **self.stats,
+        }
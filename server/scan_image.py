@@ -0,0 +1,53 @@
+"""
+Bounded-memory decoding for /upload-mri scans.
+
+Uploads stay in the request's spooled temp file (on disk past 1 MB) and are
+never read into one bytes object. decode_scan() opens that file lazily and
+shrinks the image as early as the format allows. JPEG is decoded straight
+at a reduced DCT scale via draft(), so an 8000 px, 40+ MB scan never exists
+as a full-resolution bitmap. Lossless formats (PNG, TIFF) have to be decoded
+once at full size, but are then cut down by reduce() with no further
+full-size copies. Grayscale scans stay single-channel until they are small.
+
+The decoded image feeds both branches. The classifier's processor resizes
+it to the model input, and encode_jpeg() produces the single JPEG sent to
+Gemini, bounded in bytes.
+"""
+
+import io
+
+from PIL import Image
+
+# Modes Pillow can resample directly; anything else is converted to RGB first
+RESAMPLE_MODES = ("1", "L", "LA", "RGB", "RGBA", "I", "F")
+
+
+def decode_scan(f, max_side=1024):
+    """Decode an image file to RGB with its long edge at most max_side. Returns (image, source_size)."""
+    f.seek(0)
+    with Image.open(f) as src:
+        source_size = src.size
+        # JPEG only: pick the smallest DCT scale that still covers max_side; a no-op for other formats
+        src.draft(src.mode if src.mode in ("L", "RGB") else "RGB", (max_side, max_side))
+        if src.mode not in RESAMPLE_MODES:
+            src = src.convert("RGB")
+        # reduce() by whole factors first, then a LANCZOS pass for the remainder
+        src.thumbnail((max_side, max_side), resample=Image.Resampling.LANCZOS, reducing_gap=2.0)
+        image = src.convert("RGB") if src.mode != "RGB" else src.copy()
+    f.seek(0)
+    return image, source_size
+
+
+def encode_jpeg(image, max_bytes=1024 * 1024, quality=85, min_quality=45):
+    """JPEG bytes for the image, lowering quality and then size until the result fits in max_bytes"""
+    while True:
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=quality, optimize=True)
+        if buf.tell() <= max_bytes:
+            return buf.getvalue()
+        if quality > min_quality:
+            quality -= 10
+        elif min(image.size) > 64:
+            image = image.resize((image.width * 3 // 4, image.height * 3 // 4), Image.Resampling.LANCZOS)
+        else:
+            return buf.getvalue()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Multi-worker server that loads the imaging model once.
+
+`uvicorn main:app --workers N` starts N interpreters that each import main
+and load their own copy of the MEDICAL_MODELS checkpoint. serve.py imports
+main once in this process with MODEL_LOAD_MODE=eager, then forks the
+workers. They inherit the loaded weights and only read them, so the kernel
+keeps one copy of those pages, shared copy-on-write; each worker adds its
+own heap, not another model. gc.freeze() before forking keeps the garbage
+collector from writing into every inherited object (which would unshare
+those pages over time).
+
+All workers accept on one listening socket. This process only supervises:
+it restarts workers that exit, passes SIGTERM/SIGINT on to them, and every
+--memory-report-s logs per-worker RSS and PSS, where PSS splits shared pages
+between the processes that map them and so adds up to the real total.
+
+The model is loaded with one intra-op thread (OpenMP thread pools do not
+survive fork), and --threads-per-worker sets torch's per-worker count after
+the fork. With INFERENCE_BACKEND=onnx the ONNX Runtime session stays at one
+thread per worker, so scale it with --workers.
+
+State kept in process memory is per worker: live ECG rings and WebSocket
+subscribers, anomaly windows, waveform analyzers, the device/roster/result
+caches, report jobs and profiler settings. A live viewer only sees readings
+posted to its own worker, so deployments that depend on /ws/ecg should keep
+one worker for those routes.
+
+Linux only (fork, /proc).
+
+Usage: python serve.py --workers 4 [--host 0.0.0.0] [--port 8000] [--threads-per-worker 1]
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import uvicorn
+
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="torch intra-op threads in each worker")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0, help="seconds workers get to drain on shutdown")
+    parser.add_argument("--memory-report-s", type=float, default=60.0, help="0 disables the periodic memory log")
+    return parser.parse_args()
+
+
+def run_worker(main, sock, args):
+    """Body of a forked worker; never returns"""
+    status = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(args.threads_per_worker)
+        config = uvicorn.Config(
+            main.app,
+            log_config=None,  # keep main's logging setup
+            access_log=False,
+            timeout_graceful_shutdown=args.graceful_timeout,
+        )
+        uvicorn.Server(config).run(sockets=[sock])
+        status = 0
+    except BaseException:
+        main.log.exception("Worker crashed")
+    finally:
+        os._exit(status)
+
+
+def main():
+    args = parse_args()
+
+    # Load the model here, before forking, on a single thread
+    if os.getenv("MODEL_LOAD_MODE", "").lower() != "off":
+        os.environ["MODEL_LOAD_MODE"] = "eager"
+    os.environ["OMP_NUM_THREADS"] = "1"
+    os.environ["MKL_NUM_THREADS"] = "1"
+
+    import main as app_main
+    from telemetry import process_memory
+
+    log = logging.getLogger("medipulse.serve")
+    if threading.active_count() > 1:
+        names = ", ".join(t.name for t in threading.enumerate() if t is not threading.main_thread())
+        log.warning(f"Threads running before fork will not exist in the workers: {names}")
+
+    gc.collect()
+    gc.freeze()
+
+    family = socket.AF_INET6 if ":" in args.host else socket.AF_INET
+    sock = socket.create_server((args.host, args.port), family=family, backlog=args.backlog)
+    log.info("Serving", extra={
+        "host": args.host, "port": args.port, "workers": args.workers,
+        "model": app_main.active_model_name, "backend": app_main.active_backend
+    })
+
+    workers = {}  # pid -> (index, started)
+    stopping = False
+
+    def spawn(index):
+        # Blocked across fork so a stop signal can't reach the child before it drops the supervisor's handler
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            run_worker(app_main, sock, args)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        workers[pid] = (index, time.monotonic())
+        log.info("Worker started", extra={"worker": index, "pid": pid})
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        log.info(f"Received {signal.Signals(signum).name}, stopping {len(workers)} workers")
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    next_report = time.monotonic() + args.memory_report_s
+    stop_deadline = None
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            index, started = workers.pop(pid)
+            if not stopping:
+                log.error("Worker exited, restarting", extra={
+                    "worker": index, "pid": pid, "status": os.waitstatus_to_exitcode(status)
+                })
+                # Back off a little when a worker dies right after starting
+                if time.monotonic() - started < 5:
+                    time.sleep(1)
+                spawn(index)
+            continue
+
+        now = time.monotonic()
+        if stopping:
+            stop_deadline = stop_deadline or now + args.graceful_timeout + 5
+            if now > stop_deadline:
+                log.warning(f"Killing {len(workers)} workers that did not stop in time")
+                for pid in workers:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+        elif args.memory_report_s and now >= next_report:
+            next_report = now + args.memory_report_s
+            total_pss = process_memory().get("pss", 0)
+            for pid, (index, _) in sorted(workers.items(), key=lambda item: item[1][0]):
+                memory = process_memory(pid)
+                total_pss += memory.get("pss", 0)
+                log.info("Worker memory", extra={"worker": index, "pid": pid,
+                                                 **{f"{k}_mb": round(v / 2**20, 1) for k, v in memory.items()}})
+            log.info("Total memory", extra={"pss_mb": round(total_pss / 2**20, 1), "workers": len(workers)})
+        time.sleep(0.2)
+
+    sock.close()
+    log.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
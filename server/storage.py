@@ -0,0 +1,442 @@
+"""
+Storage backends for the tables the API reads and writes: profiles, patients,
+ecg_devices, ecg_readings and mri_scans.
+
+SupabaseStorage runs every call as PostgREST queries on the pooled async
+SupabaseDB. SQLiteStorage keeps the same tables in a local SQLite file (WAL,
+keyset index on patient_id/timestamp/id), so the server can be profiled end
+to end offline or run at an edge site with no cloud dependency. main.py picks
+one from STORAGE_BACKEND. Both return plain row dicts shaped like PostgREST
+responses (None when a single row is not found).
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from ecg_query import decode_cursor, keyset_filter
+
+
+class SupabaseStorage:
+    def __init__(self, db):
+        self.db = db
+
+    async def _first(self, query):
+        resp = await self.db.execute(query.limit(1))
+        return resp.data[0] if resp.data else None
+
+    # profiles
+
+    async def get_profile_by_email(self, email):
+        return await self._first(self.db.table("profiles").select("*").eq("email", email))
+
+    async def list_profiles_by_email(self, email):
+        resp = await self.db.execute(self.db.table("profiles").select("*").eq("email", email))
+        return resp.data or []
+
+    async def list_patient_profiles(self, limit, offset):
+        """One page of patient profiles, each with its patient_id (or None), plus the total count."""
+        # patients has two foreign keys to profiles, so the embed names the user_id one
+        resp = await self.db.execute(
+            self.db.table("profiles")
+            .select("id, email, full_name, role, patients!user_id(id)", count="exact")
+            .eq("role", "patient")
+            .order("email")
+            .order("id")
+            .range(offset, offset + limit - 1)
+        )
+        rows = []
+        for profile in resp.data or []:
+            patients = profile.pop("patients", None)
+            rows.append({**profile, "patient_id": patients[0]["id"] if patients else None})
+        return rows, resp.count
+
+    # patients
+
+    async def get_patient_by_user(self, user_id):
+        return await self._first(self.db.table("patients").select("*").eq("user_id", user_id))
+
+    async def list_patients_by_user(self, user_id):
+        resp = await self.db.execute(self.db.table("patients").select("*").eq("user_id", user_id))
+        return resp.data or []
+
+    async def create_patient(self, row):
+        resp = await self.db.execute(self.db.table("patients").insert(row))
+        return resp.data[0] if resp.data else None
+
+    # ecg_devices
+
+    async def get_device(self, patient_id, device_id):
+        return await self._first(self.db.table("ecg_devices").select("*").eq("patient_id", patient_id).eq("device_id", device_id))
+
+    async def list_devices(self, patient_id):
+        resp = await self.db.execute(self.db.table("ecg_devices").select("*").eq("patient_id", patient_id))
+        return resp.data or []
+
+    async def save_device(self, patient_id, device_id, fields):
+        """Update the patient's device if it exists, otherwise create it; returns the stored row."""
+        if await self.get_device(patient_id, device_id):
+            resp = await self.db.execute(
+                self.db.table("ecg_devices").update(fields).eq("device_id", device_id).eq("patient_id", patient_id)
+            )
+        else:
+            resp = await self.db.execute(
+                self.db.table("ecg_devices").insert({"device_id": device_id, "patient_id": patient_id, **fields})
+            )
+        return resp.data[0] if resp.data else None
+
+    # ecg_readings
+
+    async def insert_readings(self, rows):
+        resp = await self.db.execute(self.db.table("ecg_readings").insert(rows))
+        return resp.data or []
+
+    async def query_readings(self, patient_id, columns=("*",), since=None, until=None, cursor=None, limit=100, descending=True):
+        """A keyset page of readings ordered by (timestamp, id); cursor continues after a previous page."""
+        query = self.db.table("ecg_readings").select(",".join(columns)).eq("patient_id", patient_id)
+        if since:
+            query = query.gte("timestamp", since)
+        if until:
+            query = query.lt("timestamp", until)
+        if cursor:
+            query = query.or_(keyset_filter(cursor, descending=descending))
+        resp = await self.db.execute(query.order("timestamp", desc=descending).order("id", desc=descending).limit(limit))
+        return resp.data or []
+
+    async def reading_buckets(self, patient_id, since, until, bucket_seconds):
+        resp = await self.db.execute(self.db.rpc("ecg_readings_buckets", {
+            "p_patient_id": patient_id,
+            "p_since": since,
+            "p_until": until,
+            "p_bucket_seconds": bucket_seconds
+        }))
+        return resp.data or []
+
+    # mri_scans
+
+    async def insert_mri_scan(self, row):
+        resp = await self.db.execute(self.db.table("mri_scans").insert(row))
+        return resp.data[0] if resp.data else None
+
+    async def list_mri_scans(self, patient_id, limit=20):
+        """Newest first."""
+        resp = await self.db.execute(
+            self.db.table("mri_scans").select("*").eq("patient_id", patient_id).order("created_at", desc=True).order("id", desc=True).limit(limit)
+        )
+        return resp.data or []
+
+    async def close(self):
+        await self.db.close()
+
+    def snapshot(self):
+        return {"backend": "supabase", **self.db.snapshot()}
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    full_name TEXT,
+    role TEXT NOT NULL DEFAULT 'patient',
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_profiles_email ON profiles (email);
+CREATE INDEX IF NOT EXISTS idx_profiles_role_email ON profiles (role, email, id);
+
+CREATE TABLE IF NOT EXISTS patients (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    date_of_birth TEXT,
+    gender TEXT,
+    phone_number TEXT,
+    medical_history TEXT,
+    assigned_doctor_id TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_patients_user_id ON patients (user_id);
+
+CREATE TABLE IF NOT EXISTS ecg_devices (
+    id TEXT PRIMARY KEY,
+    device_id TEXT NOT NULL,
+    patient_id TEXT NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    device_name TEXT,
+    is_active INTEGER DEFAULT 1,
+    last_sync TEXT,
+    battery_level INTEGER,
+    created_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ecg_devices_patient_device ON ecg_devices (patient_id, device_id);
+
+CREATE TABLE IF NOT EXISTS ecg_readings (
+    id TEXT PRIMARY KEY,
+    device_id TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    heart_rate INTEGER NOT NULL,
+    temperature REAL,
+    ecg_data TEXT,
+    signal_quality INTEGER,
+    battery_level INTEGER,
+    activity_level TEXT,
+    anomaly_detected INTEGER DEFAULT 0,
+    anomaly_type TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ecg_readings_patient_timestamp_id ON ecg_readings (patient_id, timestamp DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS mri_scans (
+    id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    uploaded_by TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    file_size INTEGER,
+    scan_type TEXT,
+    scan_date TEXT,
+    ai_analysis_result TEXT,
+    ai_confidence_score REAL,
+    doctor_notes TEXT,
+    status TEXT DEFAULT 'pending',
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mri_scans_patient_created ON mri_scans (patient_id, created_at DESC);
+"""
+
+# Columns stored as TEXT/INTEGER in SQLite that PostgREST would return as JSON or booleans
+JSON_COLUMNS = {"ecg_data", "ai_analysis_result"}
+BOOL_COLUMNS = {"is_active", "anomaly_detected"}
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _utc(ts):
+    """Normalize an ISO timestamp to UTC so stored timestamps compare correctly as text."""
+    parsed = datetime.fromisoformat(ts)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+class SQLiteStorage:
+    """
+    Local storage in one SQLite file. All statements run on a single dedicated
+    thread, so the event loop never blocks and the one connection needs no locking.
+    The connection is opened on that thread by the first query, so creating the
+    object starts no thread and a process may create it and then fork (serve.py).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = None
+        self._columns = {}
+        self.stats = {"queries": 0, "errors": 0, "total_ms": 0.0}
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SQLITE_SCHEMA)
+        for table in ("profiles", "patients", "ecg_devices", "ecg_readings", "mri_scans"):
+            self._columns[table] = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+
+    def _call(self, fn, *args):
+        if self._conn is None:
+            self._open()
+        return fn(*args)
+
+    async def _run(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn, *args)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["queries"] += 1
+            self.stats["total_ms"] += (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    def _decode(row):
+        out = dict(row)
+        for key in JSON_COLUMNS & out.keys():
+            if out[key] is not None:
+                out[key] = json.loads(out[key])
+        for key in BOOL_COLUMNS & out.keys():
+            if out[key] is not None:
+                out[key] = bool(out[key])
+        return out
+
+    def _encode(self, table, row):
+        row = {"id": str(uuid.uuid4()), "created_at": _now(), **row}
+        unknown = set(row) - set(self._columns[table])
+        if unknown:
+            raise ValueError(f"Unknown columns for {table}: {', '.join(sorted(unknown))}")
+        for key, value in row.items():
+            if value == "now()":
+                row[key] = _now()
+            elif key in JSON_COLUMNS and value is not None:
+                row[key] = json.dumps(value)
+        return row
+
+    def _select(self, sql, params=()):
+        return [self._decode(row) for row in self._conn.execute(sql, params)]
+
+    def _select_one(self, sql, params=()):
+        rows = self._select(sql + " LIMIT 1", params)
+        return rows[0] if rows else None
+
+    def _insert(self, table, rows):
+        encoded = [self._encode(table, row) for row in rows]
+        with self._conn:
+            for row in encoded:
+                columns = ", ".join(row)
+                placeholders = ", ".join("?" for _ in row)
+                self._conn.execute(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", tuple(row.values()))
+        return [self._decode(row) for row in encoded]
+
+    # profiles
+
+    async def create_profile(self, row):
+        """Local deployments have no Supabase Auth; profiles are created directly."""
+        return await self._run(lambda: self._insert("profiles", [row])[0])
+
+    async def get_profile_by_email(self, email):
+        return await self._run(self._select_one, "SELECT * FROM profiles WHERE email = ?", (email,))
+
+    async def list_profiles_by_email(self, email):
+        return await self._run(self._select, "SELECT * FROM profiles WHERE email = ?", (email,))
+
+    async def list_patient_profiles(self, limit, offset):
+        def query():
+            rows = self._select(
+                "SELECT p.id, p.email, p.full_name, p.role,"
+                " (SELECT pt.id FROM patients pt WHERE pt.user_id = p.id LIMIT 1) AS patient_id"
+                " FROM profiles p WHERE p.role = 'patient' ORDER BY p.email, p.id LIMIT ? OFFSET ?",
+                (limit, offset),
+            )
+            total = self._conn.execute("SELECT COUNT(*) FROM profiles WHERE role = 'patient'").fetchone()[0]
+            return rows, total
+        return await self._run(query)
+
+    # patients
+
+    async def get_patient_by_user(self, user_id):
+        return await self._run(self._select_one, "SELECT * FROM patients WHERE user_id = ?", (user_id,))
+
+    async def list_patients_by_user(self, user_id):
+        return await self._run(self._select, "SELECT * FROM patients WHERE user_id = ?", (user_id,))
+
+    async def create_patient(self, row):
+        return await self._run(lambda: self._insert("patients", [row])[0])
+
+    # ecg_devices
+
+    async def get_device(self, patient_id, device_id):
+        return await self._run(self._select_one, "SELECT * FROM ecg_devices WHERE patient_id = ? AND device_id = ?", (patient_id, device_id))
+
+    async def list_devices(self, patient_id):
+        return await self._run(self._select, "SELECT * FROM ecg_devices WHERE patient_id = ?", (patient_id,))
+
+    async def save_device(self, patient_id, device_id, fields):
+        def upsert():
+            existing = self._select_one("SELECT * FROM ecg_devices WHERE patient_id = ? AND device_id = ?", (patient_id, device_id))
+            if existing is None:
+                return self._insert("ecg_devices", [{"device_id": device_id, "patient_id": patient_id, **fields}])[0]
+            changes = self._encode("ecg_devices", fields)
+            changes.pop("id")
+            changes.pop("created_at")
+            assignments = ", ".join(f"{column} = ?" for column in changes)
+            with self._conn:
+                self._conn.execute(f"UPDATE ecg_devices SET {assignments} WHERE id = ?", (*changes.values(), existing["id"]))
+            return self._select_one("SELECT * FROM ecg_devices WHERE id = ?", (existing["id"],))
+        return await self._run(upsert)
+
+    # ecg_readings
+
+    async def insert_readings(self, rows):
+        # Timestamps are compared as text, so store them normalized to UTC
+        rows = [{**row, "timestamp": _utc(row["timestamp"])} for row in rows]
+        return await self._run(self._insert, "ecg_readings", rows)
+
+    async def query_readings(self, patient_id, columns=("*",), since=None, until=None, cursor=None, limit=100, descending=True):
+        if columns != ["*"] and columns != ("*",):
+            if not self._columns:
+                # Column names are read when the connection opens
+                await self._run(lambda: None)
+            unknown = set(columns) - set(self._columns["ecg_readings"])
+            if unknown:
+                raise ValueError(f"Unknown columns for ecg_readings: {', '.join(sorted(unknown))}")
+        sql = f"SELECT {', '.join(columns)} FROM ecg_readings WHERE patient_id = ?"
+        params = [patient_id]
+        if since:
+            sql += " AND timestamp >= ?"
+            params.append(_utc(since))
+        if until:
+            sql += " AND timestamp < ?"
+            params.append(_utc(until))
+        if cursor:
+            timestamp, row_id = decode_cursor(cursor)
+            op = "<" if descending else ">"
+            sql += f" AND (timestamp {op} ? OR (timestamp = ? AND id {op} ?))"
+            params += [timestamp, timestamp, row_id]
+        direction = "DESC" if descending else "ASC"
+        sql += f" ORDER BY timestamp {direction}, id {direction} LIMIT ?"
+        params.append(limit)
+        return await self._run(self._select, sql, tuple(params))
+
+    async def reading_buckets(self, patient_id, since, until, bucket_seconds):
+        # Same columns as the ecg_readings_buckets SQL function, bucketed from the Unix epoch
+        def query():
+            rows = self._select(
+                "SELECT (CAST(strftime('%s', timestamp) AS INTEGER) / ?) * ? AS bucket_epoch,"
+                " COUNT(*) AS readings,"
+                " MIN(heart_rate) AS heart_rate_min, MAX(heart_rate) AS heart_rate_max,"
+                " ROUND(AVG(heart_rate), 1) AS heart_rate_avg,"
+                " MIN(temperature) AS temperature_min, MAX(temperature) AS temperature_max,"
+                " ROUND(AVG(temperature), 2) AS temperature_avg,"
+                " SUM(anomaly_detected) AS anomalies"
+                " FROM ecg_readings WHERE patient_id = ? AND timestamp >= ? AND timestamp < ?"
+                " GROUP BY bucket_epoch ORDER BY bucket_epoch",
+                (bucket_seconds, bucket_seconds, patient_id, _utc(since), _utc(until)),
+            )
+            for row in rows:
+                row["bucket"] = datetime.fromtimestamp(row.pop("bucket_epoch"), timezone.utc).isoformat()
+            return rows
+        return await self._run(query)
+
+    # mri_scans
+
+    async def insert_mri_scan(self, row):
+        return await self._run(lambda: self._insert("mri_scans", [row])[0])
+
+    async def list_mri_scans(self, patient_id, limit=20):
+        return await self._run(
+            self._select, "SELECT * FROM mri_scans WHERE patient_id = ? ORDER BY created_at DESC, id DESC LIMIT ?", (patient_id, limit)
+        )
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    def snapshot(self):
+        queries = self.stats["queries"]
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "queries": queries,
+            "errors": self.stats["errors"],
+            "avg_ms": round(self.stats["total_ms"] / queries, 2) if queries else 0.0,
+        }
@@ -0,0 +1,270 @@
+"""
+Metrics and logging for the backend.
+
+MetricsRegistry keeps counters, histograms and callback gauges in process
+and renders them in the Prometheus text format for GET /metrics, so any
+Prometheus-compatible scraper works without a client library. Updates take
+a per-metric lock and cost a dict lookup plus a bisect, so they are cheap
+enough for the ECG hot path and safe from the inference threads.
+
+MetricsMiddleware is a plain ASGI middleware (it does not buffer bodies, so
+SSE and file responses stream as before). It counts requests and times them
+per route template, e.g. /ecg-data/{patient_id}, never per raw path.
+
+configure_logging() replaces the print-based [INFO]/[DEBUG] lines with
+stdlib logging: leveled by LOG_LEVEL, one line per event with key=value
+fields (or JSON), and sampled. A record logged with extra={"sample": 0.01}
+is emitted for ~1% of calls, which keeps per-reading events affordable.
+
+process_memory() splits a process's resident memory into shared and private
+pages, which is what tells forked workers (serve.py) apart from copies.
+"""
+
+import bisect
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, key)} {_num(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, key, [('le', _num(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {_num(total)}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Value read at scrape time from a component's own stats; fn returns a number,
+    or a dict of label-value tuple -> number. kind is "gauge" or "counter".
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.getLogger("medipulse.telemetry").warning(f"Metric callback {self.name} failed: {e}")
+            return lines
+        values = value if isinstance(value, dict) else {(): value}
+        for key, v in sorted(values.items()):
+            if v is not None:
+                lines.append(f"{self.name}{_label_str(self.labels, key)} {_num(v)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        return self._add(CallbackMetric(name, help, fn, labels))
+
+    def counter_callback(self, name, help, fn, labels=()):
+        return self._add(CallbackMetric(name, help, fn, labels, kind="counter"))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, requests, latency, slow_request_s=None):
+        # requests: Counter(method, route, status); latency: Histogram(method, route)
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.slow_request_s = slow_request_s
+        self.log = logging.getLogger("medipulse.http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            # The router leaves the matched route in the shared scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.requests.inc(method=scope["method"], route=route, status=status)
+            self.latency.observe(elapsed, method=scope["method"], route=route)
+            if self.slow_request_s is not None and elapsed >= self.slow_request_s:
+                self.log.warning("Slow request", extra={"method": scope["method"], "route": route,
+                                                        "status": status, "ms": round(elapsed * 1000)})
+
+
+def process_memory(pid="self"):
+    """
+    Resident memory of a process in bytes: rss, pss (shared pages split between
+    the processes mapping them), and the shared/private parts of rss. Linux only;
+    {} where /proc/<pid>/smaps_rollup is unavailable.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if rest.strip().endswith("kB"):
+                    fields[name] = int(rest.split()[0]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+# LogRecord attributes that are not user fields
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record):
+        rate = getattr(record, "sample", 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+        if self.json_lines:
+            entry = {"ts": ts, "level": record.levelname, "logger": record.name, "msg": record.getMessage(), **fields}
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = f"{ts} [{record.levelname}] {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={json.dumps(v, default=str) if isinstance(v, str) and ' ' in v else v}"
+                                   for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level="INFO", fmt="text"):
+    """Route the "medipulse" logger tree to stdout with sampling and structured fields"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(StructuredFormatter(json_lines=fmt == "json"))
+    handler.addFilter(SamplingFilter())
+    root = logging.getLogger("medipulse")
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    root.propagate = False
+    return root
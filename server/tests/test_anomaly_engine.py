@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from anomaly_engine import AnomalyEngine, Rule
+
+
+def reading(heart_rate=72, **extra):
+    return {
+        "heart_rate": heart_rate,
+        "rr_interval": 830,
+        "temperature": 98.6,
+        "qrs_duration": 90,
+        "heart_rate_variability": 40,
+        "st_segment": 0.02,
+        **extra,
+    }
+
+
+def random_readings(count, patients, seed):
+    rng = random.Random(seed)
+    ids, readings = [], []
+    for _ in range(count):
+        ids.append(f"p{rng.randrange(patients)}")
+        readings.append(reading(
+            heart_rate=rng.choice([rng.randint(60, 90), rng.randint(100, 140), rng.randint(40, 58)]),
+            temperature=round(rng.uniform(97, 102), 1),
+            st_segment=rng.uniform(0, 0.15),
+            heart_rate_variability=rng.randint(10, 60),
+        ))
+    return ids, readings
+
+
+def window_state(engine):
+    return {
+        pid: ({spec: [round(v, 9) for v in w.ordered()] for spec, w in state.windows.items()},
+              {rule.name: n for rule, n in state.counters.items()})
+        for pid, state in engine._states.items()
+    }
+
+
+def test_instantaneous_rules():
+    engine = AnomalyEngine()
+    assert engine.evaluate("p", reading()) == []
+    found = engine.evaluate("p", reading(heart_rate=130, st_segment=0.2, temperature=101.2))
+    assert {"Abnormal Heart Rate", "ST Segment Elevation", "Fever"} <= set(found)
+
+
+def test_sustained_rule_needs_consecutive_readings():
+    engine = AnomalyEngine()
+    hits = [("Sustained Tachycardia" in engine.evaluate("p", reading(heart_rate=110))) for _ in range(10)]
+    assert hits == [False] * 9 + [True]
+    engine.evaluate("p", reading())
+    assert "Sustained Tachycardia" not in engine.evaluate("p", reading(heart_rate=110))
+
+
+def test_sudden_change_after_a_stable_window():
+    engine = AnomalyEngine()
+    for _ in range(30):
+        assert "Sudden Heart Rate Change" not in engine.evaluate("p", reading())
+    assert "Sudden Heart Rate Change" in engine.evaluate("p", reading(heart_rate=95))
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_batch_matches_streaming(seed):
+    ids, readings = random_readings(600, patients=7, seed=seed)
+    streamed = AnomalyEngine()
+    batched = AnomalyEngine()
+    expected = [streamed.evaluate(pid, r) for pid, r in zip(ids, readings)]
+    got = []
+    # Uneven batches so state carries across batch boundaries
+    for start, end in [(0, 1), (1, 50), (50, 51), (51, 333), (333, 600)]:
+        got.extend(batched.evaluate_batch(ids[start:end], readings[start:end]))
+    assert got == expected
+    assert window_state(batched) == window_state(streamed)
+
+
+def test_late_reading_leaves_state_alone():
+    engine = AnomalyEngine()
+    for _ in range(30):
+        engine.evaluate("p", reading())
+    before = window_state(engine)
+    found = engine.evaluate_late(reading(heart_rate=130))
+    assert found == ["Abnormal Heart Rate"]
+    assert window_state(engine) == before
+
+
+def test_patient_state_is_bounded():
+    engine = AnomalyEngine(max_patients=2)
+    for pid in ("a", "b", "a", "c"):
+        engine.evaluate(pid, reading())
+    assert set(engine._states) == {"a", "c"}
+    assert engine.snapshot()["evicted"] == 1
+
+
+def test_rule_is_abstract():
+    with pytest.raises(TypeError):
+        Rule()
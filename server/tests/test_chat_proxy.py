@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from chat_proxy import ChatUpstreamError, GeminiChat
+from inference import PoolSaturatedError
+
+
+def answer(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def client(handler, **kwargs):
+    return GeminiChat("key", transport=httpx.MockTransport(handler), **kwargs)
+
+
+async def collect(chat):
+    return [chunk async for chunk in chat.stream("", "hi")]
+
+
+def test_complete_caches_answers():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=answer("hello"))
+
+    async def scenario():
+        chat = client(handler)
+        assert await chat.complete("ctx", "hi") == ("hello", False)
+        assert await chat.complete("ctx", "hi") == ("hello", True)
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
+
+
+def test_stream_yields_sse_chunks():
+    def handler(request):
+        body = "".join(f"data: {chunk}\n\n" for chunk in ('{"candidates":[{"content":{"parts":[{"text":"a"}]}}]}',
+                                                         '{"candidates":[{"content":{"parts":[{"text":"b"}]}}]}'))
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+    async def scenario():
+        chat = client(handler)
+        assert await collect(chat) == ["a", "b"]
+        assert await collect(chat) == ["ab"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("handler", [
+    lambda request: (_ for _ in ()).throw(httpx.ConnectError("refused", request=request)),
+    lambda request: (_ for _ in ()).throw(httpx.ReadTimeout("stalled", request=request)),
+    lambda request: httpx.Response(200, content=b"not json"),
+    lambda request: httpx.Response(500, json={"error": {"message": "boom"}}),
+])
+def test_upstream_failures_become_chat_upstream_error(handler):
+    async def scenario():
+        chat = client(handler)
+        with pytest.raises(ChatUpstreamError):
+            await chat.complete("", "hi")
+        assert chat.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_stream_transport_failure_becomes_chat_upstream_error():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    async def scenario():
+        chat = client(handler)
+        with pytest.raises(ChatUpstreamError):
+            await collect(chat)
+        assert chat.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_capacity_check():
+    chat = client(lambda request: httpx.Response(200, json=answer("x")), max_concurrent=1, max_waiting=0)
+    chat.active = 1
+    with pytest.raises(PoolSaturatedError):
+        chat.check_capacity()
@@ -0,0 +1,45 @@
+from device_cache import DeviceCache, TTLCache
+
+
+def test_hit_miss_and_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("device_cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    assert cache.get("p") is None
+    cache.set("p", "device")
+    assert cache.get("p") == "device"
+    now[0] += 11
+    assert cache.get("p") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_set_refreshes_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("device_cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.set("p", 1)
+    now[0] += 8
+    cache.set("p", 1)
+    now[0] += 8
+    assert cache.get("p") == 1
+
+
+def test_lru_eviction():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.snapshot()["evictions"] == 1
+
+
+def test_invalidate_and_clear():
+    cache = DeviceCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert cache.get("a") is None and cache.get("b") == 2
+    cache.clear()
+    assert cache.snapshot()["entries"] == 0
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from ecg_ingest import BufferFullError, ECGWriteBuffer
+from ecg_sequence import DUPLICATE, NEW, SequenceTracker
+
+
+class FlakyInsert:
+    """Records inserted chunks; fails the first `failures` calls."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.chunks = []
+
+    async def __call__(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database down")
+        self.chunks.append(list(rows))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_flush_writes_in_chunks():
+    async def scenario():
+        insert = FlakyInsert()
+        buffer = ECGWriteBuffer(insert, flush_rows=2)
+        await buffer.add([1, 2, 3, 4, 5])
+        assert await buffer.flush() == 5
+        assert insert.chunks == [[1, 2], [3, 4], [5]]
+        assert buffer.pending == 0
+
+    run(scenario())
+
+
+def test_failed_flush_requeues_in_order():
+    async def scenario():
+        insert = FlakyInsert(failures=1)
+        buffer = ECGWriteBuffer(insert, flush_rows=2)
+        await buffer.add([1, 2, 3])
+        assert await buffer.flush() == 0
+        await buffer.add([4])
+        assert await buffer.flush() == 4
+        assert [row for chunk in insert.chunks for row in chunk] == [1, 2, 3, 4]
+        assert buffer.stats["failed_flushes"] == 1
+
+    run(scenario())
+
+
+def test_requeue_drops_what_exceeds_the_bound():
+    async def scenario():
+        async def insert(rows):
+            # New readings arrive while the failing insert is in flight
+            await buffer.add([8, 9])
+            raise RuntimeError("database down")
+
+        buffer = ECGWriteBuffer(insert, flush_rows=10, max_rows=3)
+        await buffer.add([1, 2, 3])
+        await buffer.flush()
+        assert buffer._rows == [1, 8, 9]
+        assert buffer.stats["dropped"] == 2
+
+    run(scenario())
+
+
+
+def test_dropped_rows_release_their_seqs_for_retry():
+    async def scenario():
+        tracker = SequenceTracker(window=64)
+
+        def forget(rows):
+            for row in rows:
+                tracker.discard(row["device_id"], row["seq"])
+
+        async def insert(rows):
+            # The buffer fills up behind the failing insert
+            await buffer.add([{"device_id": "dev", "seq": 9}])
+            raise RuntimeError("database down")
+
+        buffer = ECGWriteBuffer(insert, flush_rows=10, max_rows=2, on_drop=forget)
+        for seq in (1, 2):
+            assert tracker.check("dev", seq) == NEW
+            tracker.confirm("dev", seq)
+        await buffer.add([{"device_id": "dev", "seq": 1}, {"device_id": "dev", "seq": 2}])
+        await buffer.flush()
+        assert [row["seq"] for row in buffer._rows] == [1, 9]
+        # Seq 2 was lost, so the device's retry is taken; seq 1 is still queued and stays a duplicate
+        assert tracker.check("dev", 2) != DUPLICATE
+        assert tracker.check("dev", 1) == DUPLICATE
+
+    run(scenario())
+
+def test_add_is_all_or_nothing_when_full():
+    async def scenario():
+        buffer = ECGWriteBuffer(FlakyInsert(), max_rows=3)
+        await buffer.add([1, 2])
+        with pytest.raises(BufferFullError):
+            await buffer.add([3, 4])
+        assert buffer.pending == 2
+        assert buffer.stats["rejected"] == 2
+
+    run(scenario())
+
+
+def test_stop_flushes_and_refuses_new_rows():
+    async def scenario():
+        insert = FlakyInsert()
+        buffer = ECGWriteBuffer(insert, flush_rows=100, flush_interval=60)
+        await buffer.start()
+        await buffer.add([1, 2])
+        await buffer.stop()
+        assert insert.chunks == [[1, 2]]
+        with pytest.raises(BufferFullError):
+            await buffer.add([3])
+
+    run(scenario())
@@ -0,0 +1,56 @@
+import pytest
+
+from ecg_query import decode_cursor, encode_cursor, keyset_filter, lttb, parse_fields
+
+ROW = {"timestamp": "2025-06-29T10:00:00.123456+00:00", "id": "6ee3c3ea-a165-4a15-acb5-ca147992cb03"}
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(ROW)) == (ROW["timestamp"], ROW["id"])
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    encode_cursor({"timestamp": "yesterday", "id": "1"}),
+    encode_cursor({"timestamp": ROW["timestamp"], "id": ""}),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_keyset_filter_descending_and_ascending():
+    cursor = encode_cursor(ROW)
+    ts, key = f'"{ROW["timestamp"]}"', f'"{ROW["id"]}"'
+    assert keyset_filter(cursor) == f"timestamp.lt.{ts},and(timestamp.eq.{ts},id.lt.{key})"
+    assert keyset_filter(cursor, descending=False) == f"timestamp.gt.{ts},and(timestamp.eq.{ts},id.gt.{key})"
+
+
+def test_keyset_filter_quotes_hostile_ids():
+    cursor = encode_cursor({"timestamp": ROW["timestamp"], "id": 'x"),id.gt.(0'})
+    assert keyset_filter(cursor).endswith('id.lt."x\\"),id.gt.(0")')
+
+
+def test_parse_fields():
+    assert parse_fields(None) == ["*"]
+    assert parse_fields(" * ") == ["*"]
+    assert parse_fields("heart_rate") == ["heart_rate", "id", "timestamp"]
+    with pytest.raises(ValueError):
+        parse_fields("heart_rate,password")
+
+
+def test_lttb_passes_small_series_through():
+    points = [(i, i * i) for i in range(5)]
+    assert lttb(points, 10) == points
+    assert lttb(points, 2) == points
+
+
+def test_lttb_keeps_ends_peaks_and_extra_tuple_fields():
+    # (x, y, label) as /ecg-data passes them; the label must survive sampling
+    points = [(i, 70, f"t{i}") for i in range(1000)]
+    points[400] = (400, 180, "t400")
+    sampled = lttb(points, 50)
+    assert len(sampled) == 50
+    assert sampled[0] == points[0] and sampled[-1] == points[-1]
+    assert (400, 180, "t400") in sampled
+    assert [p[0] for p in sampled] == sorted(p[0] for p in sampled)
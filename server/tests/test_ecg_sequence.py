@@ -0,0 +1,90 @@
+import asyncio
+
+from ecg_sequence import DUPLICATE, LATE, NEW, RESET, SequenceTracker
+
+
+def test_new_duplicate_and_late():
+    tracker = SequenceTracker(window=64)
+    assert tracker.check("dev", 10) == NEW
+    assert tracker.check("dev", 10) == DUPLICATE
+    assert tracker.check("dev", 12) == NEW
+    assert tracker.check("dev", 11) == LATE
+    assert tracker.check("dev", 11) == DUPLICATE
+    assert tracker.check("dev", 10) == DUPLICATE
+
+
+def test_devices_are_independent():
+    tracker = SequenceTracker(window=64)
+    assert tracker.check("a", 1) == NEW
+    assert tracker.check("b", 1) == NEW
+
+
+def test_jump_past_the_window_forgets_older_numbers():
+    tracker = SequenceTracker(window=8)
+    tracker.check("dev", 1)
+    assert tracker.check("dev", 100) == NEW
+    # 95 is inside the window of the new mark and was never seen
+    assert tracker.check("dev", 95) == LATE
+
+
+def test_far_below_the_window_resets_the_device():
+    tracker = SequenceTracker(window=8)
+    tracker.check("dev", 1000)
+    assert tracker.check("dev", 1) == RESET
+    assert tracker.check("dev", 2) == NEW
+    assert tracker.check("dev", 1) == DUPLICATE
+
+
+def test_window_edge():
+    tracker = SequenceTracker(window=8)
+    tracker.check("dev", 20)
+    assert tracker.check("dev", 13) == LATE     # 7 below the mark: last bit of the window
+    assert tracker.check("dev", 12) == RESET    # 8 below: outside it
+
+
+def test_discard_lets_the_retry_in():
+    tracker = SequenceTracker(window=64)
+    tracker.check("dev", 5)
+    tracker.discard("dev", 5)
+    assert tracker.check("dev", 5) != DUPLICATE
+
+
+def test_least_recent_device_is_evicted():
+    tracker = SequenceTracker(window=64, max_devices=2)
+    tracker.check("a", 1)
+    tracker.check("b", 1)
+    tracker.check("a", 2)
+    tracker.check("c", 1)
+    assert tracker.snapshot()["evicted"] == 1
+    assert tracker.check("a", 2) == DUPLICATE
+    assert tracker.check("b", 1) == NEW
+
+
+def test_duplicate_waits_for_the_first_copy():
+    async def scenario():
+        tracker = SequenceTracker(window=64)
+        tracker.check("dev", 7)
+        assert tracker.check("dev", 7) == DUPLICATE
+        waiter = asyncio.create_task(tracker.stored("dev", 7))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        tracker.confirm("dev", 7)
+        assert await waiter is True
+        assert await tracker.stored("dev", 7) is True
+        assert tracker.snapshot()["pending"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_learns_when_the_first_copy_was_discarded():
+    async def scenario():
+        tracker = SequenceTracker(window=64)
+        tracker.check("dev", 7)
+        tracker.check("dev", 7)
+        waiter = asyncio.create_task(tracker.stored("dev", 7))
+        await asyncio.sleep(0)
+        tracker.discard("dev", 7)
+        assert await waiter is False
+        assert tracker.check("dev", 7) != DUPLICATE
+
+    asyncio.run(scenario())
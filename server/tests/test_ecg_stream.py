@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+from ecg_stream import ECGHub
+
+
+def test_ring_keeps_the_latest_readings():
+    hub = ECGHub(ring_size=3)
+    for i in range(5):
+        hub.publish("p", {"i": i})
+    stream = hub.get("p")
+    assert stream.latest(10) == [{"i": 4}, {"i": 3}, {"i": 2}]
+    assert [seq for seq, _ in stream.since(3)] == [4, 5]
+    # Older than the ring: only what is still held
+    assert [json.loads(m)["data"]["i"] for _, m in stream.since(0)] == [2, 3, 4]
+
+
+def test_waiters_wake_on_publish():
+    async def scenario():
+        hub = ECGHub()
+        stream = hub.stream("p")
+        waiters = [asyncio.create_task(stream.wait(0)) for _ in range(3)]
+        await asyncio.sleep(0)
+        waiters[0].cancel()
+        hub.publish("p", {"i": 1})
+        await asyncio.gather(*waiters[1:])
+
+    asyncio.run(scenario())
+
+
+def test_get_does_not_create_streams():
+    hub = ECGHub()
+    assert hub.get("p") is None
+    assert hub.snapshot()["patients"] == 0
+
+
+def test_idle_unwatched_streams_are_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("ecg_stream.time.monotonic", lambda: now[0])
+    hub = ECGHub(idle_ttl=60)
+    hub.publish("idle", {})
+    hub.publish("watched", {})
+    hub.get("watched").subscribers += 1
+    now[0] += 61
+    hub.publish("active", {})
+    assert hub.get("idle") is None
+    assert hub.get("watched") is not None
+    assert hub.snapshot()["evicted"] == 1
+
+
+def test_stream_count_is_bounded():
+    hub = ECGHub(max_patients=2)
+    for pid in ("a", "b", "c"):
+        hub.publish(pid, {})
+    assert hub.snapshot()["patients"] == 2
+    assert hub.get("a") is None
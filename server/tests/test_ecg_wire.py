@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ecg_wire import HEADER, MAX_COUNT, RECORD, decode_frames, encode_frames
+
+
+def reading(i=0, **extra):
+    return {
+        "heart_rate": 60 + i % 40,
+        "rr_interval": 800 + i,
+        "temperature": 98.6,
+        "qrs_duration": 90,
+        "heart_rate_variability": 40,
+        "st_segment": 0.012,
+        **extra,
+    }
+
+
+def test_round_trip_with_seq_and_timestamps():
+    start = datetime(2025, 6, 29, 10, 0, tzinfo=timezone.utc)
+    readings = [reading(i, seq=100 + i, timestamp=(start + timedelta(milliseconds=250 * i)).isoformat()) for i in range(20)]
+    body = encode_frames(readings)
+    assert len(body) == HEADER.size + 20 * RECORD.itemsize
+
+    decoded = decode_frames(body)
+    assert [r["seq"] for r in decoded] == list(range(100, 120))
+    assert decoded[5]["timestamp"] == start + timedelta(milliseconds=1250)
+    assert decoded[3]["heart_rate"] == 63
+    assert decoded[3]["temperature"] == pytest.approx(98.6)
+    assert decoded[3]["st_segment"] == pytest.approx(0.012)
+
+
+def test_round_trip_without_optional_fields():
+    decoded = decode_frames(encode_frames([reading(i) for i in range(3)]))
+    assert len(decoded) == 3
+    assert "seq" not in decoded[0] and "timestamp" not in decoded[0]
+
+
+def test_new_frame_when_a_delta_does_not_fit():
+    readings = [reading(0, seq=1), reading(1, seq=2), reading(2, seq=2 + 0x100), reading(3, seq=3 + 0x100)]
+    body = encode_frames(readings)
+    assert len(body) == 2 * HEADER.size + 4 * RECORD.itemsize
+    assert [r["seq"] for r in decode_frames(body)] == [1, 2, 258, 259]
+
+
+def test_new_frame_when_optional_fields_change():
+    body = encode_frames([reading(0, seq=1), reading(1)])
+    assert len(body) == 2 * HEADER.size + 2 * RECORD.itemsize
+    first, second = decode_frames(body)
+    assert first["seq"] == 1 and "seq" not in second
+
+
+def test_count_limit_splits_frames():
+    body = encode_frames([reading(0)] * (MAX_COUNT + 1))
+    assert len(body) == 2 * HEADER.size + (MAX_COUNT + 1) * RECORD.itemsize
+
+
+def test_out_of_range_value_is_rejected():
+    with pytest.raises(ValueError):
+        encode_frames([reading(0, heart_rate=300)])
+    with pytest.raises(ValueError):
+        encode_frames([reading(0, seq=-1)])
+
+
+@pytest.mark.parametrize("body", [b"EF", b"XX" + bytes(HEADER.size), b"EF\x02" + bytes(HEADER.size)])
+def test_malformed_header_is_rejected(body):
+    with pytest.raises(ValueError):
+        decode_frames(body)
+
+
+def test_truncated_records_are_rejected():
+    body = encode_frames([reading(i) for i in range(4)])
+    with pytest.raises(ValueError):
+        decode_frames(body[:-1])
+
+
+def test_empty_body_decodes_to_nothing():
+    assert decode_frames(b"") == []
@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+
+from inference import InferencePool, MicroBatcher, PoolSaturatedError
+
+
+def test_check_capacity_matches_submit_rejection():
+    async def scenario():
+        pool = InferencePool(workers=1, max_queue=4, retry_after=3)
+        batcher = MicroBatcher(lambda items: items, pool, max_batch=1, max_wait_ms=1, max_pending=1)
+        # Before the first submit the queue does not exist yet; that is not saturation
+        batcher.check_capacity()
+        await batcher.start()
+        batcher._slots = asyncio.Semaphore(0)  # no worker ever frees up
+        await batcher._queue.put(("held", asyncio.get_running_loop().create_future()))
+        with pytest.raises(PoolSaturatedError) as info:
+            batcher.check_capacity()
+        assert info.value.retry_after == 3
+        with pytest.raises(PoolSaturatedError):
+            await batcher.submit("next")
+        assert batcher.stats["rejected"] == 2
+        await batcher.stop()
+        pool.shutdown()
+
+    asyncio.run(scenario())
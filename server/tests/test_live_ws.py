@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+# main reads its configuration at import; run it on a throwaway SQLite database without the model or the network
+os.environ.update({
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(tempfile.mkdtemp(prefix="medipulse_test_"), "test.db"),
+    "MODEL_LOAD_MODE": "off",
+    "LOG_LEVEL": "WARNING",
+})
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+main = pytest.importorskip("main")
+uvicorn = pytest.importorskip("uvicorn")
+websockets = pytest.importorskip("websockets")
+
+
+@pytest.fixture(scope="module")
+def server():
+    """A real uvicorn server, so a client going away looks the way it does in production"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    instance = uvicorn.Server(uvicorn.Config(main.app, log_config=None, access_log=False))
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(instance.serve(sockets=[sock]),), daemon=True)
+    thread.start()
+    assert wait_for(lambda: instance.started)
+    yield loop, f"ws://127.0.0.1:{port}"
+    instance.should_exit = True
+    thread.join(10)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_viewer_receives_readings_and_disconnect_releases_the_stream(server):
+    loop, base = server
+
+    async def viewer():
+        async with websockets.connect(f"{base}/ws/ecg/patient-ws") as ws:
+            assert json.loads(await ws.recv())["type"] == "snapshot"
+            assert main.ecg_hub.get("patient-ws").subscribers == 1
+            # Published on the server's loop, as an ingest request would
+            loop.call_soon_threadsafe(main.ecg_hub.publish, "patient-ws", {"heart_rate": 72})
+            message = json.loads(await asyncio.wait_for(ws.recv(), 5))
+            assert message["type"] == "reading" and message["data"] == {"heart_rate": 72}
+
+    asyncio.run(viewer())
+    # No reading is published after the close; the handler must still notice it
+    assert wait_for(lambda: main.ecg_hub.get("patient-ws").subscribers == 0)
@@ -0,0 +1,76 @@
+import base64
+
+import numpy as np
+import pytest
+
+from qrs_detect import WaveformAnalyzer, decode_int16
+
+FS = 500
+
+
+def synthesize_ecg(seconds, heart_rate, noise_mv=0.03, seed=0):
+    """Gaussian P-QRS-T beats at a fixed rate plus baseline wander and noise, in ADC counts. Returns (signal, beats)."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * FS)) / FS
+    signal = np.zeros_like(t)
+    # (offset s, width s, amplitude mV) for P, Q, R, S, T
+    waves = [(-0.2, 0.025, 0.15), (-0.03, 0.01, -0.1), (0.0, 0.012, 1.2), (0.03, 0.01, -0.25), (0.25, 0.04, 0.3)]
+    beats = np.arange(0.5, seconds - 0.3, 60.0 / heart_rate)
+    for beat in beats:
+        for offset, width, amplitude in waves:
+            signal += amplitude * np.exp(-((t - beat - offset) ** 2) / (2 * width ** 2))
+    signal += 0.15 * np.sin(2 * np.pi * 0.3 * t) + rng.normal(0, noise_mv, len(t))
+    return np.round(signal / 0.008), beats
+
+
+def stream(signal, chunk_s=2.0):
+    """Feed the analyzer upload-sized chunks; returns the per-chunk summaries that found beats."""
+    analyzer = WaveformAnalyzer(FS)
+    chunk = int(chunk_s * FS)
+    summaries = [analyzer.process(signal[i:i + chunk]) for i in range(0, len(signal), chunk)]
+    return [s for s in summaries if s]
+
+
+@pytest.mark.parametrize("heart_rate", [50, 72, 110, 150])
+def test_heart_rate_and_beat_count_at_known_rates(heart_rate):
+    signal, beats = synthesize_ecg(20, heart_rate)
+    summaries = stream(signal)
+    # A beat in the last few hundred ms of the final chunk is held back waiting for more samples
+    assert len(beats) - 1 <= sum(s["beats"] for s in summaries) <= len(beats)
+    for summary in summaries:
+        assert abs(summary["heart_rate"] - heart_rate) <= 3
+        assert abs(summary["rr_interval"] - 60000 / heart_rate) <= 10
+
+
+@pytest.mark.parametrize("chunk_s", [20, 2.0, 1.5, 1.0])
+def test_beats_across_chunk_boundaries_are_counted_once(chunk_s):
+    signal, beats = synthesize_ecg(20, 72)
+    # A chunk whose only beat has no predecessor summarizes to None, so count RR intervals rather than beats
+    intervals = [rr for s in stream(signal, chunk_s) for rr in s["rr_intervals"]]
+    assert len(intervals) == len(beats) - 1
+    assert all(abs(rr - 60000 / 72) <= 10 for rr in intervals)
+
+
+def test_noisy_signal_keeps_the_rate():
+    signal, _ = synthesize_ecg(20, 80, noise_mv=0.15, seed=1)
+    rates = [s["heart_rate"] for s in stream(signal)]
+    assert rates
+    assert abs(np.median(rates) - 80) <= 3
+
+
+def test_flat_signal_has_no_beats():
+    assert stream(np.zeros(10 * FS)) == []
+    assert stream(np.full(10 * FS, 512.0)) == []
+
+
+@pytest.mark.parametrize("samples", [0, 1, 2, 10, FS // 4])
+def test_too_short_signal_reports_nothing(samples):
+    assert WaveformAnalyzer(FS).process(np.arange(samples, dtype=np.float64)) is None
+
+
+def test_decode_int16_round_trips_and_rejects_odd_payloads():
+    samples = np.array([0, 1, -1, 32767, -32768], dtype="<i2")
+    assert decode_int16(base64.b64encode(samples.tobytes()).decode()).tolist() == samples.tolist()
+    assert decode_int16(samples.tobytes()).tolist() == samples.tolist()
+    with pytest.raises(ValueError):
+        decode_int16(b"\x00\x01\x02")
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import os
+
+from result_cache import ResultCache
+
+
+def test_key_depends_on_content_model_and_prompt():
+    key = ResultCache.make_key(b"scan", "model-a", 1)
+    assert key == ResultCache.make_key(b"scan", "model-a", 1)
+    assert key != ResultCache.make_key(b"scan2", "model-a", 1)
+    assert key != ResultCache.make_key(b"scan", "model-b", 1)
+    assert key != ResultCache.make_key(b"scan", "model-a", 2)
+
+
+def test_key_from_file_matches_and_rewinds():
+    data = os.urandom(3000)
+    f = io.BytesIO(data)
+    key, size = ResultCache.make_key_from_file(f, "m", 1, chunk_size=1024)
+    assert (key, size) == (ResultCache.make_key(data, "m", 1), 3000)
+    assert f.tell() == 0
+
+
+def test_memory_tier_is_lru_and_returns_copies():
+    cache = ResultCache(max_entries=2)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    cache.get("a")["v"] = 99
+    cache.set("c", {"v": 3})
+    assert cache.get("a") == {"v": 1}
+    assert cache.get("b") is None
+    assert cache.snapshot()["memory_hits"] == 2
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    ResultCache(disk_dir=str(tmp_path)).set("k", {"diagnosis": "normal"})
+    cache = ResultCache(disk_dir=str(tmp_path))
+    assert cache.get("k") == {"diagnosis": "normal"}
+    assert cache.get("k") == {"diagnosis": "normal"}
+    assert cache.snapshot()["disk_hits"] == 1
+    assert cache.snapshot()["memory_hits"] == 1
+
+
+def test_async_access_matches_sync(tmp_path):
+    async def scenario():
+        await ResultCache(disk_dir=str(tmp_path)).aset("k", {"diagnosis": "normal"})
+        cache = ResultCache(disk_dir=str(tmp_path))
+        assert await cache.aget("k") == {"diagnosis": "normal"}
+        assert await cache.aget("k") == {"diagnosis": "normal"}
+        assert await cache.aget("missing") is None
+        return cache.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert (snapshot["disk_hits"], snapshot["memory_hits"], snapshot["misses"]) == (1, 1, 1)
+
+
+def test_disk_tier_evicts_oldest_past_the_bound(tmp_path):
+    cache = ResultCache(max_entries=1, disk_dir=str(tmp_path), disk_max_bytes=200)
+    for i in range(10):
+        cache.set(f"k{i}", {"payload": "x" * 40})
+        os.utime(tmp_path / f"k{i}.json", (i, i))
+    assert cache.snapshot()["disk_bytes"] <= 200
+    assert cache.snapshot()["disk_evictions"] > 0
+    assert cache.get("k9") is not None
+    assert not (tmp_path / "k0.json").exists()
+
+
+def test_unreadable_disk_entry_is_dropped(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path))
+    (tmp_path / "bad.json").write_text("{not json")
+    assert cache.get("bad") is None
+    assert not (tmp_path / "bad.json").exists()
@@ -0,0 +1,43 @@
+-- Keyset index for the ECG history API: pages are ordered by (timestamp, id) within a patient
+CREATE INDEX IF NOT EXISTS idx_ecg_readings_patient_timestamp_id
+    ON public.ecg_readings (patient_id, "timestamp" DESC, id DESC);
+
+-- Server-side downsampling: min/max/avg per time bucket so multi-day charts
+-- transfer one row per bucket instead of every reading
+CREATE OR REPLACE FUNCTION public.ecg_readings_buckets(
+    p_patient_id UUID,
+    p_since TIMESTAMPTZ,
+    p_until TIMESTAMPTZ,
+    p_bucket_seconds INTEGER DEFAULT 60
+)
+RETURNS TABLE (
+    bucket TIMESTAMPTZ,
+    readings BIGINT,
+    heart_rate_min INTEGER,
+    heart_rate_max INTEGER,
+    heart_rate_avg NUMERIC,
+    temperature_min NUMERIC,
+    temperature_max NUMERIC,
+    temperature_avg NUMERIC,
+    anomalies BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        date_bin(make_interval(secs => p_bucket_seconds), r."timestamp", TIMESTAMPTZ '2000-01-01') AS bucket,
+        count(*) AS readings,
+        min(r.heart_rate) AS heart_rate_min,
+        max(r.heart_rate) AS heart_rate_max,
+        round(avg(r.heart_rate), 1) AS heart_rate_avg,
+        min(r.temperature) AS temperature_min,
+        max(r.temperature) AS temperature_max,
+        round(avg(r.temperature), 2) AS temperature_avg,
+        count(*) FILTER (WHERE r.anomaly_detected) AS anomalies
+    FROM public.ecg_readings r
+    WHERE r.patient_id = p_patient_id
+      AND r."timestamp" >= p_since
+      AND r."timestamp" < p_until
+    GROUP BY 1
+    ORDER BY 1;
+$$;
@@ -0,0 +1,4 @@
+-- Temperatures are stored in Fahrenheit; DECIMAL(4,2) tops out at 99.99, so every
+-- fever reading (the anomaly engine's "Fever" rule fires above 100.4) failed on insert
+ALTER TABLE public.ecg_readings
+ALTER COLUMN temperature TYPE DECIMAL(5,2);